@@ -1,13 +1,19 @@
 """API route definitions for the claim processing pipeline."""
 
 import logging
+import os
 import tempfile
+import time
 from pathlib import Path
 from typing import Any
 
-from fastapi import APIRouter, File, Form, HTTPException, UploadFile
+from fastapi import APIRouter, File, Form, Header, HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
 
+from app.graph.nodes.llm_client import circuit_retry_after, get_llm_stats
 from app.graph.workflow import run_claim_workflow
+from app.services.page_fingerprint import get_fingerprint_stats
+from app.services.page_rules import get_rule_stats
 from app.services.pdf_parser import extract_pages
 
 logger = logging.getLogger(__name__)
@@ -17,6 +23,10 @@ router = APIRouter()
 ALLOWED_CONTENT_TYPES: set[str] = {"application/pdf"}
 ALLOWED_EXTENSIONS: set[str] = {".pdf"}
 
+# Time budget per claim in seconds (0 disables); overridable per request
+# with the ``X-Request-Timeout`` header.
+CLAIM_DEADLINE_SECONDS = float(os.getenv("CLAIM_DEADLINE_SECONDS", "120"))
+
 
 def _validate_claim_id(claim_id: str) -> str:
     """Validate that claim_id is a non-empty string.
@@ -37,6 +47,32 @@ def _validate_claim_id(claim_id: str) -> str:
     return stripped
 
 
+def _resolve_deadline(timeout_header: str | None, started: float) -> float | None:
+    """Turn the request's time budget into a ``time.monotonic()`` deadline.
+
+    Args:
+        timeout_header: Value of the ``X-Request-Timeout`` header in
+            seconds, or ``None`` to use ``CLAIM_DEADLINE_SECONDS``.
+        started: ``time.monotonic()`` when the request arrived.
+
+    Returns:
+        The deadline, or ``None`` when no budget applies.
+
+    Raises:
+        HTTPException: If the header is not a positive number.
+    """
+    if timeout_header is None:
+        return started + CLAIM_DEADLINE_SECONDS if CLAIM_DEADLINE_SECONDS > 0 else None
+    try:
+        budget = float(timeout_header)
+    except ValueError:
+        budget = 0.0
+    if not budget > 0:
+        logger.warning("Invalid X-Request-Timeout header: %r", timeout_header)
+        raise HTTPException(status_code=400, detail="X-Request-Timeout must be a positive number of seconds.")
+    return started + budget
+
+
 def _validate_pdf(file: UploadFile) -> None:
     """Validate that the uploaded file is a PDF.
 
@@ -94,50 +130,76 @@ async def _save_to_tmp(file: UploadFile) -> Path:
 async def process_claim(
     claim_id: str = Form(..., description="Unique claim identifier"),
     file: UploadFile = File(..., description="PDF document to process"),
+    x_request_timeout: str | None = Header(None, description="Time budget for the claim in seconds"),
 ) -> dict[str, Any]:
     """Accept a claim PDF for processing.
 
     Validates the claim_id and uploaded file, persists the file to a
-    temporary location, and returns an acknowledgement response.
+    temporary location, and returns an acknowledgement response. PDF
+    parsing and the workflow are blocking, so they run on the thread
+    pool and the event loop keeps serving other requests. The
+    status is ``"partial"`` when some agents fell back to defaults
+    because the LLM backend was unavailable or the claim's time budget
+    ran out.
 
     Args:
         claim_id: Unique identifier for the claim.
         file: PDF file to be processed.
+        x_request_timeout: Optional time budget overriding
+            ``CLAIM_DEADLINE_SECONDS``.
 
     Returns:
         A dict containing the claim_id, filename, and processing status.
+
+    Raises:
+        HTTPException: 503 with ``Retry-After`` when the LLM circuit was
+            open during page classification.
     """
+    deadline = _resolve_deadline(x_request_timeout, time.monotonic())
     validated_claim_id = _validate_claim_id(claim_id)
     _validate_pdf(file)
     saved_path = await _save_to_tmp(file)
 
     # --- Phase 2: page-level text extraction ---
     try:
-        pages = extract_pages(str(saved_path))
+        pages = await run_in_threadpool(extract_pages, str(saved_path))
     except ValueError as exc:
         logger.warning("PDF extraction failed for claim %s: %s", validated_claim_id, exc)
         raise HTTPException(status_code=400, detail=str(exc)) from exc
 
     # --- Phase 3: LangGraph workflow ---
     try:
-        final_output = run_claim_workflow(validated_claim_id, pages)
+        final_output = await run_in_threadpool(run_claim_workflow, validated_claim_id, pages, deadline)
     except Exception as exc:
         logger.exception("Workflow failed for claim %s", validated_claim_id)
         raise HTTPException(
             status_code=500, detail="Claim processing workflow failed."
         ) from exc
 
+    degraded_nodes = final_output["processing_metadata"]["degraded_nodes"]
+    deadline_exceeded = final_output["processing_metadata"]["deadline_exceeded"]
+    if "segregator" in degraded_nodes and not deadline_exceeded:
+        # Without page classification no agent had usable input.
+        retry_after = max(1, round(circuit_retry_after()))
+        logger.warning("LLM backend unavailable for claim %s — returning 503", validated_claim_id)
+        raise HTTPException(
+            status_code=503,
+            detail="LLM backend temporarily unavailable. Please retry later.",
+            headers={"Retry-After": str(retry_after)},
+        )
+
     logger.info(
-        "Claim processed — claim_id=%s file=%s pages=%d",
+        "Claim processed — claim_id=%s file=%s pages=%d degraded=%s",
         validated_claim_id,
         file.filename,
         len(pages),
+        degraded_nodes,
     )
     return {
         "claim_id": validated_claim_id,
         "filename": file.filename,
         "pages_count": len(pages),
-        "status": "processed",
+        "status": "partial" if degraded_nodes else "processed",
         "output": final_output,
     }
 
@@ -150,3 +212,34 @@ async def health_check() -> dict[str, str]:
         A dict with the current service status.
     """
     return {"status": "ok"}
+
+
+@router.get("/metrics/llm", status_code=200)
+async def llm_metrics() -> dict[str, Any]:
+    """Expose the LLM client's cache and traffic counters.
+
+    Returns:
+        A snapshot of the counters reported by ``get_llm_stats``.
+    """
+    return get_llm_stats()
+
+
+@router.get("/metrics/page-rules", status_code=200)
+async def page_rule_metrics() -> dict[str, Any]:
+    """Expose hit counts of the segregator's keyword rules.
+
+    Returns:
+        A snapshot of the counters reported by ``get_rule_stats``.
+    """
+    return get_rule_stats()
+
+
+@router.get("/metrics/page-fingerprints", status_code=200)
+async def page_fingerprint_metrics() -> dict[str, Any]:
+    """Expose counters of the segregator's near-duplicate page index.
+
+    Returns:
+        A snapshot of the counters reported by ``get_fingerprint_stats``,
+        or ``{"enabled": False}`` when the index is disabled.
+    """
+    return get_fingerprint_stats() or {"enabled": False}
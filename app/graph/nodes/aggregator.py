@@ -4,6 +4,7 @@ import logging
 from datetime import datetime, timezone
 from typing import Any
 
+from app.graph.nodes.llm_client import get_call_context
 from app.graph.state import ClaimState
 
 logger = logging.getLogger(__name__)
@@ -13,7 +14,8 @@ def aggregator_node(state: ClaimState) -> dict[str, Any]:
     """Merge identity, discharge, and billing data into a single output.
 
     Includes processing metadata with page counts, classified types,
-    and an ISO-8601 timestamp.
+    the nodes that degraded to defaults, whether the claim deadline cut
+    any LLM call short, and an ISO-8601 timestamp.
 
     Args:
         state: Current graph state with all agent outputs populated.
@@ -22,6 +24,7 @@ def aggregator_node(state: ClaimState) -> dict[str, Any]:
         A dict with the ``final_output`` key to merge into state.
     """
     classified = state.get("classified_pages", {})
+    call_context = get_call_context()
 
     final_output: dict[str, Any] = {
         "claim_id": state["claim_id"],
@@ -31,6 +34,8 @@ def aggregator_node(state: ClaimState) -> dict[str, Any]:
         "processing_metadata": {
             "total_pages": len(state.get("pages", [])),
             "classified_types": sorted(classified.keys()),
+            "degraded_nodes": sorted(set(state.get("degraded_nodes", []))),
+            "deadline_exceeded": bool(call_context and call_context.deadline_exceeded),
             "timestamp": datetime.now(timezone.utc).isoformat(),
         },
     }
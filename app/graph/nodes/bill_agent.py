@@ -2,13 +2,39 @@
 
 import json
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
 from typing import Any
 
-from app.graph.nodes.llm_client import call_llm, collect_page_texts
+from app.graph.nodes.llm_client import (
+    STREAMING_ENABLED,
+    LLMUnavailableError,
+    call_llm,
+    call_llm_json_stream,
+    collect_page_texts,
+    estimate_tokens,
+)
 from app.graph.state import ClaimState
+from app.services.bill_table import (
+    BILL_TABLE_ENABLED,
+    MIN_CONFIDENCE,
+    BillTable,
+    is_header_row,
+    is_running_total,
+    parse_bill_table,
+)
 
 logger = logging.getLogger(__name__)
 
+# Chunked mode: bills whose pages exceed this many estimated prompt tokens
+# are split into chunks of at most this size, extracted concurrently
+# (0, the default, always sends all bill pages in one request).
+_CHUNK_TOKENS = int(os.getenv("BILL_CHUNK_TOKENS", "0"))
+
+# Max chunks of one bill being extracted at the same time.
+_CHUNK_CONCURRENCY = int(os.getenv("BILL_CHUNK_CONCURRENCY", "8"))
+
 BILL_SYSTEM_PROMPT = """You are a medical insurance document data extractor. You will receive text from itemized bill pages of an insurance claim.
 
 Extract ALL line items from the bill. For each item extract:
@@ -42,7 +68,7 @@ Rules:
 
 _ITEM_REQUIRED_KEYS: set[str] = {"description", "quantity", "unit_price", "total_price"}
 
-_DEFAULT_BILL_DATA: dict[str, Any] = {
+DEFAULT_BILL_DATA: dict[str, Any] = {
     "items": [],
     "calculated_total": 0,
     "verified_total": 0,
@@ -79,31 +105,42 @@ def _validate_item(item: Any) -> dict[str, Any] | None:
         return None
 
 
-def _sanitise_bill(parsed: dict[str, Any]) -> dict[str, Any]:
+def _collect_item(raw_item: Any, clean_items: list[dict[str, Any]]) -> None:
+    """Validate ``raw_item`` and append it to ``clean_items`` if well-formed."""
+    validated = _validate_item(raw_item)
+    if validated is not None:
+        clean_items.append(validated)
+    else:
+        logger.debug("Bill Agent — skipping malformed item: %s", raw_item)
+
+
+def sanitise_bill(
+    parsed: dict[str, Any],
+    clean_items: list[dict[str, Any]] | None = None,
+) -> dict[str, Any]:
     """Validate structure, recalculate totals, and flag mismatches.
 
     Args:
         parsed: Raw parsed JSON from LLM.
+        clean_items: Items already validated while the response was
+            streaming. When given, ``parsed["items"]`` is not re-validated.
 
     Returns:
         Sanitised bill dict with verified_total and total_mismatch.
     """
     if not isinstance(parsed, dict):
         logger.warning("Bill Agent — LLM returned non-dict JSON")
-        return dict(_DEFAULT_BILL_DATA)
+        return dict(DEFAULT_BILL_DATA)
 
     items_raw = parsed.get("items")
     if not isinstance(items_raw, list):
         logger.warning("Bill Agent — 'items' is not a list")
-        return dict(_DEFAULT_BILL_DATA)
+        return dict(DEFAULT_BILL_DATA)
 
-    clean_items: list[dict[str, Any]] = []
-    for raw_item in items_raw:
-        validated = _validate_item(raw_item)
-        if validated is not None:
-            clean_items.append(validated)
-        else:
-            logger.debug("Bill Agent — skipping malformed item: %s", raw_item)
+    if clean_items is None:
+        clean_items = []
+        for raw_item in items_raw:
+            _collect_item(raw_item, clean_items)
 
     # Python-verified total — independent of LLM
     verified_total = round(sum(i["total_price"] for i in clean_items), 2)
@@ -140,36 +177,280 @@ def _sanitise_bill(parsed: dict[str, Any]) -> dict[str, Any]:
     }
 
 
+def _read_bill_tables(
+    pages: list[dict[str, Any]],
+    page_numbers: list[int],
+) -> tuple[list[dict[str, Any]], float, list[int]]:
+    """Parse bill pages from their word positions.
+
+    A page is only taken from its layout when it parses with enough
+    confidence and its items add up to the total printed on it. A single
+    printed total may instead cover every parsed page, as a grand total
+    on the last page does.
+
+    Args:
+        pages: All extracted pages.
+        page_numbers: Page numbers classified as itemized bills.
+
+    Returns:
+        The line items from the accepted pages, their total and the page
+        numbers left for the LLM.
+    """
+    by_number = {page["page_number"]: page for page in pages}
+    tables: dict[int, BillTable] = {}
+    remaining: list[int] = []
+    for number in page_numbers:
+        words = by_number.get(number, {}).get("words")
+        table = parse_bill_table(words) if words else None
+        if table is None or not table.items or table.confidence < MIN_CONFIDENCE:
+            remaining.append(number)
+        else:
+            tables[number] = table
+
+    def item_sum(numbers: list[int]) -> float:
+        """Sum of the parsed items on the given pages."""
+        return sum(item["total_price"] for number in numbers for item in tables[number].items)
+
+    printed = {number: table.printed_total for number, table in tables.items() if table.printed_total is not None}
+    grand_total = len(printed) == 1 and _totals_agree(next(iter(printed.values())), item_sum(list(tables)))
+    if not grand_total:
+        for number, total in printed.items():
+            if not _totals_agree(total, item_sum([number])):
+                logger.info("Bill Agent — page %d items do not add up to its printed total, sending it to the LLM", number)
+                del tables[number]
+                remaining.append(number)
+
+    items = [item for table in tables.values() for item in table.items]
+    total = sum(item["total_price"] for item in items)
+    return items, round(total, 2), sorted(remaining)
+
+
+def _totals_agree(printed: float, items_total: float) -> bool:
+    """Whether parsed items add up to a printed total, to the paisa or 0.5%."""
+    return abs(printed - items_total) <= max(0.01, 0.005 * printed)
+
+
+def _merge_table_items(
+    parsed: Any,
+    table_items: list[dict[str, Any]],
+    table_total: float,
+) -> Any:
+    """Add geometry-parsed items and their total to the LLM's output."""
+    if not table_items or not isinstance(parsed, dict) or not isinstance(parsed.get("items"), list):
+        return parsed
+    try:
+        llm_total = float(parsed.get("calculated_total", 0))
+    except (TypeError, ValueError):
+        llm_total = 0.0
+    return {**parsed, "items": table_items + parsed["items"], "calculated_total": table_total + llm_total}
+
+
+def _reported_total(item: Any) -> float:
+    """The ``total_price`` an extractor reported for a raw item, or 0."""
+    try:
+        return float(item.get("total_price", 0))
+    except (AttributeError, TypeError, ValueError):
+        return 0.0
+
+
+def _is_repeated_row(item: Any) -> bool:
+    """Whether a raw item repeats rows counted elsewhere: a running total or a column header.
+
+    Identical charges on consecutive pages are kept, since a bill can
+    legitimately repeat one, such as daily room rent.
+    """
+    if not isinstance(item, dict):
+        return False
+    description = str(item.get("description", ""))
+    return is_running_total(description) or is_header_row(description)
+
+
+def _pack_chunks(pages: list[dict[str, Any]], page_numbers: list[int]) -> list[list[int]]:
+    """Group consecutive bill pages into chunks of at most ``_CHUNK_TOKENS``.
+
+    A page larger than the budget gets a chunk of its own.
+    """
+    texts = {page["page_number"]: page.get("text", "") for page in pages}
+    chunks: list[list[int]] = []
+    current: list[int] = []
+    used = 0
+    for number in sorted(page_numbers):
+        cost = estimate_tokens(texts.get(number, "")) + 8  # page marker
+        if current and used + cost > _CHUNK_TOKENS:
+            chunks.append(current)
+            current, used = [], 0
+        current.append(number)
+        used += cost
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _extract_chunk(content: str) -> dict[str, Any]:
+    """Extract the line items of one chunk of a long bill.
+
+    Raises:
+        ValueError: If the answer is not an object with an item list, so
+            that a chunk's items are never silently missing from the bill.
+    """
+    parsed = json.loads(call_llm(BILL_SYSTEM_PROMPT, content))
+    if not isinstance(parsed, dict) or not isinstance(parsed.get("items"), list):
+        raise ValueError("bill chunk answer has no item list")
+    return parsed
+
+
+def _extract_in_chunks(pages: list[dict[str, Any]], chunks: list[list[int]]) -> tuple[dict[str, Any], bool]:
+    """Extract a long bill chunk by chunk and merge the answers.
+
+    Chunks are extracted concurrently, each in a copy of the caller's
+    context so LLM calls keep the claim's retry budget and deadline.
+    Subtotals carried between pages and column headers repeated on each
+    page are dropped, and their reported totals are taken out of the
+    summed ``calculated_total`` so it still describes the merged item set.
+    A failed chunk is left out and the others are kept.
+
+    Args:
+        pages: All extracted pages.
+        chunks: Page numbers per chunk, in order.
+
+    Returns:
+        The merged ``{"items": [...], "calculated_total": ...}`` answer,
+        and whether every chunk succeeded.
+
+    Raises:
+        Exception: The first chunk's error, if no chunk succeeded.
+    """
+    contents = [
+        f"Part {index} of {len(chunks)} of a longer bill. Extract only the line items on these pages; "
+        f"skip subtotals carried or brought forward from other pages.\n\n{collect_page_texts(pages, chunk)}"
+        for index, chunk in enumerate(chunks, start=1)
+    ]
+    workers = max(1, min(_CHUNK_CONCURRENCY, len(contents)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bill-chunk") as pool:
+        futures = [pool.submit(copy_context().run, _extract_chunk, content) for content in contents]
+        answers: list[dict[str, Any]] = []
+        errors: list[Exception] = []
+        for chunk, future in zip(chunks, futures):
+            try:
+                answers.append(future.result())
+            except Exception as exc:
+                logger.warning("Bill Agent — chunk with pages %s failed: %s", chunk, exc)
+                errors.append(exc)
+    if not answers:
+        raise errors[0]
+
+    items: list[Any] = []
+    removed: list[Any] = []
+    for answer in answers:
+        for item in answer["items"]:
+            if _is_repeated_row(item):
+                removed.append(item)
+            else:
+                items.append(item)
+
+    llm_total = 0.0
+    for answer in answers:
+        try:
+            llm_total += float(answer.get("calculated_total", 0))
+        except (TypeError, ValueError):
+            pass
+    llm_total -= sum(_reported_total(item) for item in removed)
+    logger.info(
+        "Bill Agent — merged %d of %d chunks: %d items, %d running-total or header rows dropped",
+        len(answers),
+        len(chunks),
+        len(items),
+        len(removed),
+    )
+    return {"items": items, "calculated_total": round(llm_total, 2)}, not errors
+
+
 def extract_bill(pages: list[dict[str, Any]], page_numbers: list[int]) -> dict[str, Any]:
     """Extract structured billing data from the given pages via LLM.
 
+    Pages whose table the geometry parser (see
+    :mod:`app.services.bill_table`) reads with enough confidence skip
+    the LLM; only the remaining pages are sent to it. Both sets of items
+    go through the same validation. When the remaining pages exceed
+    ``BILL_CHUNK_TOKENS``, they are extracted in concurrent chunks (see
+    :func:`_extract_in_chunks`); if some chunks fail, the others are
+    kept and the bill is flagged ``degraded``.
+
     Args:
         pages: All extracted pages.
         page_numbers: Page numbers classified as itemized bills.
 
     Returns:
         Structured bill dict with verification fields.
-        Falls back to defaults on failure.
+        Falls back to defaults on failure, flagged ``degraded`` when
+        the LLM circuit breaker is open. If layout-parsed items exist,
+        a failure keeps them instead, flagged ``degraded``.
     """
     if not page_numbers:
         logger.info("Bill Agent — no bill pages to process")
-        return dict(_DEFAULT_BILL_DATA)
-
-    combined_text = collect_page_texts(pages, page_numbers)
+        return dict(DEFAULT_BILL_DATA)
+
+    table_items: list[dict[str, Any]] = []
+    table_total = 0.0
+    llm_pages = page_numbers
+    if BILL_TABLE_ENABLED:
+        table_items, table_total, llm_pages = _read_bill_tables(pages, page_numbers)
+        if not llm_pages:
+            logger.info("Bill Agent — parsed %d bill pages from their layout", len(page_numbers))
+            return sanitise_bill({"items": table_items, "calculated_total": table_total})
+
+    combined_text = collect_page_texts(pages, llm_pages)
     if not combined_text.strip():
+        if table_items:
+            return sanitise_bill({"items": table_items, "calculated_total": table_total})
         logger.warning("Bill Agent — bill pages are empty")
-        return dict(_DEFAULT_BILL_DATA)
+        return dict(DEFAULT_BILL_DATA)
 
+    chunks = _pack_chunks(pages, llm_pages) if _CHUNK_TOKENS > 0 else [llm_pages]
     try:
+        if len(chunks) > 1:
+            parsed, complete = _extract_in_chunks(pages, chunks)
+            bill = sanitise_bill(_merge_table_items(parsed, table_items, table_total))
+            # Items of the failed chunks are missing, so the bill is partial.
+            return bill if complete else {**bill, "degraded": True}
+        if STREAMING_ENABLED:
+            # Validate line items as they stream instead of after the
+            # whole (often long) item list has been generated.
+            clean_items: list[dict[str, Any]] = []
+            for item in table_items:
+                _collect_item(item, clean_items)
+            parsed = call_llm_json_stream(
+                BILL_SYSTEM_PROMPT,
+                combined_text,
+                item_key="items",
+                on_item=lambda item: _collect_item(item, clean_items),
+            )
+            return sanitise_bill(_merge_table_items(parsed, table_items, table_total), clean_items)
         raw = call_llm(BILL_SYSTEM_PROMPT, combined_text)
         parsed = json.loads(raw)
-        return _sanitise_bill(parsed)
+        return sanitise_bill(_merge_table_items(parsed, table_items, table_total))
     except (json.JSONDecodeError, KeyError, IndexError) as exc:
         logger.warning("Bill Agent — failed to parse LLM response: %s", exc)
-        return dict(_DEFAULT_BILL_DATA)
+        return _table_only(table_items, table_total, dict(DEFAULT_BILL_DATA))
+    except LLMUnavailableError as exc:
+        logger.warning("Bill Agent — %s", exc)
+        return _table_only(table_items, table_total, {**DEFAULT_BILL_DATA, "degraded": True})
     except Exception as exc:
         logger.error("Bill Agent — LLM call failed: %s", exc)
-        return dict(_DEFAULT_BILL_DATA)
+        return _table_only(table_items, table_total, dict(DEFAULT_BILL_DATA))
+
+
+def _table_only(table_items: list[dict[str, Any]], table_total: float, fallback: dict[str, Any]) -> dict[str, Any]:
+    """Keep the layout-parsed items when the LLM pages failed, flagged ``degraded``.
+
+    Returns:
+        The sanitised table items marked ``degraded``, since the LLM
+        pages are missing from them, or ``fallback`` without any.
+    """
+    if not table_items:
+        return fallback
+    logger.warning("Bill Agent — returning %d layout-parsed items without the LLM pages", len(table_items))
+    return {**sanitise_bill({"items": table_items, "calculated_total": table_total}), "degraded": True}
 
 
 def bill_agent_node(state: ClaimState) -> dict[str, Any]:
@@ -179,7 +460,8 @@ def bill_agent_node(state: ClaimState) -> dict[str, Any]:
         state: Current graph state with classified pages.
 
     Returns:
-        A dict with the ``bill_data`` key to merge into state.
+        A dict with the ``bill_data`` key to merge into state, plus
+        ``degraded_nodes`` when the LLM backend was unavailable.
     """
     page_numbers = state["classified_pages"].get("itemized_bill", [])
     logger.info(
@@ -191,6 +473,9 @@ def bill_agent_node(state: ClaimState) -> dict[str, Any]:
         bill_data = extract_bill(state["pages"], page_numbers)
     except Exception as exc:
         logger.exception("Bill Agent — unhandled error for claim %s", state["claim_id"])
-        bill_data = dict(_DEFAULT_BILL_DATA)
+        bill_data = dict(DEFAULT_BILL_DATA)
     logger.info("Bill Agent — claim_id=%s confidence=%s verified_total=%s mismatch=%s", state["claim_id"], bill_data.get("confidence"), bill_data.get("verified_total"), bill_data.get("total_mismatch"))
-    return {"bill_data": bill_data}
+    result: dict[str, Any] = {"bill_data": bill_data}
+    if bill_data.get("degraded"):
+        result["degraded_nodes"] = ["bill_agent"]
+    return result
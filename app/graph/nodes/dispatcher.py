@@ -0,0 +1,140 @@
+"""Dispatcher node — overlaps page classification with the extraction agents."""
+
+import logging
+import threading
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import copy_context
+from dataclasses import dataclass
+from typing import Any
+
+from app.graph.nodes.bill_agent import bill_agent_node
+from app.graph.nodes.discharge_agent import discharge_agent_node
+from app.graph.nodes.id_agent import id_agent_node
+from app.graph.nodes.llm_client import cancellable_llm_calls
+from app.graph.nodes.segregator import segregator_node
+from app.graph.state import ClaimState
+
+logger = logging.getLogger(__name__)
+
+# Document type each extraction agent reads, with the agent's node function.
+AGENTS: dict[str, Callable[[ClaimState], dict[str, Any]]] = {
+    "identity_document": id_agent_node,
+    "discharge_summary": discharge_agent_node,
+    "itemized_bill": bill_agent_node,
+}
+
+
+@dataclass
+class _EarlyRun:
+    """An agent started before classification finished."""
+
+    page_numbers: list[int]
+    future: Future
+    stale: threading.Event
+
+
+class _StreamingDispatch:
+    """Start each agent as soon as its document looks complete.
+
+    A document type is taken as complete once every page up to the end
+    of its run is classified and the page after the run has another
+    type. The agent then starts on the pages found so far, while the
+    remaining pages are still being classified. If another page of that
+    type turns up later, the early run goes stale: it is cancelled if it
+    has not started, and otherwise makes no further LLM calls (see
+    ``cancellable_llm_calls``). The agent then runs once more on the
+    full set after classification, so the output matches a sequential
+    run. Each type gets at most one early run.
+    """
+
+    def __init__(self, state: ClaimState, pool: ThreadPoolExecutor) -> None:
+        self._state = state
+        self._pool = pool
+        self._context = copy_context()
+        self._types: list[str | None] = [None] * len(state["pages"])
+        self._started: dict[str, _EarlyRun] = {}
+        self._lock = threading.Lock()
+
+    def on_page(self, index: int, doc_type: str) -> None:
+        """Record a classified page and start agents whose pages are complete."""
+        with self._lock:
+            self._types[index] = doc_type
+            page_number = self._state["pages"][index]["page_number"]
+            early = self._started.get(doc_type)
+            if early is not None and not early.stale.is_set() and page_number not in early.page_numbers:
+                logger.info("Dispatcher — %s gained page %d, dropping its early run", doc_type, page_number)
+                early.stale.set()
+                early.future.cancel()
+            for agent_type in AGENTS:
+                if agent_type not in self._started and (page_numbers := self._closed_run(agent_type)):
+                    logger.info("Dispatcher — starting %s on pages %s early", agent_type, page_numbers)
+                    stale = threading.Event()
+                    future = self._submit(agent_type, page_numbers, stale)
+                    self._started[agent_type] = _EarlyRun(page_numbers, future, stale)
+
+    def results(self, classified: dict[str, list[int]]) -> list[dict[str, Any]]:
+        """Collect every agent's node output for the final classification."""
+        futures = []
+        for agent_type in AGENTS:
+            page_numbers = classified.get(agent_type, [])
+            early = self._started.get(agent_type)
+            if early is not None and not early.stale.is_set() and early.page_numbers == page_numbers:
+                futures.append(early.future)
+            else:
+                futures.append(self._submit(agent_type, page_numbers))
+        return [future.result() for future in futures]
+
+    def _closed_run(self, doc_type: str) -> list[int]:
+        """Page numbers of ``doc_type`` if its run is followed by another type."""
+        settled = next((i for i, t in enumerate(self._types) if t is None), len(self._types))
+        indexes = [i for i in range(settled) if self._types[i] == doc_type]
+        if not indexes or indexes[-1] + 1 >= settled:
+            return []
+        return [self._state["pages"][i]["page_number"] for i in indexes]
+
+    def _submit(self, doc_type: str, page_numbers: list[int], stale: threading.Event | None = None) -> Future:
+        agent_state: ClaimState = {**self._state, "classified_pages": {doc_type: page_numbers}}
+        if stale is None:
+            return self._pool.submit(self._context.copy().run, AGENTS[doc_type], agent_state)
+        return self._pool.submit(self._context.copy().run, _run_cancellable, AGENTS[doc_type], agent_state, stale)
+
+
+def _run_cancellable(
+    agent: Callable[[ClaimState], dict[str, Any]],
+    state: ClaimState,
+    stale: threading.Event,
+) -> dict[str, Any]:
+    """Run an early agent that stops calling the LLM once ``stale`` is set."""
+    with cancellable_llm_calls(stale):
+        return agent(state)
+
+
+def dispatcher_node(state: ClaimState) -> dict[str, Any]:
+    """Classify pages and run the extraction agents, overlapping the two.
+
+    Replaces the segregator → agents fan-out when
+    ``WORKFLOW_STREAMING_DISPATCH`` is on: agents start on their pages
+    while the rest of the claim is still being classified.
+
+    Args:
+        state: Current graph state containing extracted pages.
+
+    Returns:
+        The merged updates of the segregator and all three agents:
+        ``classified_pages``, ``id_data``, ``discharge_data``,
+        ``bill_data`` and ``degraded_nodes``.
+    """
+    with ThreadPoolExecutor(max_workers=2 * len(AGENTS), thread_name_prefix="dispatcher") as pool:
+        dispatch = _StreamingDispatch(state, pool)
+        segregated = segregator_node(state, on_page=dispatch.on_page)
+        agent_results = dispatch.results(segregated["classified_pages"])
+
+    result: dict[str, Any] = {"classified_pages": segregated["classified_pages"], "degraded_nodes": []}
+    for update in [segregated, *agent_results]:
+        for key, value in update.items():
+            if key == "degraded_nodes":
+                result["degraded_nodes"].extend(value)
+            elif key != "classified_pages":
+                result[key] = value
+    return result
@@ -0,0 +1,456 @@
+"""Schema-driven field extraction shared by the ID and discharge agents.
+
+An extraction agent is declared as an :class:`ExtractionSchema`: the
+document type it reads, its output fields and an optional deterministic
+pre-pass. Schemas are compiled once at import into a
+:class:`CompiledSchema` holding the system prompt, the validator and the
+confidence scorer. :func:`make_extraction_node` runs several schemas for
+a claim, answering those whose pages are small with a single LLM
+request.
+"""
+
+import json
+import logging
+import os
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any
+
+from app.graph.nodes.llm_client import LLMUnavailableError, call_llm, collect_page_texts, estimate_tokens
+from app.graph.state import ClaimState
+from app.services.layout_templates import extract_with_templates
+
+logger = logging.getLogger(__name__)
+
+# Schemas whose pages together stay within this many estimated tokens
+# are extracted with one request (0 gives every schema a request of its
+# own).
+COMBINE_TOKENS = int(os.getenv("EXTRACTION_COMBINE_TOKENS", "0"))
+
+# Share of fields that must be filled for "high" and "medium" confidence.
+_HIGH_CONFIDENCE_RATIO = 0.8
+_MEDIUM_CONFIDENCE_RATIO = 0.4
+
+_PROMPT_TEMPLATE = """You are a medical insurance document data extractor. You will receive text from {document} pages of an insurance claim.
+
+Extract ONLY the following fields from the provided text. Do NOT infer or guess values that are not explicitly present.
+
+Required JSON output format:
+{{
+{fields}
+}}
+
+Rules:
+- Return null for any field not explicitly found in the text.
+- Do NOT hallucinate or fabricate data.
+- Return ONLY the JSON object, no explanation or commentary."""
+
+_COMBINED_PROMPT_TEMPLATE = """You are a medical insurance document data extractor. You will receive text from several pages of an insurance claim, each page under a marker line of the form "--- Page <page_number> ---". A "Sections" list at the end names the pages each section of the answer must be read from.
+
+Extract ONLY the following fields, each section from its own pages. Do NOT infer or guess values that are not explicitly present.
+
+Required JSON output format:
+{{
+{sections}
+}}
+
+Rules:
+- Return null for any field not explicitly found in the section's pages.
+- Do NOT hallucinate or fabricate data.
+- Return ONLY the JSON object, no explanation or commentary."""
+
+_HINTS_HEADER = (
+    "\n\nAlready read from this text by validated patterns "
+    "(keep these values and focus on the remaining fields):\n"
+)
+
+# ---------------------------------------------------------------------------
+# Schemas
+# ---------------------------------------------------------------------------
+
+
+@dataclass
+class Prefill:
+    """Fields a schema's deterministic pre-pass found before the LLM.
+
+    Attributes:
+        fields: Validated values. They override the LLM's.
+        complete: Whether they are enough to skip the LLM.
+        hints: Notes for the LLM prompt, or ``""``.
+    """
+
+    fields: dict[str, str] = field(default_factory=dict)
+    complete: bool = False
+    hints: str = ""
+
+
+@dataclass(frozen=True)
+class ExtractionSchema:
+    """Declarative description of a field extraction agent.
+
+    Attributes:
+        name: The agent's node name, reported in ``degraded_nodes``.
+        label: Log prefix, e.g. ``"ID Agent"``.
+        doc_type: Document type whose pages the agent reads.
+        document: How the prompt names those pages.
+        state_key: ``ClaimState`` key the result is stored under.
+        fields: Output fields; each is a string or ``None``.
+        prefill: Optional deterministic pre-pass over the pages' text.
+        select: Optional span selector returning the parts of the pages'
+            text the fields are in, or ``None`` to send all of it. Fields
+            the spans leave empty are asked for again with the full text.
+    """
+
+    name: str
+    label: str
+    doc_type: str
+    document: str
+    state_key: str
+    fields: tuple[str, ...]
+    prefill: Callable[[str], Prefill] | None = None
+    select: Callable[[str], str | None] | None = None
+
+
+def _field_lines(fields: tuple[str, ...], indent: str) -> str:
+    """Lay out fields as lines of the prompt's JSON template."""
+    return ",\n".join(f'{indent}"{name}": "<string or null>"' for name in fields)
+
+
+class CompiledSchema:
+    """An :class:`ExtractionSchema` with its prompt and scoring prepared.
+
+    Args:
+        schema: The declaration to compile.
+    """
+
+    def __init__(self, schema: ExtractionSchema) -> None:
+        self.schema = schema
+        self.fields = schema.fields
+        self.system_prompt = _PROMPT_TEMPLATE.format(document=schema.document, fields=_field_lines(schema.fields, "  "))
+        self._high = _HIGH_CONFIDENCE_RATIO * len(schema.fields)
+        self._medium = _MEDIUM_CONFIDENCE_RATIO * len(schema.fields)
+
+    def validate(self, parsed: dict[str, Any]) -> dict[str, Any]:
+        """Keep exactly the schema's fields, as non-empty strings or ``None``."""
+        result: dict[str, Any] = {}
+        for key in self.fields:
+            val = parsed.get(key)
+            if val is not None and not isinstance(val, str):
+                val = str(val)
+            result[key] = val if val else None
+        return result
+
+    def confidence(self, data: dict[str, Any]) -> str:
+        """Rate a validated result ``"high"``, ``"medium"`` or ``"low"`` by filled fields."""
+        filled = sum(1 for key in self.fields if data.get(key) is not None)
+        if filled >= self._high:
+            return "high"
+        if filled >= self._medium:
+            return "medium"
+        return "low"
+
+    def result(self, parsed: dict[str, Any], prefill: Prefill | None = None) -> dict[str, Any]:
+        """Validate an answer and add its confidence; pre-pass fields win."""
+        validated = self.validate({**parsed, **prefill.fields} if prefill else parsed)
+        validated["confidence"] = self.confidence(validated)
+        return validated
+
+    def default(self) -> dict[str, Any]:
+        """The all-``None`` result returned when nothing could be extracted."""
+        return {**{key: None for key in self.fields}, "confidence": "low"}
+
+
+def compile_schema(schema: ExtractionSchema) -> CompiledSchema:
+    """Compile a schema; call at import so the work is done once."""
+    return CompiledSchema(schema)
+
+
+@lru_cache(maxsize=32)
+def combined_prompt(schemas: tuple[CompiledSchema, ...]) -> str:
+    """System prompt asking for several schemas' fields in one answer."""
+    sections = ",\n".join(
+        f'  "{compiled.schema.doc_type}": {{\n{_field_lines(compiled.fields, "    ")}\n  }}' for compiled in schemas
+    )
+    return _COMBINED_PROMPT_TEMPLATE.format(sections=sections)
+
+
+# ---------------------------------------------------------------------------
+# Extraction
+# ---------------------------------------------------------------------------
+
+
+@dataclass
+class _Job:
+    """A schema's pages that still need the LLM."""
+
+    schema: CompiledSchema
+    page_numbers: list[int]
+    text: str
+    prefill: Prefill | None
+
+
+def _prepare(compiled: CompiledSchema, pages: list[dict[str, Any]], page_numbers: list[int]) -> dict[str, Any] | _Job:
+    """Settle a schema without the LLM if possible.
+
+    Returns:
+        The finished result when there are no usable pages, when learned
+        layout templates yield every field, or when the pre-pass is
+        complete; otherwise the :class:`_Job` for the LLM.
+    """
+    label = compiled.schema.label
+    if not page_numbers:
+        logger.info("%s — no %s pages to process", label, compiled.schema.document)
+        return compiled.default()
+
+    combined_text = collect_page_texts(pages, page_numbers)
+    if not combined_text.strip():
+        logger.warning("%s — %s pages are empty", label, compiled.schema.document)
+        return compiled.default()
+
+    templated = extract_with_templates(pages, page_numbers, list(compiled.fields))
+    if templated is not None:
+        logger.info("%s — fields read from layout templates, skipping the LLM", label)
+        return compiled.result(templated)
+
+    prefill = compiled.schema.prefill(combined_text) if compiled.schema.prefill else None
+    if prefill is not None and prefill.complete:
+        logger.info("%s — fields matched deterministically, skipping the LLM", label)
+        return compiled.result(prefill.fields)
+    return _Job(compiled, page_numbers, combined_text, prefill)
+
+
+def _fill_from_full_text(
+    job: _Job,
+    parsed: dict[str, Any],
+    system_prompt: str,
+    user_content: str,
+    llm: Callable[[str, str], str],
+) -> dict[str, Any]:
+    """Ask again with the full text if the selected spans left fields empty.
+
+    Values found in the spans are kept. If the second call fails, the
+    spans' answer is used as it is.
+    """
+    missing = [name for name, value in job.schema.result(parsed, job.prefill).items() if value is None]
+    if not missing:
+        return parsed
+    logger.info("%s — %s not in the selected spans, asking with the full text", job.schema.schema.label, missing)
+    try:
+        full = json.loads(llm(system_prompt, user_content))
+    except Exception as exc:
+        logger.warning("%s — full-text retry failed: %s", job.schema.schema.label, exc)
+        return parsed
+    if not isinstance(full, dict):
+        return parsed
+    return {**full, **{name: value for name, value in parsed.items() if value}}
+
+
+def _ask(jobs: list[_Job], pages: list[dict[str, Any]], llm: Callable[[str, str], str]) -> list[dict[str, Any]]:
+    """Answer one or more jobs with a single LLM request.
+
+    Falls back to each schema's defaults on failure, flagged
+    ``degraded`` when the LLM circuit breaker is open.
+    """
+    label = " + ".join(job.schema.schema.label for job in jobs)
+    spans: str | None = None
+    hints = ""
+    if len(jobs) == 1:
+        system_prompt = jobs[0].schema.system_prompt
+        if jobs[0].schema.schema.select is not None:
+            spans = jobs[0].schema.schema.select(jobs[0].text)
+        if jobs[0].prefill is not None and jobs[0].prefill.hints:
+            hints = _HINTS_HEADER + jobs[0].prefill.hints
+        user_content = (spans or jobs[0].text) + hints
+    else:
+        system_prompt = combined_prompt(tuple(job.schema for job in jobs))
+        page_numbers = sorted({number for job in jobs for number in job.page_numbers})
+        lines = []
+        for job in jobs:
+            lines.append(f"- {job.schema.schema.doc_type}: pages {', '.join(map(str, job.page_numbers))}")
+            if job.prefill is not None and job.prefill.hints:
+                lines.append("  Already read by validated patterns (keep these values):")
+                lines.extend(f"  {hint}" for hint in job.prefill.hints.splitlines())
+        user_content = collect_page_texts(pages, page_numbers) + "\n\nSections:\n" + "\n".join(lines)
+
+    try:
+        parsed = json.loads(llm(system_prompt, user_content))
+        if not isinstance(parsed, dict):
+            logger.warning("%s — LLM returned non-dict JSON", label)
+            return [job.schema.default() for job in jobs]
+        if len(jobs) == 1:
+            if spans is not None:
+                parsed = _fill_from_full_text(jobs[0], parsed, system_prompt, jobs[0].text + hints, llm)
+            return [jobs[0].schema.result(parsed, jobs[0].prefill)]
+        results = []
+        for job in jobs:
+            section = parsed.get(job.schema.schema.doc_type)
+            results.append(job.schema.result(section if isinstance(section, dict) else {}, job.prefill))
+        return results
+
+    except (json.JSONDecodeError, KeyError, IndexError) as exc:
+        logger.warning("%s — failed to parse LLM response: %s", label, exc)
+        return [job.schema.default() for job in jobs]
+    except LLMUnavailableError as exc:
+        logger.warning("%s — %s", label, exc)
+        return [{**job.schema.default(), "degraded": True} for job in jobs]
+    except Exception as exc:
+        logger.error("%s — LLM call failed: %s", label, exc)
+        return [job.schema.default() for job in jobs]
+
+
+def extract_fields(
+    compiled: CompiledSchema,
+    pages: list[dict[str, Any]],
+    page_numbers: list[int],
+    llm: Callable[[str, str], str] | None = None,
+) -> dict[str, Any]:
+    """Extract one schema's fields from the given pages.
+
+    Pages matching learned layout templates are read at the stored
+    field positions when that yields every field. Otherwise the schema's
+    pre-pass runs; the LLM is skipped when it is complete, and is told
+    what it found when it is not.
+
+    Args:
+        compiled: The schema to extract.
+        pages: All extracted pages.
+        page_numbers: Page numbers of the schema's document type.
+        llm: The ``call_llm``-compatible function to ask; defaults to
+            :func:`call_llm`.
+
+    Returns:
+        The validated fields with ``confidence``. Falls back to defaults
+        on failure, flagged ``degraded`` when the LLM circuit breaker is
+        open.
+    """
+    prepared = _prepare(compiled, pages, page_numbers)
+    if isinstance(prepared, dict):
+        return prepared
+    return _ask([prepared], pages, llm or call_llm)[0]
+
+
+def plan_requests(jobs: list[_Job], pages: list[dict[str, Any]]) -> list[list[_Job]]:
+    """Group jobs into LLM requests.
+
+    Jobs are added to a request in order while its pages stay within
+    ``COMBINE_TOKENS``. The segregator gives every page one type, so
+    jobs never share a page.
+    """
+    tokens = {page["page_number"]: estimate_tokens(page.get("text", "")) + 8 for page in pages}
+    requests: list[list[_Job]] = []
+    current: list[_Job] = []
+    current_pages: set[int] = set()
+    for job in jobs:
+        job_pages = set(job.page_numbers)
+        if current and sum(tokens.get(n, 0) for n in current_pages | job_pages) > COMBINE_TOKENS:
+            requests.append(current)
+            current, current_pages = [], set()
+        current.append(job)
+        current_pages |= job_pages
+    if current:
+        requests.append(current)
+    return requests
+
+
+def run_schemas(
+    schemas: list[CompiledSchema],
+    pages: list[dict[str, Any]],
+    classified: dict[str, list[int]],
+    llm: Callable[[str, str], str] | None = None,
+) -> dict[str, dict[str, Any]]:
+    """Extract several schemas for one claim, sharing LLM requests.
+
+    Requests (see :func:`plan_requests`) run concurrently, each in a
+    copy of the caller's context so LLM calls keep the claim's retry
+    budget and deadline.
+
+    Returns:
+        Each schema's result by its ``state_key``.
+    """
+    results: dict[str, dict[str, Any]] = {}
+    jobs: list[_Job] = []
+    for compiled in schemas:
+        prepared = _prepare(compiled, pages, classified.get(compiled.schema.doc_type, []))
+        if isinstance(prepared, dict):
+            results[compiled.schema.state_key] = prepared
+        else:
+            jobs.append(prepared)
+    if not jobs:
+        return results
+
+    requests = plan_requests(jobs, pages)
+    with ThreadPoolExecutor(max_workers=len(requests), thread_name_prefix="extraction") as pool:
+        futures = [pool.submit(copy_context().run, _ask, request, pages, llm or call_llm) for request in requests]
+        for request, future in zip(requests, futures):
+            for job, data in zip(request, future.result()):
+                results[job.schema.schema.state_key] = data
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Nodes
+# ---------------------------------------------------------------------------
+
+
+def run_agent_node(
+    compiled: CompiledSchema,
+    state: ClaimState,
+    extract: Callable[[list[dict[str, Any]], list[int]], dict[str, Any]],
+) -> dict[str, Any]:
+    """Run one extraction agent as a graph node.
+
+    Args:
+        compiled: The agent's schema.
+        state: Current graph state with classified pages.
+        extract: The agent's ``(pages, page_numbers)`` extraction function.
+
+    Returns:
+        A dict with the schema's ``state_key`` to merge into state, plus
+        ``degraded_nodes`` when the LLM backend was unavailable.
+    """
+    schema = compiled.schema
+    page_numbers = state["classified_pages"].get(schema.doc_type, [])
+    logger.info("%s — claim_id=%s processing pages=%s", schema.label, state["claim_id"], page_numbers)
+    try:
+        data = extract(state["pages"], page_numbers)
+    except Exception:
+        logger.exception("%s — unhandled error for claim %s", schema.label, state["claim_id"])
+        data = compiled.default()
+    logger.info("%s — claim_id=%s confidence=%s result=%s", schema.label, state["claim_id"], data.get("confidence"), data)
+    result: dict[str, Any] = {schema.state_key: data}
+    if data.get("degraded"):
+        result["degraded_nodes"] = [schema.name]
+    return result
+
+
+def make_extraction_node(schemas: list[CompiledSchema]) -> Callable[[ClaimState], dict[str, Any]]:
+    """Build a graph node that runs several extraction agents together.
+
+    Args:
+        schemas: The agents' compiled schemas.
+
+    Returns:
+        A node function returning every schema's ``state_key`` plus
+        ``degraded_nodes`` for agents whose LLM backend was unavailable.
+    """
+
+    def extraction_node(state: ClaimState) -> dict[str, Any]:
+        """Extract every schema's fields for the claim."""
+        try:
+            results = run_schemas(schemas, state["pages"], state["classified_pages"])
+        except Exception:
+            logger.exception("Extraction — unhandled error for claim %s", state["claim_id"])
+            results = {compiled.schema.state_key: compiled.default() for compiled in schemas}
+        update: dict[str, Any] = dict(results)
+        update["degraded_nodes"] = [c.schema.name for c in schemas if results[c.schema.state_key].get("degraded")]
+        logger.info(
+            "Extraction — claim_id=%s confidence=%s",
+            state["claim_id"],
+            {key: data.get("confidence") for key, data in results.items()},
+        )
+        return update
+
+    return extraction_node
@@ -0,0 +1,147 @@
+"""Fused node — classifies and extracts a small claim in a single LLM call."""
+
+import json
+import logging
+import os
+from collections.abc import Callable
+from typing import Any
+
+from app.graph.nodes.bill_agent import DEFAULT_BILL_DATA, sanitise_bill
+from app.graph.nodes.discharge_agent import DISCHARGE_SCHEMA
+from app.graph.nodes.id_agent import ID_SCHEMA
+from app.graph.nodes.llm_client import LLMUnavailableError, call_llm, collect_page_texts, estimate_tokens
+from app.graph.nodes.segregator import TYPE_GUIDE, format_batch, read_page_labels, remember_llm_label
+from app.graph.state import ClaimState
+
+logger = logging.getLogger(__name__)
+
+# Claims of at most this many estimated tokens are classified and
+# extracted with one request (0 turns fused mode off).
+FUSED_MAX_TOKENS = int(os.getenv("WORKFLOW_FUSED_MAX_TOKENS", "0"))
+
+
+def _null_fields(fields: tuple[str, ...]) -> str:
+    """Describe string fields for the JSON template in ``FUSED_SYSTEM_PROMPT``."""
+    return ", ".join(f'"{name}": "<string or null>"' for name in fields)
+
+
+FUSED_SYSTEM_PROMPT = f"""You are a medical insurance claim processor. You will receive the text content of every page of an insurance claim. Each page starts with a marker line of the form "=== PAGE <page_number> ===".
+
+First classify every page into EXACTLY ONE of the following document types:
+
+{TYPE_GUIDE}
+
+Then extract data from the pages you classified:
+- identity: from identity_document pages only.
+- discharge: from discharge_summary pages only.
+- bill: every line item from itemized_bill pages only. If quantity is missing, assume 1. total_price is quantity × unit_price, and calculated_total is the sum of all total_price values. Do NOT blindly trust any printed total on the document — always compute it yourself.
+
+Required JSON output format:
+{{
+  "pages": [{{"page_number": <page_number>, "document_type": "<one_of_the_allowed_types>"}}],
+  "identity": {{{_null_fields(ID_SCHEMA.fields)}}},
+  "discharge": {{{_null_fields(DISCHARGE_SCHEMA.fields)}}},
+  "bill": {{"items": [{{"description": "<string>", "quantity": <number>, "unit_price": <number>, "total_price": <number>}}], "calculated_total": <number>}}
+}}
+
+Rules:
+- Classify each page on its own content. Do not skip any page.
+- Return null for any field not explicitly found in its pages, and an empty item list if there is no bill.
+- Do NOT hallucinate or fabricate data.
+- Return ONLY the JSON object, no explanation or commentary."""
+
+
+def extract_fused(pages: list[dict[str, Any]]) -> dict[str, Any] | None:
+    """Classify and extract a claim with one LLM call.
+
+    The answer is split back into the state keys the segregator and the
+    agents produce, through the agents' own validators. Identity fields
+    read by the validated patterns override the LLM's, as in the ID agent.
+
+    Args:
+        pages: All extracted pages of the claim.
+
+    Returns:
+        ``classified_pages``, ``id_data``, ``discharge_data`` and
+        ``bill_data`` updates, or ``None`` if the call failed or the
+        answer did not label every page exactly once.
+    """
+    page_numbers = {page["page_number"] for page in pages}
+    try:
+        parsed = json.loads(call_llm(FUSED_SYSTEM_PROMPT, format_batch(pages)))
+    except LLMUnavailableError as exc:
+        logger.warning("Fused — %s", exc)
+        return None
+    except Exception as exc:
+        logger.warning("Fused — LLM call failed or answer was not JSON: %s", exc)
+        return None
+    if not isinstance(parsed, dict):
+        logger.warning("Fused — LLM returned non-dict JSON")
+        return None
+
+    labels = read_page_labels(parsed.get("pages"), page_numbers)
+    if labels.keys() != page_numbers:
+        logger.warning("Fused — answer left pages %s unlabelled", sorted(page_numbers - labels.keys()))
+        return None
+    classified: dict[str, list[int]] = {}
+    for page in pages:
+        doc_type = labels[page["page_number"]]
+        classified.setdefault(doc_type, []).append(page["page_number"])
+        if page.get("text", "").strip():
+            remember_llm_label(page["text"], doc_type)
+
+    def section(key: str) -> dict[str, Any]:
+        """The answer's object under ``key``, or ``{}``."""
+        value = parsed.get(key)
+        return value if isinstance(value, dict) else {}
+
+    id_data = ID_SCHEMA.default()
+    if id_pages := classified.get("identity_document"):
+        prefill = ID_SCHEMA.schema.prefill(collect_page_texts(pages, id_pages))
+        id_data = ID_SCHEMA.result(section("identity"), prefill)
+
+    discharge_data = DISCHARGE_SCHEMA.default()
+    if classified.get("discharge_summary"):
+        discharge_data = DISCHARGE_SCHEMA.result(section("discharge"))
+
+    bill_data = dict(DEFAULT_BILL_DATA)
+    if classified.get("itemized_bill"):
+        bill_data = sanitise_bill(section("bill"))
+
+    return {
+        "classified_pages": classified,
+        "id_data": id_data,
+        "discharge_data": discharge_data,
+        "bill_data": bill_data,
+    }
+
+
+def make_fused_node(fallback: Callable[[ClaimState], dict[str, Any]]) -> Callable[[ClaimState], dict[str, Any]]:
+    """Build a node that processes a small claim with one LLM call.
+
+    Replaces the segregator and the agents when ``WORKFLOW_FUSED_MAX_TOKENS``
+    is set. Claims above that size, and claims whose fused answer is
+    unusable, go through ``fallback`` instead.
+
+    Args:
+        fallback: The pipeline the graph would run without fusion, as a
+            node function returning the same state keys.
+
+    Returns:
+        A node function returning ``classified_pages``, ``id_data``,
+        ``discharge_data`` and ``bill_data``, plus ``degraded_nodes`` from
+        the fallback path.
+    """
+
+    def fused_node(state: ClaimState) -> dict[str, Any]:
+        """Try the fused call, then the fallback pipeline."""
+        tokens = sum(estimate_tokens(page.get("text", "")) for page in state["pages"])
+        if 0 < tokens <= FUSED_MAX_TOKENS:
+            fused = extract_fused(state["pages"])
+            if fused is not None:
+                logger.info("Fused — claim_id=%s classified=%s", state["claim_id"], fused["classified_pages"])
+                return fused
+            logger.info("Fused — claim_id=%s falling back to per-page classification", state["claim_id"])
+        return fallback(state)
+
+    return fused_node
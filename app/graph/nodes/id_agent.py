@@ -1,122 +1,77 @@
 """ID Agent node — extracts identity information from classified pages."""
 
-import json
-import logging
 from typing import Any
 
-from app.graph.nodes.llm_client import call_llm, collect_page_texts
+from app.graph.nodes.extraction import ExtractionSchema, Prefill, compile_schema, extract_fields, run_agent_node
+from app.graph.nodes.llm_client import call_llm
 from app.graph.state import ClaimState
+from app.services.id_extractor import ID_PREFILL_ENABLED, extract_id_fields
 
-logger = logging.getLogger(__name__)
-
-ID_SYSTEM_PROMPT = """You are a medical insurance document data extractor. You will receive text from identity document pages of an insurance claim.
-
-Extract ONLY the following fields from the provided text. Do NOT infer or guess values that are not explicitly present.
-
-Required JSON output format:
-{
-  "patient_name": "<string or null>",
-  "date_of_birth": "<string or null>",
-  "policy_number": "<string or null>",
-  "member_id": "<string or null>",
-  "insurance_provider": "<string or null>"
-}
-
-Rules:
-- Return null for any field not explicitly found in the text.
-- Do NOT hallucinate or fabricate data.
-- Return ONLY the JSON object, no explanation or commentary."""
-
-_ID_FIELDS: list[str] = [
+_ID_FIELDS: tuple[str, ...] = (
     "patient_name",
     "date_of_birth",
     "policy_number",
     "member_id",
     "insurance_provider",
-]
-
-_DEFAULT_ID_DATA: dict[str, Any] = {k: None for k in _ID_FIELDS}
+)
 
+# Fields the deterministic extractor must fill for the LLM call to be
+# skipped. Insurer names have no fixed format, so they are not required.
+_FAST_PATH_FIELDS: list[str] = ["patient_name", "date_of_birth", "policy_number", "member_id"]
 
-def _validate_id_data(parsed: dict[str, Any]) -> dict[str, Any]:
-    """Validate and normalise the LLM output for identity extraction.
 
-    Ensures every expected key exists and values are strings or None.
+def _prefill(text: str) -> Prefill:
+    """Read identity fields with validated patterns and checksums.
 
     Args:
-        parsed: Raw parsed JSON from LLM.
+        text: The combined text of the identity pages.
 
     Returns:
-        A validated identity dict.
+        The findings; complete when every field in ``_FAST_PATH_FIELDS``
+        was found and no label was left with an invalid value. Empty
+        when ``ID_PREFILL_ENABLED`` is off.
     """
-    result: dict[str, Any] = {}
-    for key in _ID_FIELDS:
-        val = parsed.get(key)
-        if val is not None and not isinstance(val, str):
-            val = str(val)
-        result[key] = val if val else None
-    return result
-
+    if not ID_PREFILL_ENABLED:
+        return Prefill()
+    findings = extract_id_fields(text, list(_ID_FIELDS))
+    complete = all(name in findings.fields for name in _FAST_PATH_FIELDS) and not findings.unresolved
+    return Prefill(fields=findings.fields, complete=complete, hints=findings.hints())
+
+
+ID_SCHEMA = compile_schema(
+    ExtractionSchema(
+        name="id_agent",
+        label="ID Agent",
+        doc_type="identity_document",
+        document="identity document",
+        state_key="id_data",
+        fields=_ID_FIELDS,
+        prefill=_prefill,
+    )
+)
 
-def _compute_confidence(data: dict[str, Any]) -> str:
-    """Determine extraction confidence based on filled fields.
-
-    Args:
-        data: Validated identity dict.
-
-    Returns:
-        ``"high"``, ``"medium"``, or ``"low"``.
-    """
-    filled = sum(1 for k in _ID_FIELDS if data.get(k) is not None)
-    total = len(_ID_FIELDS)
-    ratio = filled / total
-    if ratio >= 0.8:
-        return "high"
-    if ratio >= 0.4:
-        return "medium"
-    return "low"
+ID_SYSTEM_PROMPT = ID_SCHEMA.system_prompt
 
 
 def extract_identity(pages: list[dict[str, Any]], page_numbers: list[int]) -> dict[str, Any]:
     """Extract structured identity data from the given pages via LLM.
 
+    Pages matching learned layout templates are read at the stored
+    field positions instead, when that yields every field. Otherwise
+    precompiled patterns with format and checksum checks run first; the
+    LLM is skipped when they fill every field in ``_FAST_PATH_FIELDS``,
+    and is told what they found when they do not.
+
     Args:
         pages: All extracted pages.
         page_numbers: Page numbers classified as identity documents.
 
     Returns:
         Structured identity dict with ``confidence`` field.
-        Falls back to defaults on failure.
+        Falls back to defaults on failure, flagged ``degraded`` when
+        the LLM circuit breaker is open.
     """
-    default = {**_DEFAULT_ID_DATA, "confidence": "low"}
-
-    if not page_numbers:
-        logger.info("ID Agent — no identity pages to process")
-        return default
-
-    combined_text = collect_page_texts(pages, page_numbers)
-    if not combined_text.strip():
-        logger.warning("ID Agent — identity pages are empty")
-        return default
-
-    try:
-        raw = call_llm(ID_SYSTEM_PROMPT, combined_text)
-        parsed = json.loads(raw)
-
-        if not isinstance(parsed, dict):
-            logger.warning("ID Agent — LLM returned non-dict JSON")
-            return default
-
-        validated = _validate_id_data(parsed)
-        validated["confidence"] = _compute_confidence(validated)
-        return validated
-
-    except (json.JSONDecodeError, KeyError, IndexError) as exc:
-        logger.warning("ID Agent — failed to parse LLM response: %s", exc)
-        return default
-    except Exception as exc:
-        logger.error("ID Agent — LLM call failed: %s", exc)
-        return default
+    return extract_fields(ID_SCHEMA, pages, page_numbers, call_llm)
 
 
 def id_agent_node(state: ClaimState) -> dict[str, Any]:
@@ -126,18 +81,7 @@ def id_agent_node(state: ClaimState) -> dict[str, Any]:
         state: Current graph state with classified pages.
 
     Returns:
-        A dict with the ``id_data`` key to merge into state.
+        A dict with the ``id_data`` key to merge into state, plus
+        ``degraded_nodes`` when the LLM backend was unavailable.
     """
-    page_numbers = state["classified_pages"].get("identity_document", [])
-    logger.info(
-        "ID Agent — claim_id=%s processing pages=%s",
-        state["claim_id"],
-        page_numbers,
-    )
-    try:
-        id_data = extract_identity(state["pages"], page_numbers)
-    except Exception as exc:
-        logger.exception("ID Agent — unhandled error for claim %s", state["claim_id"])
-        id_data = {**_DEFAULT_ID_DATA, "confidence": "low"}
-    logger.info("ID Agent — claim_id=%s confidence=%s result=%s", state["claim_id"], id_data.get("confidence"), id_data)
-    return {"id_data": id_data}
+    return run_agent_node(ID_SCHEMA, state, extract_identity)
@@ -1,31 +1,1491 @@
 """Shared Cerebras LLM client for agent nodes."""
 
+import hashlib
+import importlib.util
+import json
+import logging
 import os
-from typing import Any
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from collections.abc import Callable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, TypeVar
 
-from cerebras.cloud.sdk import Cerebras
+import httpx
+from cerebras.cloud.sdk import (
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    Cerebras,
+    DefaultHttpxClient,
+    InternalServerError,
+    RateLimitError,
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+LLM_MODEL = "gpt-oss-120b"
+
+# Connection pool settings for the shared client.
+_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "100"))
+_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))
+_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "60"))
+
+# Response cache settings (see ``LLMResponseCache``). The disk tier is
+# off unless a path is set: answers hold patient data in plaintext.
+_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "")
+_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "2048"))
+_CACHE_DISK_ENTRIES = int(os.getenv("LLM_CACHE_DISK_ENTRIES", "100000"))
+_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# Adaptive concurrency limiter settings (see ``AdaptiveConcurrencyLimiter``).
+_CONCURRENCY_INITIAL = int(os.getenv("LLM_CONCURRENCY_INITIAL", "16"))
+_CONCURRENCY_MIN = int(os.getenv("LLM_CONCURRENCY_MIN", "2"))
+_CONCURRENCY_MAX = int(os.getenv("LLM_CONCURRENCY_MAX", "256"))
+_CONCURRENCY_BACKOFF = float(os.getenv("LLM_CONCURRENCY_BACKOFF", "0.5"))
+_CONCURRENCY_LATENCY_TOLERANCE = float(os.getenv("LLM_CONCURRENCY_LATENCY_TOLERANCE", "2.0"))
+
+# Request/token quota settings (see ``TokenRateLimiter``). 0 disables a bucket.
+_RATE_LIMIT_RPM = float(os.getenv("LLM_RATE_LIMIT_RPM", "0"))
+_RATE_LIMIT_TPM = float(os.getenv("LLM_RATE_LIMIT_TPM", "0"))
+_RATE_LIMIT_MAX_WAIT = float(os.getenv("LLM_RATE_LIMIT_MAX_WAIT", "30"))
+
+# Hedged request settings (see ``HedgePolicy``).
+_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "0") == "1"
+_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+_HEDGE_BUDGET = float(os.getenv("LLM_HEDGE_BUDGET", "0.05"))
+
+# Retry settings (see ``RetryBudget`` and ``llm_call_context``).
+_RETRY_MAX_ATTEMPTS = int(os.getenv("LLM_RETRY_MAX_ATTEMPTS", "3"))
+_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+_RETRY_BUDGET_RATIO = float(os.getenv("LLM_RETRY_BUDGET_RATIO", "0.2"))
+_RETRY_BUDGET_MIN_PER_SECOND = float(os.getenv("LLM_RETRY_BUDGET_MIN_PER_SECOND", "1"))
+_CLAIM_RETRY_BUDGET = int(os.getenv("LLM_CLAIM_RETRY_BUDGET", "10"))
+
+# Circuit breaker settings (see ``CircuitBreaker``).
+_BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", "5"))
+_BREAKER_RECOVERY_SECONDS = float(os.getenv("LLM_BREAKER_RECOVERY_SECONDS", "30"))
+
+# Deadlines: calls are not started with less than this much time left.
+_DEADLINE_MIN_CALL_SECONDS = float(os.getenv("LLM_DEADLINE_MIN_CALL_SECONDS", "1"))
+
+# Streaming mode for JSON answers (see ``call_llm_json_stream``).
+STREAMING_ENABLED = os.getenv("LLM_STREAM_ENABLED", "0") == "1"
 
 _client: Cerebras | None = None
+_cache: "LLMResponseCache | None" = None
+_cache_lock = threading.Lock()
+
+
+class LLMEmptyResponseError(RuntimeError):
+    """The API answered successfully but without any message content."""
+
+
+class LLMStreamInterruptedError(RuntimeError):
+    """A stream failed after parsed items were already handed to the caller.
+
+    Not retried, because replaying the stream would deliver those items
+    a second time.
+    """
+
+
+class LLMCallCancelledError(RuntimeError):
+    """The caller's result is no longer needed, so the call was not made.
+
+    Raised inside a :func:`cancellable_llm_calls` scope once its event is
+    set. Cached answers are still returned.
+    """
+
+
+class LLMUnavailableError(RuntimeError):
+    """The circuit breaker is open, so the call was not attempted.
+
+    Attributes:
+        retry_after: Seconds until the breaker will admit a probe call.
+    """
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f"LLM backend unavailable — circuit open for another {retry_after:.0f}s.")
+        self.retry_after = retry_after
+
+
+class LLMOverloadedError(LLMUnavailableError):
+    """Local limits are saturated, so the call was not attempted.
+
+    Raised when no concurrency slot freed up within the request timeout
+    while the claim still had time, or when the rate-limit backlog is
+    over ``LLM_RATE_LIMIT_MAX_WAIT``. A subclass of
+    :class:`LLMUnavailableError` so nodes degrade and the API answers 503.
+    """
+
+    def __init__(self, reason: str, retry_after: float) -> None:
+        RuntimeError.__init__(self, f"LLM backend overloaded — {reason}.")
+        self.retry_after = retry_after
+
+
+class LLMDeadlineExceededError(LLMUnavailableError):
+    """The claim's deadline leaves too little time to make the call.
+
+    A subclass of :class:`LLMUnavailableError` so nodes fall back to
+    their defaults and report themselves degraded in the same way.
+    """
+
+    def __init__(self, claim_id: str | None = None) -> None:
+        RuntimeError.__init__(self, f"Deadline exceeded for claim {claim_id} — LLM call skipped.")
+        self.retry_after = 0.0
+
+
+def _get_api_key() -> str:
+    """Read the Cerebras API key from the environment.
+
+    Raises:
+        RuntimeError: If CEREBRAS_API_KEY is not set.
+    """
+    api_key = os.getenv("CEREBRAS_API_KEY")
+    if not api_key:
+        raise RuntimeError("CEREBRAS_API_KEY environment variable is not set.")
+    return api_key
+
+
+def _http2_available() -> bool:
+    """Return ``True`` when the optional ``h2`` package is installed."""
+    return importlib.util.find_spec("h2") is not None
+
+
+def _pool_limits() -> httpx.Limits:
+    """Build the keep-alive connection pool limits for the HTTP clients."""
+    return httpx.Limits(
+        max_connections=_POOL_SIZE,
+        max_keepalive_connections=_POOL_SIZE,
+        keepalive_expiry=_KEEPALIVE_EXPIRY,
+    )
 
 
 def get_cerebras_client() -> Cerebras:
     """Return a cached Cerebras client, initialised on first call.
 
+    The client shares one keep-alive connection pool (``LLM_POOL_SIZE``
+    connections, HTTP/2 when ``h2`` is installed) across every node and
+    worker thread. SDK-level retries are disabled; ``call_llm`` applies
+    its own budgeted retry policy.
+
     Raises:
         RuntimeError: If CEREBRAS_API_KEY is not set.
     """
     global _client
     if _client is None:
-        api_key = os.getenv("CEREBRAS_API_KEY")
-        if not api_key:
-            raise RuntimeError("CEREBRAS_API_KEY environment variable is not set.")
-        _client = Cerebras(api_key=api_key)
+        _client = Cerebras(
+            api_key=_get_api_key(),
+            timeout=_REQUEST_TIMEOUT,
+            max_retries=0,
+            http_client=DefaultHttpxClient(limits=_pool_limits(), http2=_http2_available()),
+        )
     return _client
 
 
+def close_llm_client() -> None:
+    """Close the cached client and release its pooled connections."""
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
+
+
+# ---------------------------------------------------------------------------
+# Response cache
+# ---------------------------------------------------------------------------
+
+
+def prompt_version(system_prompt: str) -> str:
+    """Return a short content hash identifying a system prompt revision.
+
+    The version is part of every cache key, so editing a prompt such as
+    ``SYSTEM_PROMPT`` or ``BILL_SYSTEM_PROMPT`` makes its old entries
+    unreachable without touching entries for the other prompts.
+    """
+    return hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:12]
+
+
+def make_cache_key(request: dict[str, Any]) -> str:
+    """Derive a content-addressed cache key from completion parameters.
+
+    Args:
+        request: The chat completion parameters from ``_build_request``.
+
+    Returns:
+        ``"<prompt_version>:<sha256 of the canonical request>"``.
+    """
+    system_prompt = request["messages"][0]["content"]
+    canonical = json.dumps(request, sort_keys=True, ensure_ascii=False)
+    digest = hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+    return f"{prompt_version(system_prompt)}:{digest}"
+
+
+class LLMResponseCache:
+    """Two-tier response cache: an in-process LRU in front of SQLite.
+
+    Entries expire after ``ttl_seconds``. The memory tier holds at most
+    ``memory_entries`` items and the disk tier at most ``disk_entries``;
+    the least recently used entries are evicted first. Disk failures are
+    logged and never propagate to the caller.
+    """
+
+    def __init__(
+        self,
+        path: str | None,
+        memory_entries: int = _CACHE_MEMORY_ENTRIES,
+        disk_entries: int = _CACHE_DISK_ENTRIES,
+        ttl_seconds: float = _CACHE_TTL_SECONDS,
+    ) -> None:
+        self._memory: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._memory_entries = memory_entries
+        self._disk_entries = disk_entries
+        self._ttl = ttl_seconds
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._disk_count = 0
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+        }
+        self._db: sqlite3.Connection | None = None
+        if path:
+            self._open_disk(path)
+
+    def _open_disk(self, path: str) -> None:
+        """Open (or create) the SQLite store, disabling it on failure."""
+        try:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, prompt_version TEXT NOT NULL, value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed_at)")
+            db.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),))
+            self._disk_count = db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            self._db = db
+        except sqlite3.Error as exc:
+            logger.warning("LLM cache — disk tier disabled (%s): %s", path, exc)
+
+    def get(self, key: str, record_miss: bool = True) -> str | None:
+        """Return the cached value for ``key`` or ``None`` on a miss.
+
+        Args:
+            key: Cache key from ``make_cache_key``.
+            record_miss: Count a miss in the stats. Re-checks after an
+                already counted miss pass ``False``.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return entry[1]
+                del self._memory[key]
+
+        row = self._disk_get(key, now)
+        with self._lock:
+            if row is None:
+                if record_miss:
+                    self._stats["misses"] += 1
+                return None
+            self._stats["disk_hits"] += 1
+            self._remember(key, row[0], row[1])
+        return row[1]
+
+    def put(self, key: str, value: str, version: str) -> None:
+        """Store ``value`` in both tiers under ``key``."""
+        expires_at = time.time() + self._ttl
+        with self._lock:
+            self._stats["stores"] += 1
+            self._remember(key, expires_at, value)
+        self._disk_put(key, value, version, expires_at)
+
+    def invalidate_prompt_version(self, version: str) -> None:
+        """Drop every entry produced under the given prompt version."""
+        with self._lock:
+            for key in [k for k in self._memory if k.startswith(f"{version}:")]:
+                del self._memory[key]
+        self._disk_execute("DELETE FROM llm_cache WHERE prompt_version = ?", (version,))
+
+    def clear(self) -> None:
+        """Remove every entry from both tiers."""
+        with self._lock:
+            self._memory.clear()
+        self._disk_execute("DELETE FROM llm_cache", ())
+
+    def stats(self) -> dict[str, Any]:
+        """Return hit/miss counters and tier sizes."""
+        with self._lock:
+            stats: dict[str, Any] = dict(self._stats)
+            stats["memory_size"] = len(self._memory)
+        stats["disk_size"] = self._disk_count if self._db is not None else None
+        return stats
+
+    def _remember(self, key: str, expires_at: float, value: str) -> None:
+        """Insert into the memory LRU. Caller must hold ``self._lock``."""
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._memory_entries:
+            self._memory.popitem(last=False)
+            self._stats["memory_evictions"] += 1
+
+    def _disk_get(self, key: str, now: float) -> tuple[float, str] | None:
+        """Read an unexpired entry from SQLite and refresh its access time."""
+        if self._db is None:
+            return None
+        try:
+            with self._disk_lock:
+                row = self._db.execute(
+                    "SELECT expires_at, value FROM llm_cache WHERE key = ? AND expires_at > ?",
+                    (key, now),
+                ).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            return row
+        except sqlite3.Error as exc:
+            logger.warning("LLM cache — disk read failed: %s", exc)
+            return None
+
+    def _disk_put(self, key: str, value: str, version: str, expires_at: float) -> None:
+        """Upsert an entry into SQLite, evicting the LRU tail when full."""
+        if self._db is None:
+            return
+        try:
+            with self._disk_lock:
+                cursor = self._db.execute(
+                    "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?)",
+                    (key, version, value, expires_at, time.time()),
+                )
+                # Replacing an existing key also reports one row, so the
+                # running count is an upper bound; recount before evicting.
+                self._disk_count += cursor.rowcount
+                if self._disk_count > self._disk_entries:
+                    self._disk_count = self._db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+                overflow = self._disk_count - self._disk_entries
+                if overflow > 0:
+                    self._db.execute(
+                        "DELETE FROM llm_cache WHERE key IN "
+                        "(SELECT key FROM llm_cache ORDER BY accessed_at LIMIT ?)",
+                        (overflow,),
+                    )
+                    self._disk_count = self._db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+                    with self._lock:
+                        self._stats["disk_evictions"] += overflow
+        except sqlite3.Error as exc:
+            logger.warning("LLM cache — disk write failed: %s", exc)
+
+    def _disk_execute(self, sql: str, params: tuple[Any, ...]) -> None:
+        """Run a maintenance statement against SQLite and resync the size."""
+        if self._db is None:
+            return
+        try:
+            with self._disk_lock:
+                self._db.execute(sql, params)
+                self._disk_count = self._db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        except sqlite3.Error as exc:
+            logger.warning("LLM cache — disk maintenance failed: %s", exc)
+
+
+def get_response_cache() -> LLMResponseCache | None:
+    """Return the process-wide response cache, or ``None`` when disabled."""
+    global _cache
+    if not _CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMResponseCache(_CACHE_PATH or None)
+    return _cache
+
+
+def _is_cacheable(content: str) -> bool:
+    """Only cache well-formed JSON so a malformed answer is never pinned."""
+    try:
+        json.loads(content)
+    except ValueError:
+        return False
+    return True
+
+
+# ---------------------------------------------------------------------------
+# Single-flight coalescing
+# ---------------------------------------------------------------------------
+
+
+class SingleFlight:
+    """Coalesce identical in-flight requests onto one shared future.
+
+    The first caller for a key becomes the leader and performs the
+    request; callers arriving before it finishes wait on the leader's
+    ``concurrent.futures.Future``.
+    """
+
+    def __init__(self) -> None:
+        self._inflight: dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._leaders = 0
+        self._coalesced = 0
+
+    def join(self, key: str) -> tuple[Future, bool]:
+        """Return the future for ``key`` and whether the caller leads it."""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self._coalesced += 1
+                return future, False
+            future = Future()
+            self._inflight[key] = future
+            self._leaders += 1
+            return future, True
+
+    def resolve(self, key: str, result: str) -> None:
+        """Publish the leader's result to every waiting caller."""
+        with self._lock:
+            future = self._inflight.pop(key)
+        future.set_result(result)
+
+    def reject(self, key: str, exc: BaseException) -> None:
+        """Propagate the leader's failure to every waiting caller."""
+        with self._lock:
+            future = self._inflight.pop(key)
+        future.set_exception(exc)
+
+    def stats(self) -> dict[str, int]:
+        """Return leader/coalesced counters and the number of open flights."""
+        with self._lock:
+            return {
+                "leaders": self._leaders,
+                "coalesced": self._coalesced,
+                "in_flight": len(self._inflight),
+            }
+
+
+_singleflight = SingleFlight()
+
+
+# ---------------------------------------------------------------------------
+# Request and token rate limiting
+# ---------------------------------------------------------------------------
+
+_TOKEN_PIECE_RE = re.compile(r"\d+|[^\W\d_]+|[^\w\s]|_")
+
+# Chat framing tokens added per message and per request.
+_TOKENS_PER_MESSAGE = 4
+_TOKENS_PER_REQUEST = 3
+
+# Token estimates kept, keyed by a digest of the text.
+_ESTIMATE_CACHE_SIZE = 4096
+_estimate_cache: OrderedDict[bytes, int] = OrderedDict()
+_estimate_lock = threading.Lock()
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate the BPE token count of ``text`` without a tokenizer.
+
+    Words cost one token per ~6 characters, digit runs one per 3 digits
+    and punctuation one each, which tracks the model's tokenizer closely
+    enough for quota scheduling. The last ``_ESTIMATE_CACHE_SIZE``
+    results are cached under a BLAKE2b digest of the text, so repeated
+    system prompts cost one hash and no page text is kept in memory.
+    """
+    key = hashlib.blake2b(text.encode(), digest_size=16).digest()
+    with _estimate_lock:
+        cached = _estimate_cache.get(key)
+        if cached is not None:
+            _estimate_cache.move_to_end(key)
+            return cached
+    tokens = _count_tokens(text)
+    with _estimate_lock:
+        _estimate_cache[key] = tokens
+        if len(_estimate_cache) > _ESTIMATE_CACHE_SIZE:
+            _estimate_cache.popitem(last=False)
+    return tokens
+
+
+def _count_tokens(text: str) -> int:
+    """Uncached token count behind :func:`estimate_tokens`."""
+    tokens = 0
+    for piece in _TOKEN_PIECE_RE.findall(text):
+        if piece[0].isdigit():
+            tokens += (len(piece) + 2) // 3
+        elif piece[0].isalpha():
+            tokens += 1 + (len(piece) - 1) // 6
+        else:
+            tokens += 1
+    return tokens
+
+
+class TokenBucket:
+    """A per-minute token bucket that lets callers reserve into debt.
+
+    ``reserve`` always succeeds and returns how long the caller must wait
+    for the bucket to cover the reservation, so waiters are served in
+    arrival order without polling.
+    """
+
+    def __init__(self, per_minute: float) -> None:
+        self._rate = per_minute / 60.0
+        self._capacity = per_minute
+        self._tokens = per_minute
+        self._updated = time.monotonic()
+
+    def reserve(self, amount: float) -> float:
+        """Take ``amount`` tokens and return the seconds until they exist."""
+        self._refill()
+        self._tokens -= amount
+        return 0.0 if self._tokens >= 0 else -self._tokens / self._rate
+
+    def refund(self, amount: float) -> None:
+        """Give back tokens (negative ``amount`` takes more)."""
+        self._refill()
+        self._tokens = min(self._capacity, self._tokens + amount)
+
+    @property
+    def available(self) -> float:
+        """Tokens currently available (negative while in debt)."""
+        self._refill()
+        return self._tokens
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+
+@dataclass
+class _Reservation:
+    """Quota taken for one request, reconciled against ``usage`` later.
+
+    ``prompt_estimate`` is the uncalibrated estimate, so the observed
+    ratio to ``usage.prompt_tokens`` recalibrates the estimator.
+    ``completion_estimate`` is the part of ``tokens`` expected for the
+    answer.
+    """
+
+    prompt_estimate: int
+    tokens: int
+    delay: float
+    completion_estimate: int = 0
+
+
+class TokenRateLimiter:
+    """Schedule requests under Cerebras request- and token-per-minute quotas.
+
+    Each request reserves one request token plus its estimated prompt
+    tokens and an expected completion size. When the buckets are in
+    debt the caller sleeps until its reservation is covered instead of
+    being rejected by the API. Once the response arrives, the
+    reservation is reconciled with the reported ``usage`` and the
+    prompt estimate is recalibrated.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = _RATE_LIMIT_RPM,
+        tokens_per_minute: float = _RATE_LIMIT_TPM,
+        max_wait: float = _RATE_LIMIT_MAX_WAIT,
+    ) -> None:
+        self._requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self._tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self._max_wait = max_wait
+        self._lock = threading.Lock()
+        self._calibration = 1.0
+        self._completion_ewma = 256.0
+        self._waited = 0.0
+        self._throttled = 0
+
+    def estimate(self, request: dict[str, Any]) -> int:
+        """Estimate the prompt tokens of a chat completion request."""
+        return int(self._raw_estimate(request) * self._calibration)
+
+    def reserve(self, request: dict[str, Any]) -> _Reservation:
+        """Reserve quota for ``request`` and report how long to wait.
+
+        Raises:
+            LLMOverloadedError: If the wait would exceed ``max_wait`` seconds.
+        """
+        raw = self._raw_estimate(request)
+        with self._lock:
+            completion = int(self._completion_ewma)
+            tokens = int(raw * self._calibration) + completion
+            delay = 0.0
+            if self._requests is not None:
+                delay = max(delay, self._requests.reserve(1))
+            if self._tokens is not None:
+                delay = max(delay, self._tokens.reserve(tokens))
+            if delay > self._max_wait:
+                self._give_back(1, tokens)
+                raise LLMOverloadedError(f"rate limit backlog is {delay:.1f}s, over the {self._max_wait:.0f}s limit", delay)
+            if delay > 0:
+                self._throttled += 1
+                self._waited += delay
+        return _Reservation(prompt_estimate=raw, tokens=tokens, delay=delay, completion_estimate=completion)
+
+    def reconcile(self, reservation: _Reservation, usage: Any) -> None:
+        """Settle a reservation against the ``usage`` the API reported."""
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        completion_tokens = getattr(usage, "completion_tokens", None)
+        if prompt_tokens is None or completion_tokens is None:
+            return
+        with self._lock:
+            if reservation.prompt_estimate > 0:
+                ratio = prompt_tokens / reservation.prompt_estimate
+                self._calibration = 0.9 * self._calibration + 0.1 * ratio
+            self._completion_ewma = 0.9 * self._completion_ewma + 0.1 * completion_tokens
+            if self._tokens is not None:
+                self._tokens.refund(reservation.tokens - (prompt_tokens + completion_tokens))
+
+    def cancel(self, reservation: _Reservation) -> None:
+        """Return a reservation for a request that never reached the API."""
+        with self._lock:
+            self._give_back(1, reservation.tokens)
+
+    def settle_failed(self, reservation: _Reservation) -> None:
+        """Settle a request that reached the API but failed without ``usage``.
+
+        The request and its prompt count against the quota all the same,
+        so only the expected completion tokens are returned.
+        """
+        with self._lock:
+            self._give_back(0, reservation.completion_estimate)
+
+    def stats(self) -> dict[str, Any]:
+        """Return bucket levels, calibration and throttling counters."""
+        with self._lock:
+            return {
+                "requests_available": None if self._requests is None else round(self._requests.available, 1),
+                "tokens_available": None if self._tokens is None else round(self._tokens.available),
+                "estimate_calibration": round(self._calibration, 3),
+                "expected_completion_tokens": round(self._completion_ewma),
+                "throttled": self._throttled,
+                "total_wait_seconds": round(self._waited, 3),
+            }
+
+    @staticmethod
+    def _raw_estimate(request: dict[str, Any]) -> int:
+        """Uncalibrated prompt estimate including chat framing tokens."""
+        return _TOKENS_PER_REQUEST + sum(
+            _TOKENS_PER_MESSAGE + estimate_tokens(m["content"]) for m in request["messages"]
+        )
+
+    def _give_back(self, requests: int, tokens: int) -> None:
+        """Refund both buckets. Caller holds the lock."""
+        if self._requests is not None:
+            self._requests.refund(requests)
+        if self._tokens is not None:
+            self._tokens.refund(tokens)
+
+
+_rate_limiter = TokenRateLimiter()
+
+
+# ---------------------------------------------------------------------------
+# Adaptive concurrency limiter
+# ---------------------------------------------------------------------------
+
+
+class _Waiter:
+    """A queued acquirer, woken through its event."""
+
+    __slots__ = ("event", "granted")
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.granted = False
+
+    def wake(self) -> None:
+        """Signal the waiter from any thread."""
+        self.event.set()
+
+
+class AdaptiveConcurrencyLimiter:
+    """Process-wide AIMD limit on outstanding LLM requests.
+
+    Every healthy completion (latency within ``latency_tolerance`` times
+    the best smoothed latency seen, and a low recent error rate) raises
+    the limit by ``1 / limit``, i.e. roughly one slot per full window.
+    A 429 or timeout multiplies the limit by ``backoff``, at most once
+    per smoothed round trip so a single burst cannot collapse it to the
+    floor. Callers over the limit queue in FIFO order.
+    """
+
+    def __init__(
+        self,
+        initial: int = _CONCURRENCY_INITIAL,
+        minimum: int = _CONCURRENCY_MIN,
+        maximum: int = _CONCURRENCY_MAX,
+        backoff: float = _CONCURRENCY_BACKOFF,
+        latency_tolerance: float = _CONCURRENCY_LATENCY_TOLERANCE,
+    ) -> None:
+        self._limit = float(max(minimum, min(initial, maximum)))
+        self._min = minimum
+        self._max = maximum
+        self._backoff = backoff
+        self._latency_tolerance = latency_tolerance
+        self._in_flight = 0
+        self._waiters: deque[_Waiter] = deque()
+        self._lock = threading.Lock()
+        self._latency_ewma: float | None = None
+        self._best_latency: float | None = None
+        self._error_rate = 0.0
+        self._last_decrease = 0.0
+        self._increases = 0
+        self._decreases = 0
+
+    @property
+    def limit(self) -> int:
+        """Current number of requests allowed in flight."""
+        return int(self._limit)
+
+    def acquire(self, timeout: float | None = None) -> None:
+        """Block until a slot is free.
+
+        Raises:
+            TimeoutError: If no slot became free within ``timeout`` seconds.
+        """
+        with self._lock:
+            if not self._waiters and self._in_flight < int(self._limit):
+                self._in_flight += 1
+                return
+            waiter = _Waiter()
+            self._waiters.append(waiter)
+        if not waiter.event.wait(timeout):
+            with self._lock:
+                if not waiter.granted:
+                    self._waiters.remove(waiter)
+                    raise TimeoutError("Timed out waiting for an LLM concurrency slot.")
+
+    def release(self, latency: float | None, overloaded: bool, failed: bool) -> None:
+        """Return a slot and feed the request outcome into the AIMD loop.
+
+        Args:
+            latency: Wall time of the request in seconds, if it ran.
+            overloaded: The backend signalled overload (429 or timeout).
+            failed: The request failed for any reason.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._in_flight -= 1
+            self._error_rate = 0.9 * self._error_rate + (0.1 if failed else 0.0)
+            if overloaded:
+                cooldown = self._latency_ewma or 1.0
+                if now - self._last_decrease >= cooldown:
+                    self._limit = max(float(self._min), self._limit * self._backoff)
+                    self._last_decrease = now
+                    self._decreases += 1
+            elif latency is not None and not failed:
+                self._observe_latency(latency)
+                if self._healthy(latency):
+                    self._limit = min(float(self._max), self._limit + 1.0 / self._limit)
+                    self._increases += 1
+            self._grant_waiters()
+
+    def has_spare_capacity(self) -> bool:
+        """Whether a request could start right now without queueing."""
+        with self._lock:
+            return not self._waiters and self._in_flight < int(self._limit)
+
+    def stats(self) -> dict[str, Any]:
+        """Return the current limit, in-flight count and queue depth."""
+        with self._lock:
+            return {
+                "limit": int(self._limit),
+                "in_flight": self._in_flight,
+                "queue_depth": len(self._waiters),
+                "latency_ewma": self._latency_ewma,
+                "error_rate": round(self._error_rate, 4),
+                "increases": self._increases,
+                "decreases": self._decreases,
+            }
+
+    def _observe_latency(self, latency: float) -> None:
+        """Update the smoothed and best-seen latency. Caller holds the lock."""
+        if self._latency_ewma is None:
+            self._latency_ewma = latency
+        else:
+            self._latency_ewma = 0.8 * self._latency_ewma + 0.2 * latency
+        if self._best_latency is None or self._latency_ewma < self._best_latency:
+            self._best_latency = self._latency_ewma
+
+    def _healthy(self, latency: float) -> bool:
+        """Whether a completion should grow the limit. Caller holds the lock."""
+        if self._error_rate > 0.1:
+            return False
+        return latency <= (self._best_latency or latency) * self._latency_tolerance
+
+    def _grant_waiters(self) -> None:
+        """Hand free slots to queued callers in order. Caller holds the lock."""
+        while self._waiters and self._in_flight < int(self._limit):
+            waiter = self._waiters.popleft()
+            waiter.granted = True
+            self._in_flight += 1
+            waiter.wake()
+
+
+_limiter = AdaptiveConcurrencyLimiter()
+
+
+def _is_overload(exc: BaseException) -> bool:
+    """Whether an error means the backend is shedding load."""
+    return isinstance(exc, (RateLimitError, APITimeoutError, TimeoutError))
+
+
+# ---------------------------------------------------------------------------
+# Hedged requests
+# ---------------------------------------------------------------------------
+
+
+class HedgePolicy:
+    """Decide when to send a duplicate request and keep it within budget.
+
+    The hedge delay is the configured percentile of recent successful
+    latencies. A hedge is only sent while hedges stay under ``budget``
+    of all hedgeable requests and the concurrency limiter has a spare
+    slot, so hedging never adds queueing of its own.
+    """
+
+    _WINDOW = 512
+    _MIN_SAMPLES = 20
+
+    def __init__(self, percentile: float = _HEDGE_PERCENTILE, budget: float = _HEDGE_BUDGET) -> None:
+        self._percentile = percentile
+        self._budget = budget
+        self._latencies: deque[float] = deque(maxlen=self._WINDOW)
+        self._lock = threading.Lock()
+        self._delay: float | None = None
+        self._dirty = 0
+        self._requests = 0
+        self._hedges = 0
+        self._wins = 0
+
+    def record(self, latency: float) -> None:
+        """Add a successful request latency to the sliding window."""
+        with self._lock:
+            self._latencies.append(latency)
+            self._dirty += 1
+
+    def delay(self) -> float | None:
+        """Return the hedge delay, or ``None`` until enough samples exist.
+
+        Also counts the request towards the hedge budget.
+        """
+        with self._lock:
+            self._requests += 1
+            if len(self._latencies) < self._MIN_SAMPLES:
+                return None
+            if self._delay is None or self._dirty >= 16:
+                ordered = sorted(self._latencies)
+                index = min(len(ordered) - 1, int(len(ordered) * self._percentile / 100))
+                self._delay = ordered[index]
+                self._dirty = 0
+            return self._delay
+
+    def try_spend(self) -> bool:
+        """Claim budget for one hedge if the budget and limiter allow it."""
+        if not _limiter.has_spare_capacity():
+            return False
+        with self._lock:
+            if self._hedges + 1 > self._budget * self._requests:
+                return False
+            self._hedges += 1
+            return True
+
+    def record_win(self) -> None:
+        """Count a hedge that answered before its primary."""
+        with self._lock:
+            self._wins += 1
+
+    def stats(self) -> dict[str, Any]:
+        """Return hedge rate, wins and the current delay."""
+        with self._lock:
+            return {
+                "enabled": _HEDGE_ENABLED,
+                "requests": self._requests,
+                "hedges": self._hedges,
+                "hedge_rate": round(self._hedges / self._requests, 4) if self._requests else 0.0,
+                "hedge_wins": self._wins,
+                "delay": self._delay,
+            }
+
+
+_hedger = HedgePolicy()
+_hedge_pool = ThreadPoolExecutor(max_workers=2 * _POOL_SIZE, thread_name_prefix="llm-hedge")
+
+
+def _build_request(system_prompt: str, user_content: str, stream: bool = False) -> dict[str, Any]:
+    """Assemble the chat completion parameters shared by both call paths."""
+    return {
+        "model": LLM_MODEL,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_content},
+        ],
+        "temperature": 0,
+        "top_p": 1,
+        "stream": stream,
+    }
+
+
+def _response_content(response: Any) -> str:
+    """Extract the stripped message content from a completion response.
+
+    Raises:
+        RuntimeError: If the response carries no content.
+    """
+    content = response.choices[0].message.content
+    if not content:
+        raise LLMEmptyResponseError("LLM returned an empty response.")
+    return content.strip()
+
+
+def _cache_lookup(key: str, record_miss: bool = True) -> str | None:
+    """Return a cached response for ``key`` when the cache is enabled."""
+    cache = get_response_cache()
+    return cache.get(key, record_miss) if cache is not None else None
+
+
+def _cache_store(key: str, system_prompt: str, content: str) -> None:
+    """Store a response under ``key`` when the cache is enabled."""
+    cache = get_response_cache()
+    if cache is not None and _is_cacheable(content):
+        cache.put(key, content, prompt_version(system_prompt))
+
+
+@dataclass
+class _Admission:
+    """Handle for a request admitted by the rate and concurrency limiters.
+
+    ``timeout`` is the per-request timeout left by the claim deadline
+    (``None`` means the client default).
+    """
+
+    timeout: float | None = None
+    usage: Any = None
+
+
+@contextmanager
+def _admitted(request: dict[str, Any], record_latency: bool = True) -> Iterator[_Admission]:
+    """Wait for quota and a concurrency slot, then account for the outcome.
+
+    Args:
+        request: The completion parameters, used for the token estimate.
+        record_latency: Feed the latency into the hedge policy. Streams
+            that stop early are not comparable and pass ``False``.
+
+    Yields:
+        An :class:`_Admission`; set its ``usage`` from the response.
+
+    Raises:
+        LLMOverloadedError: If no concurrency slot freed up within the
+            request timeout while the claim still had time.
+        LLMDeadlineExceededError: If the claim deadline passed first.
+    """
+    budget = _deadline_budget()
+    reservation = _rate_limiter.reserve(request)
+    admission = _Admission()
+    acquired = False
+    try:
+        if budget is not None and reservation.delay >= budget:
+            raise _deadline_exceeded()
+        if reservation.delay:
+            time.sleep(reservation.delay)
+        _limiter.acquire(budget)
+        acquired = True
+        admission.timeout = _deadline_budget()
+    except BaseException as exc:
+        if acquired:
+            _limiter.release(None, False, False)
+        _rate_limiter.cancel(reservation)
+        if isinstance(exc, TimeoutError) and budget is not None:
+            if _deadline_passed():
+                raise _deadline_exceeded() from exc
+            # The wait is capped at the request timeout, which can end well before the deadline.
+            raise LLMOverloadedError(f"no request slot freed within {budget:.0f}s", budget) from exc
+        raise
+    started = time.monotonic()
+    try:
+        yield admission
+    except BaseException as exc:
+        # A timeout we imposed to meet the deadline says nothing about load.
+        overloaded = _is_overload(exc) and not _deadline_passed()
+        _limiter.release(time.monotonic() - started, overloaded, isinstance(exc, Exception))
+        _rate_limiter.settle_failed(reservation)
+        raise
+    latency = time.monotonic() - started
+    _limiter.release(latency, False, False)
+    if record_latency:
+        _hedger.record(latency)
+    _rate_limiter.reconcile(reservation, admission.usage)
+
+
+def _fetch(request: dict[str, Any]) -> str:
+    """Perform one completion request on the pooled sync client."""
+    client = get_cerebras_client()
+    with _admitted(request) as admission:
+        response = client.chat.completions.create(**request, timeout=admission.timeout)
+        admission.usage = getattr(response, "usage", None)
+    return _response_content(response)
+
+
+def _fetch_hedged(request: dict[str, Any]) -> str:
+    """Run :func:`_fetch`, adding one hedge if it outlives the hedge delay.
+
+    The primary runs on the hedge pool so the caller can stop waiting as
+    soon as either attempt succeeds. A blocking HTTP call cannot be
+    interrupted, so a losing sync attempt is abandoned and its result
+    discarded when it finishes.
+    """
+    if not _HEDGE_ENABLED or (delay := _hedger.delay()) is None:
+        return _fetch(request)
+
+    primary = _hedge_pool.submit(copy_context().run, _fetch, request)
+    try:
+        return primary.result(timeout=delay)
+    except FutureTimeoutError:
+        pass
+    if not _hedger.try_spend():
+        return primary.result()
+
+    hedge = _hedge_pool.submit(copy_context().run, _fetch, request)
+    pending = {primary, hedge}
+    error: BaseException | None = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                for loser in pending:
+                    loser.cancel()
+                if future is hedge:
+                    _hedger.record_win()
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+# ---------------------------------------------------------------------------
+# Retries
+# ---------------------------------------------------------------------------
+
+
+@dataclass
+class LLMCallContext:
+    """Per-claim state shared by every LLM call made for one claim.
+
+    Set with :func:`llm_call_context`; LangGraph copies context variables
+    into its node threads, so all nodes of a claim draw on one object.
+    ``deadline`` is a ``time.monotonic()`` value; ``deadline_exceeded``
+    records that a call was skipped or cut short because of it.
+    """
+
+    claim_id: str
+    retries_left: int = _CLAIM_RETRY_BUDGET
+    deadline: float | None = None
+    deadline_exceeded: bool = False
+
+    def __post_init__(self) -> None:
+        self._lock = threading.Lock()
+
+    def try_spend_retry(self) -> bool:
+        """Take one retry from the claim's budget if any is left."""
+        with self._lock:
+            if self.retries_left <= 0:
+                return False
+            self.retries_left -= 1
+            return True
+
+    def refund_retry(self) -> None:
+        """Return a retry that the process budget then refused."""
+        with self._lock:
+            self.retries_left += 1
+
+
+_call_context: ContextVar[LLMCallContext | None] = ContextVar("llm_call_context", default=None)
+
+
+@contextmanager
+def llm_call_context(claim_id: str, deadline: float | None = None) -> Iterator[LLMCallContext]:
+    """Scope LLM calls to a claim so they share its retry budget and deadline.
+
+    Args:
+        claim_id: The claim the enclosed calls are made for.
+        deadline: ``time.monotonic()`` value by which the claim must be
+            answered, or ``None`` for no deadline.
+
+    Yields:
+        The active :class:`LLMCallContext`.
+    """
+    context = LLMCallContext(claim_id, deadline=deadline)
+    token = _call_context.set(context)
+    try:
+        yield context
+    finally:
+        _call_context.reset(token)
+
+
+def get_call_context() -> LLMCallContext | None:
+    """Return the claim context of the current LLM calls, if any."""
+    return _call_context.get()
+
+
+_cancel_event: ContextVar[threading.Event | None] = ContextVar("llm_cancel_event", default=None)
+
+
+@contextmanager
+def cancellable_llm_calls(cancelled: threading.Event) -> Iterator[None]:
+    """Stop enclosed work from making new LLM calls once ``cancelled`` is set.
+
+    Calls already sent are not interrupted; later ones raise
+    :class:`LLMCallCancelledError` unless their answer is cached.
+
+    Args:
+        cancelled: Set by the owner when the enclosed work's result is
+            no longer needed.
+    """
+    token = _cancel_event.set(cancelled)
+    try:
+        yield
+    finally:
+        _cancel_event.reset(token)
+
+
+def _check_cancelled() -> None:
+    """Raise :class:`LLMCallCancelledError` if the caller has been cancelled."""
+    event = _cancel_event.get()
+    if event is not None and event.is_set():
+        raise LLMCallCancelledError("LLM call skipped — its result is no longer needed.")
+
+
+def _deadline_exceeded() -> LLMDeadlineExceededError:
+    """Flag the current claim as past its deadline and build the error."""
+    context = _call_context.get()
+    if context is None:
+        return LLMDeadlineExceededError()
+    context.deadline_exceeded = True
+    return LLMDeadlineExceededError(context.claim_id)
+
+
+def _remaining_time() -> float | None:
+    """Seconds left before the current claim's deadline, if it has one."""
+    context = _call_context.get()
+    if context is None or context.deadline is None:
+        return None
+    return max(0.0, context.deadline - time.monotonic())
+
+
+def _deadline_passed(after: float = 0.0) -> bool:
+    """Whether the claim would have too little time for a call ``after`` seconds from now."""
+    remaining = _remaining_time()
+    return remaining is not None and remaining - after < _DEADLINE_MIN_CALL_SECONDS
+
+
+def _deadline_budget() -> float | None:
+    """Seconds one LLM request may take under the claim deadline.
+
+    Returns:
+        ``None`` when there is no deadline, else the time remaining
+        capped at the client's request timeout.
+
+    Raises:
+        LLMDeadlineExceededError: If less than the minimum call time is left.
+    """
+    context = _call_context.get()
+    if context is None or context.deadline is None:
+        return None
+    remaining = context.deadline - time.monotonic()
+    if remaining < _DEADLINE_MIN_CALL_SECONDS:
+        raise _deadline_exceeded()
+    return min(_REQUEST_TIMEOUT, remaining)
+
+
+class RetryBudget:
+    """Process-wide cap on retries as a fraction of first attempts.
+
+    Each request deposits ``ratio`` of a retry and each retry withdraws
+    one, with a trickle of ``min_per_second`` so low traffic can still
+    retry. During an outage the balance drains and retries stop, instead
+    of multiplying load on a struggling backend.
+    """
+
+    def __init__(
+        self,
+        ratio: float = _RETRY_BUDGET_RATIO,
+        min_per_second: float = _RETRY_BUDGET_MIN_PER_SECOND,
+        capacity: float = 100.0,
+    ) -> None:
+        self._ratio = ratio
+        self._min_per_second = min_per_second
+        self._capacity = capacity
+        self._balance = min(capacity, 10.0)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        """Credit the budget for one first attempt."""
+        with self._lock:
+            self._refill()
+            self._balance = min(self._capacity, self._balance + self._ratio)
+
+    def try_withdraw(self) -> bool:
+        """Spend one retry if the balance allows it."""
+        with self._lock:
+            self._refill()
+            if self._balance < 1.0:
+                return False
+            self._balance -= 1.0
+            return True
+
+    @property
+    def balance(self) -> float:
+        """Retries currently available."""
+        with self._lock:
+            self._refill()
+            return self._balance
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._balance = min(self._capacity, self._balance + (now - self._updated) * self._min_per_second)
+        self._updated = now
+
+
+_retry_budget = RetryBudget()
+_retry_stats = {"retries": 0, "claim_budget_exhausted": 0, "process_budget_exhausted": 0, "gave_up": 0}
+_retry_stats_lock = threading.Lock()
+
+
+def _count_retry_event(name: str) -> None:
+    with _retry_stats_lock:
+        _retry_stats[name] += 1
+
+
+def _retry_snapshot() -> dict[str, Any]:
+    """Return retry counters and the process budget balance."""
+    with _retry_stats_lock:
+        snapshot: dict[str, Any] = dict(_retry_stats)
+    snapshot["process_budget"] = round(_retry_budget.balance, 2)
+    return snapshot
+
+
+def is_transient_error(exc: BaseException) -> bool:
+    """Whether an LLM failure is worth retrying.
+
+    Timeouts, connection errors, 408/409/429 and 5xx responses are
+    transient; other 4xx responses (bad request, auth) are permanent.
+    """
+    if isinstance(exc, (APIConnectionError, RateLimitError, InternalServerError, LLMEmptyResponseError)):
+        return True
+    if isinstance(exc, APIStatusError):
+        return exc.status_code in (408, 409, 429) or exc.status_code >= 500
+    return False
+
+
+def _retry_after(exc: BaseException) -> float | None:
+    """Read a ``Retry-After`` delay in seconds from an API error, if any."""
+    response = getattr(exc, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _backoff_delay(attempt: int, exc: BaseException) -> float:
+    """Full-jitter exponential backoff, honouring ``Retry-After``."""
+    ceiling = min(_RETRY_MAX_DELAY, _RETRY_BASE_DELAY * (2 ** (attempt - 1)))
+    delay = random.uniform(0, ceiling)
+    retry_after = _retry_after(exc)
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, _RETRY_MAX_DELAY))
+    return delay
+
+
+def _should_retry(exc: Exception, attempt: int) -> bool:
+    """Decide whether to retry after ``attempt`` failed, spending budget."""
+    if not is_transient_error(exc) or attempt >= _RETRY_MAX_ATTEMPTS:
+        _count_retry_event("gave_up")
+        return False
+    context = _call_context.get()
+    if context is not None and not context.try_spend_retry():
+        _count_retry_event("claim_budget_exhausted")
+        logger.warning("LLM retry budget exhausted for claim %s", context.claim_id)
+        return False
+    if not _retry_budget.try_withdraw():
+        if context is not None:
+            context.refund_retry()
+        _count_retry_event("process_budget_exhausted")
+        logger.warning("LLM process-wide retry budget exhausted")
+        return False
+    _count_retry_event("retries")
+    return True
+
+
+# ---------------------------------------------------------------------------
+# Circuit breaker
+# ---------------------------------------------------------------------------
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker around the LLM backend.
+
+    ``failure_threshold`` consecutive transient failures open the circuit,
+    and calls then fail at once with :class:`LLMUnavailableError` instead
+    of waiting out timeouts. After ``recovery_seconds`` one probe call is
+    let through (half-open): success closes the circuit, failure opens
+    it again for another full recovery period.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = _BREAKER_FAILURE_THRESHOLD,
+        recovery_seconds: float = _BREAKER_RECOVERY_SECONDS,
+    ) -> None:
+        self._threshold = failure_threshold
+        self._recovery = recovery_seconds
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._short_circuited = 0
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """The current breaker state."""
+        with self._lock:
+            return self._state
+
+    def before_call(self) -> None:
+        """Admit a call or fail fast.
+
+        Raises:
+            LLMUnavailableError: If the circuit is open, or half-open with
+                its probe already in flight.
+        """
+        with self._lock:
+            if self._state == self.OPEN:
+                remaining = self._opened_at + self._recovery - time.monotonic()
+                if remaining > 0:
+                    self._short_circuited += 1
+                    raise LLMUnavailableError(remaining)
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self._state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    self._short_circuited += 1
+                    raise LLMUnavailableError(self._recovery)
+                self._probe_in_flight = True
+
+    def record_success(self) -> None:
+        """Close the circuit and reset the failure streak."""
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self, exc: BaseException) -> None:
+        """Count a failure; only transient backend errors can trip it."""
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._probe_in_flight = False
+            if not is_transient_error(exc):
+                return
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self._threshold:
+                if self._state != self.OPEN:
+                    logger.error("LLM circuit breaker opened after %d failures", self._failures)
+                    self._opened += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def retry_after(self) -> float:
+        """Seconds until an open circuit admits its next probe (0 if closed)."""
+        with self._lock:
+            if self._state != self.OPEN:
+                return 0.0
+            return max(0.0, self._opened_at + self._recovery - time.monotonic())
+
+    def stats(self) -> dict[str, Any]:
+        """Return the breaker state and counters."""
+        with self._lock:
+            return {
+                "state": self._state,
+                "consecutive_failures": self._failures,
+                "times_opened": self._opened,
+                "short_circuited": self._short_circuited,
+            }
+
+
+_breaker = CircuitBreaker()
+
+
+def circuit_retry_after() -> float:
+    """Seconds until the LLM circuit breaker admits calls again."""
+    return _breaker.retry_after()
+
+
+def _with_retry(attempt_fn: Callable[[], T]) -> T:
+    """Run ``attempt_fn`` behind the breaker, retrying transient failures."""
+    _retry_budget.deposit()
+    attempt = 0
+    while True:
+        attempt += 1
+        _breaker.before_call()
+        try:
+            result = attempt_fn()
+        except BaseException as exc:
+            if isinstance(exc, Exception) and _deadline_passed():
+                # Cut short by our own deadline, not by the backend.
+                error = exc if isinstance(exc, LLMDeadlineExceededError) else _deadline_exceeded()
+                _breaker.record_failure(error)
+                if error is exc:
+                    raise
+                raise error from exc
+            _breaker.record_failure(exc)
+            if not isinstance(exc, Exception) or not _should_retry(exc, attempt):
+                raise
+            delay = _backoff_delay(attempt, exc)
+            if _deadline_passed(after=delay):
+                raise _deadline_exceeded() from exc
+            logger.warning("LLM call failed (%s) — retry %d in %.2fs", type(exc).__name__, attempt, delay)
+            time.sleep(delay)
+        else:
+            _breaker.record_success()
+            return result
+
+
 def call_llm(system_prompt: str, user_content: str) -> str:
     """Send a chat completion request to Cerebras and return raw content.
 
+    Identical requests are answered from the response cache, and an
+    identical request that is already in flight is joined rather than
+    sent a second time.
+
     Args:
         system_prompt: The system-level instruction.
         user_content: The user-level input text.
@@ -34,20 +1494,327 @@ def call_llm(system_prompt: str, user_content: str) -> str:
         The raw string content from the LLM response.
 
     Raises:
+        LLMUnavailableError: If the circuit breaker is open, (as
+            :class:`LLMOverloadedError`) local limits are saturated,
+            or (as :class:`LLMDeadlineExceededError`) the claim deadline
+            leaves no time for the call.
+        LLMCallCancelledError: If the caller was cancelled (see
+            :func:`cancellable_llm_calls`).
         RuntimeError: If the API call fails or returns no content.
     """
+    request = _build_request(system_prompt, user_content)
+    key = make_cache_key(request)
+    if (cached := _cache_lookup(key)) is not None:
+        return cached
+    _check_cancelled()
+
+    future, leader = _singleflight.join(key)
+    if not leader:
+        try:
+            return future.result(timeout=_remaining_time())
+        except FutureTimeoutError:
+            raise _deadline_exceeded() from None
+        except LLMDeadlineExceededError:
+            # The leader ran out of *its* claim's time; ours may remain.
+            if _deadline_passed():
+                raise
+            return call_llm(system_prompt, user_content)
+
+    try:
+        # A previous leader may have finished between our lookup and join.
+        content = _cache_lookup(key, record_miss=False)
+        if content is None:
+            content = _with_retry(lambda: _fetch_hedged(request))
+            _cache_store(key, system_prompt, content)
+    except BaseException as exc:
+        _singleflight.reject(key, exc)
+        raise
+    _singleflight.resolve(key, content)
+    return content
+
+
+# ---------------------------------------------------------------------------
+# Streaming completions
+# ---------------------------------------------------------------------------
+
+
+class IncrementalJSONParser:
+    """Parse a streamed JSON object as its text arrives.
+
+    Top-level fields become available in :attr:`fields` the moment their
+    value closes, so a caller can stop reading once the fields it needs
+    are in. Elements of top-level arrays named in ``item_keys`` are
+    returned from :meth:`feed` one by one as each element closes. Any
+    text before the opening brace (e.g. a code fence) is ignored.
+    """
+
+    def __init__(self, item_keys: tuple[str, ...] = ()) -> None:
+        self.fields: dict[str, Any] = {}
+        self.done = False
+        self._item_keys = item_keys
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._started = False
+        self._in_string = False
+        self._escape = False
+        self._expect_key = True
+        self._key: str | None = None
+        self._key_start = -1
+        self._value_start = -1
+        self._value_scalar = False
+        self._item_key: str | None = None
+        self._item_start = -1
+        self._item_scalar = False
+
+    @property
+    def text(self) -> str:
+        """All text received so far."""
+        return self._text
+
+    def has_fields(self, names: tuple[str, ...]) -> bool:
+        """Whether every named top-level field has been parsed."""
+        return bool(names) and all(name in self.fields for name in names)
+
+    def feed(self, chunk: str) -> list[Any]:
+        """Consume a chunk and return array items completed by it.
+
+        Raises:
+            ValueError: If a completed value is not valid JSON.
+        """
+        self._text += chunk
+        items: list[Any] = []
+        text = self._text
+        for i in range(self._pos, len(text)):
+            if self.done:
+                break
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    self._string_closed(i, items)
+                continue
+            if not self._started:
+                if c == "{":
+                    self._started = True
+                    self._depth = 1
+                continue
+            if c == '"':
+                self._value_begins(i, c)
+                self._in_string = True
+            elif c in "{[":
+                self._value_begins(i, c)
+                self._depth += 1
+            elif c in "}]":
+                self._scalar_closed(i, items)
+                self._depth -= 1
+                self._container_closed(i, items)
+            elif c == ",":
+                self._scalar_closed(i, items)
+                if self._depth == 1:
+                    self._expect_key = True
+            elif c == ":":
+                if self._depth == 1:
+                    self._expect_key = False
+            elif not c.isspace():
+                self._value_begins(i, c)
+        self._pos = len(text)
+        return items
+
+    def _value_begins(self, i: int, c: str) -> None:
+        if self._depth == 1:
+            if self._expect_key:
+                if c == '"':
+                    self._key_start = i
+            elif self._value_start < 0:
+                self._value_start = i
+                self._value_scalar = c not in '"{['
+                if c == "[" and self._key in self._item_keys:
+                    self._item_key = self._key
+        elif self._depth == 2 and self._item_key is not None and self._item_start < 0:
+            self._item_start = i
+            self._item_scalar = c not in '"{['
+
+    def _string_closed(self, i: int, items: list[Any]) -> None:
+        if self._depth == 1:
+            if self._key_start >= 0:
+                self._key = json.loads(self._text[self._key_start:i + 1])
+                self._key_start = -1
+            elif self._value_start >= 0 and not self._value_scalar:
+                self._field_closed(self._text[self._value_start:i + 1])
+        elif self._depth == 2 and self._item_start >= 0 and not self._item_scalar:
+            self._item_closed(self._text[self._item_start:i + 1], items)
+
+    def _scalar_closed(self, i: int, items: list[Any]) -> None:
+        if self._depth == 1 and self._value_start >= 0 and self._value_scalar:
+            self._field_closed(self._text[self._value_start:i].strip())
+        elif self._depth == 2 and self._item_start >= 0 and self._item_scalar:
+            self._item_closed(self._text[self._item_start:i].strip(), items)
+
+    def _container_closed(self, i: int, items: list[Any]) -> None:
+        if self._depth == 0:
+            self.done = True
+        elif self._depth == 1 and self._value_start >= 0:
+            self._field_closed(self._text[self._value_start:i + 1])
+        elif self._depth == 2 and self._item_start >= 0:
+            self._item_closed(self._text[self._item_start:i + 1], items)
+
+    def _field_closed(self, raw: str) -> None:
+        if self._key is not None:
+            self.fields[self._key] = json.loads(raw)
+        self._key = None
+        self._value_start = -1
+        self._item_key = None
+
+    def _item_closed(self, raw: str, items: list[Any]) -> None:
+        items.append(json.loads(raw))
+        self._item_start = -1
+
+
+def _stream_result(parser: IncrementalJSONParser, required_fields: tuple[str, ...]) -> dict[str, Any]:
+    """Return the parsed object from a finished or early-stopped stream.
+
+    Raises:
+        LLMEmptyResponseError: If the stream carried no text.
+        json.JSONDecodeError: If the text is not a JSON object.
+    """
+    if parser.done or parser.has_fields(required_fields):
+        return parser.fields
+    if not parser.text.strip():
+        raise LLMEmptyResponseError("LLM returned an empty response.")
+    parsed = json.loads(parser.text.strip())
+    if not isinstance(parsed, dict):
+        raise json.JSONDecodeError("Expected a JSON object", parser.text, 0)
+    return parsed
+
+
+def _chunk_text(chunk: Any, admission: _Admission) -> str:
+    """Return a stream chunk's content delta, recording any usage it carries."""
+    usage = getattr(chunk, "usage", None)
+    if usage is not None:
+        admission.usage = usage
+    if not chunk.choices:
+        return ""
+    return chunk.choices[0].delta.content or ""
+
+
+def _deliver(items: list[Any], on_item: Callable[[Any], None] | None, delivered: list[int]) -> None:
+    """Hand completed array items to the caller and count them."""
+    for item in items:
+        delivered[0] += 1
+        if on_item is not None:
+            on_item(item)
+
+
+def _stream_once(
+    request: dict[str, Any],
+    required_fields: tuple[str, ...],
+    item_key: str | None,
+    on_item: Callable[[Any], None] | None,
+    delivered: list[int],
+) -> dict[str, Any]:
+    """Stream one completion, stopping once ``required_fields`` are parsed."""
     client = get_cerebras_client()
-    response = client.chat.completions.create(
-        model="gpt-oss-120b",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_content},
-        ],
-        temperature=0,
-        top_p=1,
-        stream=False,
-    )
-    return response.choices[0].message.content.strip()
+    parser = IncrementalJSONParser((item_key,) if item_key else ())
+    with _admitted(request, record_latency=False) as admission:
+        stream = client.chat.completions.create(**request, timeout=admission.timeout)
+        try:
+            for chunk in stream:
+                _deliver(parser.feed(_chunk_text(chunk, admission)), on_item, delivered)
+                if parser.done or parser.has_fields(required_fields):
+                    break
+        except Exception as exc:
+            if delivered[0]:
+                raise LLMStreamInterruptedError(f"Stream failed after {delivered[0]} items: {exc}") from exc
+            raise
+        finally:
+            stream.close()
+    return _stream_result(parser, required_fields)
+
+
+def _stream_cache_key(request: dict[str, Any], required_fields: tuple[str, ...], item_key: str | None) -> str:
+    """Cache key for a streamed answer; early stopping depends on the fields."""
+    return make_cache_key({**request, "required_fields": sorted(required_fields), "item_key": item_key})
+
+
+def _replay_cached(
+    cached: str,
+    item_key: str | None,
+    on_item: Callable[[Any], None] | None,
+) -> dict[str, Any]:
+    """Decode a cached streamed answer and replay its items to ``on_item``."""
+    parsed = json.loads(cached)
+    if item_key and on_item is not None and isinstance(parsed.get(item_key), list):
+        for item in parsed[item_key]:
+            on_item(item)
+    return parsed
+
+
+def call_llm_json_stream(
+    system_prompt: str,
+    user_content: str,
+    required_fields: tuple[str, ...] = (),
+    item_key: str | None = None,
+    on_item: Callable[[Any], None] | None = None,
+) -> dict[str, Any]:
+    """Stream a JSON-object completion and return as soon as it is usable.
+
+    The response is parsed while it streams. Once every name in
+    ``required_fields`` has a closed value (or the object closes), the
+    rest of the stream is cancelled. Elements of the ``item_key`` array
+    are passed to ``on_item`` as each one closes, so callers can
+    validate them while the model is still generating.
+
+    Args:
+        system_prompt: The system-level instruction.
+        user_content: The user-level input text.
+        required_fields: Top-level fields that complete the answer.
+        item_key: Name of a top-level array whose items to stream.
+        on_item: Callback for each streamed ``item_key`` element.
+
+    Returns:
+        The parsed top-level fields.
+
+    Raises:
+        LLMUnavailableError: If the circuit breaker is open, (as
+            :class:`LLMOverloadedError`) local limits are saturated,
+            or (as :class:`LLMDeadlineExceededError`) the claim deadline
+            leaves no time for the call.
+        LLMCallCancelledError: If the caller was cancelled (see
+            :func:`cancellable_llm_calls`).
+        LLMStreamInterruptedError: If the stream broke after items were
+            delivered.
+        json.JSONDecodeError: If the answer is not a JSON object.
+        RuntimeError: If the API call fails or returns no content.
+    """
+    request = _build_request(system_prompt, user_content, stream=True)
+    key = _stream_cache_key(request, required_fields, item_key)
+    if (cached := _cache_lookup(key)) is not None:
+        return _replay_cached(cached, item_key, on_item)
+    _check_cancelled()
+
+    delivered = [0]
+    parsed = _with_retry(lambda: _stream_once(request, required_fields, item_key, on_item, delivered))
+    _cache_store(key, system_prompt, json.dumps(parsed, ensure_ascii=False))
+    return parsed
+
+
+def get_llm_stats() -> dict[str, Any]:
+    """Return a snapshot of the LLM client's operational counters."""
+    cache = get_response_cache()
+    return {
+        "cache": cache.stats() if cache is not None else None,
+        "singleflight": _singleflight.stats(),
+        "concurrency": _limiter.stats(),
+        "rate_limit": _rate_limiter.stats(),
+        "hedging": _hedger.stats(),
+        "retries": _retry_snapshot(),
+        "circuit_breaker": _breaker.stats(),
+    }
 
 
 def collect_page_texts(
@@ -2,13 +2,52 @@
 
 import json
 import logging
-from typing import Any
+import os
+import threading
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Any, TypeVar
 
-from app.graph.nodes.llm_client import call_llm
+from app.graph.nodes.llm_client import (
+    STREAMING_ENABLED,
+    LLMUnavailableError,
+    call_llm,
+    call_llm_json_stream,
+    estimate_tokens,
+)
 from app.graph.state import ClaimState
+from app.services.layout_templates import match_layout
+from app.services.page_fingerprint import lookup_page_type, remember_page_type
+from app.services.page_rules import PAGE_RULES_ENABLED, classify_by_rules, score_by_rules
+from app.services.page_runs import RUN_THRESHOLD, continuation_score
+from app.services.text_classifier import classify_locally, record_label
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+R = TypeVar("R")
+
+# Max pages of one claim being classified at the same time.
+_CLASSIFY_CONCURRENCY = int(os.getenv("SEGREGATOR_CONCURRENCY", "8"))
+
+# Batched mode: pack pages into one request up to this many estimated
+# prompt tokens (0 classifies each page with its own request).
+_BATCH_TOKENS = int(os.getenv("SEGREGATOR_BATCH_TOKENS", "0"))
+
+# Run mode: pages that clearly continue the previous page's document
+# inherit its type instead of being classified on their own.
+_RUN_MODE = os.getenv("SEGREGATOR_RUN_MODE", "0") == "1"
+
+# Excerpt mode: pages longer than these budgets are first classified from
+# their first ``_HEAD_TOKENS`` plus last ``_TAIL_TOKENS`` estimated tokens
+# (0 always sends the full page).
+_HEAD_TOKENS = int(os.getenv("SEGREGATOR_HEAD_TOKENS", "0"))
+_TAIL_TOKENS = int(os.getenv("SEGREGATOR_TAIL_TOKENS", "48"))
+
+# Batch rounds that re-ask only for pages missing from the previous answer.
+_BATCH_REASK_ROUNDS = 1
+
 ALLOWED_TYPES: set[str] = {
     "claim_forms",
     "cheque_or_bank_details",
@@ -21,11 +60,7 @@ ALLOWED_TYPES: set[str] = {
     "other",
 }
 
-SYSTEM_PROMPT = """You are an insurance document classifier. You will receive the text content of a single page from a medical insurance claim document.
-
-Classify the page into EXACTLY ONE of the following document types:
-
-- claim_forms: Standardized insurance claim forms (e.g., pre-authorization forms, cashless claim forms, reimbursement request forms).
+TYPE_GUIDE = """- claim_forms: Standardized insurance claim forms (e.g., pre-authorization forms, cashless claim forms, reimbursement request forms).
 - cheque_or_bank_details: Pages containing bank account information, cancelled cheques, or payment details.
 - identity_document: Government-issued identification such as Aadhaar card, PAN card, passport, driving license, voter ID.
 - itemized_bill: Hospital or medical bills listing individual charges, procedures, medicines, room charges with amounts.
@@ -33,66 +68,468 @@ Classify the page into EXACTLY ONE of the following document types:
 - prescription: Doctor's prescriptions listing medicines, dosages, and instructions.
 - investigation_report: Lab reports, diagnostic test results, imaging reports (X-ray, MRI, CT scan, blood work).
 - cash_receipt: Payment receipts, acknowledgements of payment received, transaction confirmations.
-- other: Any page that does not clearly fit into the above categories.
+- other: Any page that does not clearly fit into the above categories."""
+
+SYSTEM_PROMPT = f"""You are an insurance document classifier. You will receive the text content of a single page from a medical insurance claim document.
+
+Classify the page into EXACTLY ONE of the following document types:
+
+{TYPE_GUIDE}
 
 Respond with ONLY a JSON object in this exact format:
-{"document_type": "<one_of_the_allowed_types>"}
+{{"document_type": "<one_of_the_allowed_types>"}}
 
 Do not include any explanation, commentary, or additional text."""
 
+BATCH_SYSTEM_PROMPT = f"""You are an insurance document classifier. You will receive the text content of several pages from a medical insurance claim document. Each page starts with a marker line of the form "=== PAGE <page_number> ===".
+
+Classify every page into EXACTLY ONE of the following document types:
+
+{TYPE_GUIDE}
+
+Respond with ONLY a JSON array containing one object per page, in the order the pages appear:
+[{{"page_number": <page_number>, "document_type": "<one_of_the_allowed_types>"}}]
+
+Classify each page on its own content. Do not skip any page and do not include any explanation, commentary, or additional text."""
+
 
 def classify_page(text: str) -> str:
     """Classify a single page's text into a document type via the LLM.
 
+    In excerpt mode (``SEGREGATOR_HEAD_TOKENS``), a long page is first
+    classified from its head and tail only. The full page is sent when
+    that answer is ``"other"`` or contradicts the keyword rules.
+
     Args:
         text: The extracted text content of one PDF page.
 
     Returns:
         One of the ``ALLOWED_TYPES`` strings. Falls back to ``"other"``
         on any failure.
+
+    Raises:
+        LLMUnavailableError: If the LLM circuit breaker is open, so the
+            caller can mark the result as degraded.
     """
     if not text.strip():
         logger.debug("Empty page text — defaulting to 'other'")
         return "other"
 
+    excerpt = _page_excerpt(text) if _HEAD_TOKENS > 0 else None
+    if excerpt is not None:
+        doc_type = _ask_llm(excerpt)
+        if doc_type not in (None, "other") and not _contradicts_rules(text, doc_type):
+            remember_llm_label(text, doc_type)
+            return doc_type
+        logger.info("Excerpt answer '%s' not trusted — classifying the full page", doc_type)
+
+    doc_type = _ask_llm(text)
+    if doc_type is None:
+        return "other"
+    remember_llm_label(text, doc_type)
+    return doc_type
+
+
+def _ask_llm(content: str) -> str | None:
+    """Ask the LLM for one page's type, returning ``None`` on any failure.
+
+    Raises:
+        LLMUnavailableError: If the LLM circuit breaker is open.
+    """
     try:
-        raw = call_llm(SYSTEM_PROMPT, text)
-        parsed = json.loads(raw)
+        if STREAMING_ENABLED:
+            # The answer is a single field; stop reading once it closes.
+            parsed = call_llm_json_stream(SYSTEM_PROMPT, content, required_fields=("document_type",))
+        else:
+            parsed = json.loads(call_llm(SYSTEM_PROMPT, content))
         doc_type = parsed.get("document_type", "other")
 
         if doc_type not in ALLOWED_TYPES:
             logger.warning("LLM returned invalid type '%s' — defaulting to 'other'", doc_type)
-            return "other"
-
+            return None
         return doc_type
 
     except (json.JSONDecodeError, KeyError, IndexError) as exc:
         logger.warning("Failed to parse LLM response: %s", exc)
-        return "other"
+        return None
+    except LLMUnavailableError:
+        raise
     except Exception as exc:
         logger.error("LLM call failed: %s", exc)
-        return "other"
+        return None
 
 
-def segregator_node(state: ClaimState) -> dict[str, Any]:
+def _page_excerpt(text: str) -> str | None:
+    """Cut a page down to its head and tail lines for excerpt mode.
+
+    Whole lines are kept from the top up to ``_HEAD_TOKENS`` and from the
+    bottom up to ``_TAIL_TOKENS`` estimated tokens, joined by an
+    omission marker. A first line longer than the head budget is cut.
+
+    Returns:
+        The excerpt, or ``None`` if the page already fits the budgets.
+    """
+    if estimate_tokens(text) <= _HEAD_TOKENS + _TAIL_TOKENS:
+        return None
+    lines = text.splitlines()
+    head: list[str] = []
+    used = 0
+    for line in lines:
+        cost = estimate_tokens(line)
+        if used + cost > _HEAD_TOKENS:
+            break
+        head.append(line)
+        used += cost
+    if not head:
+        # ~4 characters per token for prose.
+        head.append(lines[0][: _HEAD_TOKENS * 4])
+    tail: list[str] = []
+    used = 0
+    for line in reversed(lines[len(head):]):
+        cost = estimate_tokens(line)
+        if used + cost > _TAIL_TOKENS:
+            break
+        tail.insert(0, line)
+        used += cost
+    if len(head) + len(tail) >= len(lines) and head[0] == lines[0]:
+        return None
+    return "\n".join([*head, "[...]", *tail])
+
+
+def _contradicts_rules(text: str, doc_type: str) -> bool:
+    """Whether the keyword rules point at another type and not at all at ``doc_type``."""
+    scores = score_by_rules(text).scores
+    return bool(scores) and doc_type not in scores
+
+
+def remember_llm_label(text: str, doc_type: str) -> None:
+    """Feed an LLM label to the local tiers: the fingerprint index and training log."""
+    remember_page_type(text, doc_type)
+    record_label(text, doc_type)
+
+
+def _classify_page_isolated(page: dict[str, Any]) -> tuple[str, bool]:
+    """Classify one page without letting its failure affect the others.
+
+    Args:
+        page: A page dict with ``page_number`` and ``text``.
+
+    Returns:
+        The document type and whether it is a degraded fallback.
+    """
+    try:
+        return classify_page(page.get("text", "")), False
+    except LLMUnavailableError as exc:
+        logger.warning("Page %d — %s", page["page_number"], exc)
+        return "other", True
+    except Exception:
+        logger.exception("Page %d — classification failed", page["page_number"])
+        return "other", False
+
+
+def format_batch(pages: list[dict[str, Any]]) -> str:
+    """Join page texts under the page markers ``BATCH_SYSTEM_PROMPT`` describes."""
+    return "\n\n".join(f"=== PAGE {page['page_number']} ===\n{page.get('text', '')}" for page in pages)
+
+
+def _pack_batches(pages: list[dict[str, Any]]) -> list[list[dict[str, Any]]]:
+    """Group consecutive pages into batches of at most ``_BATCH_TOKENS``.
+
+    A page larger than the budget gets a batch of its own.
+    """
+    batches: list[list[dict[str, Any]]] = []
+    current: list[dict[str, Any]] = []
+    used = 0
+    for page in pages:
+        cost = estimate_tokens(page.get("text", "")) + 8  # page marker
+        if current and used + cost > _BATCH_TOKENS:
+            batches.append(current)
+            current, used = [], 0
+        current.append(page)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _parse_batch_labels(raw: str, page_numbers: set[int]) -> dict[int, str]:
+    """Read the valid labels out of a batched classification answer.
+
+    Args:
+        raw: The LLM's JSON array of ``{page_number, document_type}``.
+        page_numbers: Pages that were asked about.
+
+    Returns:
+        Page number to document type, for pages that got exactly one
+        label in ``ALLOWED_TYPES``. Other pages are left out so they can
+        be asked about again.
+
+    Raises:
+        json.JSONDecodeError: If the answer is not JSON.
+    """
+    parsed = json.loads(raw)
+    if isinstance(parsed, dict):
+        # Tolerate the array being wrapped in an object.
+        parsed = next((v for v in parsed.values() if isinstance(v, list)), [])
+    return read_page_labels(parsed, page_numbers)
+
+
+def read_page_labels(parsed: Any, page_numbers: set[int]) -> dict[int, str]:
+    """Read valid labels from a parsed ``[{page_number, document_type}]`` list.
+
+    Args:
+        parsed: The decoded answer; anything but a list gives no labels.
+        page_numbers: Pages that were asked about.
+
+    Returns:
+        Page number to document type, for pages that got exactly one
+        label in ``ALLOWED_TYPES``.
+    """
+    if not isinstance(parsed, list):
+        return {}
+
+    labels: dict[int, str] = {}
+    repeated: set[int] = set()
+    for entry in parsed:
+        if not isinstance(entry, dict):
+            continue
+        page_num = entry.get("page_number")
+        if isinstance(page_num, str) and page_num.strip().isdigit():
+            page_num = int(page_num)
+        if isinstance(page_num, bool) or page_num not in page_numbers:
+            continue
+        doc_type = entry.get("document_type")
+        if doc_type not in ALLOWED_TYPES:
+            logger.warning("Batch answer gave page %s invalid type '%s'", page_num, doc_type)
+            continue
+        if page_num in labels:
+            repeated.add(page_num)
+        labels[page_num] = doc_type
+    for page_num in repeated:
+        logger.warning("Batch answer labelled page %d more than once", page_num)
+        del labels[page_num]
+    return labels
+
+
+def _classify_batch(pages: list[dict[str, Any]]) -> dict[int, tuple[str, bool]]:
+    """Classify a batch of pages with one request, re-asking for gaps.
+
+    Pages missing a valid label are re-asked as a smaller batch, up to
+    ``_BATCH_REASK_ROUNDS`` times, and then one request per page.
+
+    Args:
+        pages: The pages of one batch.
+
+    Returns:
+        Page number to ``(document type, degraded)`` for every page.
+    """
+    results: dict[int, tuple[str, bool]] = {}
+    pending = []
+    for page in pages:
+        if page.get("text", "").strip():
+            pending.append(page)
+        else:
+            results[page["page_number"]] = ("other", False)
+
+    for _ in range(1 + _BATCH_REASK_ROUNDS):
+        if not pending:
+            break
+        try:
+            raw = call_llm(BATCH_SYSTEM_PROMPT, format_batch(pending))
+            labels = _parse_batch_labels(raw, {page["page_number"] for page in pending})
+        except LLMUnavailableError as exc:
+            logger.warning("Pages %s — %s", [page["page_number"] for page in pending], exc)
+            results.update({page["page_number"]: ("other", True) for page in pending})
+            return results
+        except Exception as exc:
+            logger.warning("Batched classification failed: %s", exc)
+            labels = {}
+        results.update({num: (doc_type, False) for num, doc_type in labels.items()})
+        for page in pending:
+            if page["page_number"] in labels:
+                remember_llm_label(page["text"], labels[page["page_number"]])
+        if not labels:
+            # Asking the same question again would get the same answer.
+            break
+        pending = [page for page in pending if page["page_number"] not in labels]
+        if pending:
+            logger.info("Batch answer missed pages %s — re-asking", [page["page_number"] for page in pending])
+
+    for page in pending:
+        results[page["page_number"]] = _classify_page_isolated(page)
+    return results
+
+
+def _map_in_pool(
+    fn: Callable[[T], R],
+    items: list[T],
+    on_done: Callable[[int, R], None] | None = None,
+) -> list[R]:
+    """Apply ``fn`` to ``items`` concurrently, returning results in order.
+
+    At most ``SEGREGATOR_CONCURRENCY`` calls are in flight. Each task
+    runs in a copy of the caller's context so LLM calls keep the claim's
+    retry budget and deadline.
+
+    Args:
+        fn: The function to apply.
+        items: Its inputs.
+        on_done: Called with an item's index and result as soon as that
+            item finishes, from the worker thread.
+    """
+    workers = max(1, min(_CLASSIFY_CONCURRENCY, len(items)))
+    if workers == 1:
+        results = []
+        for index, item in enumerate(items):
+            results.append(fn(item))
+            if on_done is not None:
+                on_done(index, results[-1])
+        return results
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="segregator") as pool:
+        futures = [pool.submit(copy_context().run, fn, item) for item in items]
+        if on_done is not None:
+            for index, future in enumerate(futures):
+                future.add_done_callback(lambda done, index=index: on_done(index, done.result()))
+        return [future.result() for future in futures]
+
+
+def _classify_with_llm(
+    pages: list[dict[str, Any]],
+    on_result: Callable[[int, tuple[str, bool]], None] | None = None,
+) -> list[tuple[str, bool]]:
+    """Classify pages concurrently with the LLM, returning results in page order.
+
+    With ``SEGREGATOR_BATCH_TOKENS`` set, pages are packed into batched
+    requests; otherwise each page gets its own request. ``on_result``
+    receives each page's index in ``pages`` and result as it is known.
+    """
+    if _BATCH_TOKENS <= 0:
+        return _map_in_pool(_classify_page_isolated, pages, on_result)
+
+    positions = {page["page_number"]: index for index, page in enumerate(pages)}
+
+    def report_batch(_batch_index: int, batch_results: dict[int, tuple[str, bool]]) -> None:
+        for page_num, result in batch_results.items():
+            on_result(positions[page_num], result)
+
+    results: dict[int, tuple[str, bool]] = {}
+    for batch_results in _map_in_pool(_classify_batch, _pack_batches(pages), report_batch if on_result else None):
+        results.update(batch_results)
+    return [results[page["page_number"]] for page in pages]
+
+
+def _classify_pages(
+    pages: list[dict[str, Any]],
+    on_result: Callable[[int, tuple[str, bool]], None] | None = None,
+) -> list[tuple[str, bool]]:
+    """Classify pages, returning ``(document type, degraded)`` in page order.
+
+    Pages matching a learned layout template take its type. The other
+    tiers run cheapest first: keyword rules, then near-duplicates of
+    pages the LLM has already labeled, then the local model trained on
+    past LLM labels. Only pages none of them settles are sent to the LLM.
+    In run mode, pages that continue the previous page's document are
+    not sent either; they inherit its type once it is known.
+
+    Args:
+        pages: The claim's pages, in order.
+        on_result: Called with a page's index and result as soon as the
+            page is settled, possibly from a worker thread.
+    """
+    results: list[tuple[str, bool] | None] = [None] * len(pages)
+    for index, page in enumerate(pages):
+        text = page.get("text", "")
+        if (layout := match_layout(page)) is not None and layout.template.doc_type in ALLOWED_TYPES:
+            results[index] = (layout.template.doc_type, False)
+        elif PAGE_RULES_ENABLED and (doc_type := classify_by_rules(text).doc_type) in ALLOWED_TYPES:
+            results[index] = (doc_type, False)
+        elif (doc_type := lookup_page_type(text)) in ALLOWED_TYPES:
+            results[index] = (doc_type, False)
+        elif (local := classify_locally(text)) is not None and local[0] in ALLOWED_TYPES:
+            results[index] = (local[0], False)
+
+    ambiguous = [index for index, result in enumerate(results) if result is None]
+    if ambiguous:
+        logger.info("Local tiers labeled %d of %d pages", len(pages) - len(ambiguous), len(pages))
+    followers = set(_run_followers(pages, ambiguous) if _RUN_MODE else [])
+    heads = sorted(set(ambiguous) - followers)
+    lock = threading.Lock()
+
+    def settle(index: int, result: tuple[str, bool]) -> None:
+        # A settled page also settles the run of followers after it.
+        settled = []
+        with lock:
+            while True:
+                results[index] = result
+                settled.append(index)
+                index += 1
+                if index not in followers:
+                    break
+        if on_result is not None:
+            for page_index in settled:
+                on_result(page_index, result)
+
+    for index, result in [(index, result) for index, result in enumerate(results) if result is not None]:
+        settle(index, result)
+    _classify_with_llm([pages[i] for i in heads], lambda position, result: settle(heads[position], result))
+    return results
+
+
+def _run_followers(pages: list[dict[str, Any]], candidates: list[int]) -> list[int]:
+    """Pick the pages that continue the document on the page before them.
+
+    Only unlabeled pages are candidates. A page follows when its
+    continuation score reaches ``SEGREGATOR_RUN_THRESHOLD``; pages below
+    it, whether clearly a new document or an uncertain boundary, are
+    classified on their own.
+
+    Args:
+        pages: All pages of the claim, in order.
+        candidates: Indexes of the pages still without a type.
+
+    Returns:
+        Indexes of the following pages, ascending.
+    """
+    followers = [
+        index for index in candidates
+        if index > 0
+        and continuation_score(pages[index - 1].get("text", ""), pages[index].get("text", "")) >= RUN_THRESHOLD
+    ]
+    if followers:
+        logger.info("Run mode — %d of %d pages inherit the previous page's type", len(followers), len(pages))
+    return followers
+
+
+def segregator_node(
+    state: ClaimState,
+    on_page: Callable[[int, str], None] | None = None,
+) -> dict[str, Any]:
     """Classify each page into a document category using Cerebras LLM.
 
-    Iterates over every page, sends its text to the LLM for
-    classification, and groups page numbers by document type.
+    Unambiguous pages are labeled by keyword rules; the rest are
+    classified concurrently by the LLM (see ``SEGREGATOR_CONCURRENCY``).
+    Page numbers are grouped by document type, in page order. Pages that
+    cannot be classified because the LLM circuit is open default to
+    ``"other"`` and the node is reported as degraded.
 
     Args:
         state: Current graph state containing extracted pages.
+        on_page: Called with a page's index and document type as soon as
+            the page is classified, possibly from a worker thread, so
+            callers can start on pages before the whole claim is done.
 
     Returns:
-        A dict with the ``classified_pages`` key to merge into state.
+        A dict with the ``classified_pages`` key to merge into state,
+        plus ``degraded_nodes`` when the LLM backend was unavailable.
     """
     pages = state["pages"]
+    report = (lambda index, result: on_page(index, result[0])) if on_page is not None else None
     classified: dict[str, list[int]] = {t: [] for t in ALLOWED_TYPES}
+    degraded = False
 
-    for page in pages:
+    for page, (doc_type, page_degraded) in zip(pages, _classify_pages(pages, report)):
         page_num: int = page["page_number"]
-        text: str = page.get("text", "")
-        doc_type = classify_page(text)
+        degraded = degraded or page_degraded
         classified[doc_type].append(page_num)
         logger.info(
             "Page %d → %s (claim_id=%s)",
@@ -109,4 +546,7 @@ def segregator_node(state: ClaimState) -> dict[str, Any]:
         state["claim_id"],
         classified,
     )
-    return {"classified_pages": classified}
+    result: dict[str, Any] = {"classified_pages": classified}
+    if degraded:
+        result["degraded_nodes"] = ["segregator"]
+    return result
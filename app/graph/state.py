@@ -1,6 +1,7 @@
 """Shared state definition for the claim processing LangGraph workflow."""
 
-from typing import Any, TypedDict
+import operator
+from typing import Annotated, Any, TypedDict
 
 
 class ClaimState(TypedDict):
@@ -14,6 +15,12 @@ class ClaimState(TypedDict):
         discharge_data: Structured data extracted by the discharge summary agent.
         bill_data: Structured data extracted by the itemized bill agent.
         final_output: Aggregated result combining all agent outputs.
+        degraded_nodes: Names of nodes that fell back to defaults because
+            the LLM backend was unavailable. Nodes run in parallel, so
+            their entries are concatenated.
+        deadline: ``time.monotonic()`` value by which the claim must be
+            answered, or ``None`` for no deadline. LLM calls derive their
+            timeouts from it and are skipped once it has passed.
     """
 
     claim_id: str
@@ -23,3 +30,5 @@ class ClaimState(TypedDict):
     discharge_data: dict[str, Any]
     bill_data: dict[str, Any]
     final_output: dict[str, Any]
+    degraded_nodes: Annotated[list[str], operator.add]
+    deadline: float | None
@@ -1,44 +1,125 @@
 """LangGraph workflow definition for the claim processing pipeline."""
 
 import logging
+import os
+from collections.abc import Callable
 from typing import Any
 
 from langgraph.graph import END, START, StateGraph
 
 from app.graph.nodes.aggregator import aggregator_node
 from app.graph.nodes.bill_agent import bill_agent_node
-from app.graph.nodes.discharge_agent import discharge_agent_node
-from app.graph.nodes.id_agent import id_agent_node
+from app.graph.nodes.discharge_agent import DISCHARGE_SCHEMA, discharge_agent_node
+from app.graph.nodes.dispatcher import dispatcher_node
+from app.graph.nodes.extraction import COMBINE_TOKENS, make_extraction_node
+from app.graph.nodes.fused import FUSED_MAX_TOKENS, make_fused_node
+from app.graph.nodes.id_agent import ID_SCHEMA, id_agent_node
+from app.graph.nodes.llm_client import llm_call_context
 from app.graph.nodes.segregator import segregator_node
 from app.graph.state import ClaimState
+from app.services.layout_templates import record_layout_samples
 
 logger = logging.getLogger(__name__)
 
+# Start each extraction agent as soon as its pages are classified instead
+# of after the whole claim is.
+STREAMING_DISPATCH = os.getenv("WORKFLOW_STREAMING_DISPATCH", "0") == "1"
+
+# Field extraction agents that can share LLM requests (see
+# ``EXTRACTION_COMBINE_TOKENS``).
+EXTRACTION_SCHEMAS = [ID_SCHEMA, DISCHARGE_SCHEMA]
+
 # ---------------------------------------------------------------------------
 # Graph construction
 # ---------------------------------------------------------------------------
 
-graph_builder = StateGraph(ClaimState)
-
-# Nodes
-graph_builder.add_node("segregator", segregator_node)
-graph_builder.add_node("id_agent", id_agent_node)
-graph_builder.add_node("discharge_agent", discharge_agent_node)
-graph_builder.add_node("bill_agent", bill_agent_node)
-graph_builder.add_node("aggregator", aggregator_node)
-
-# Edges
-graph_builder.add_edge(START, "segregator")
-graph_builder.add_edge("segregator", "id_agent")
-graph_builder.add_edge("segregator", "discharge_agent")
-graph_builder.add_edge("segregator", "bill_agent")
-graph_builder.add_edge("id_agent", "aggregator")
-graph_builder.add_edge("discharge_agent", "aggregator")
-graph_builder.add_edge("bill_agent", "aggregator")
-graph_builder.add_edge("aggregator", END)
+
+def build_workflow(
+    streaming_dispatch: bool = STREAMING_DISPATCH,
+    fused: bool = FUSED_MAX_TOKENS > 0,
+    combine_extraction: bool = COMBINE_TOKENS > 0,
+) -> Any:
+    """Build and compile the claim processing graph.
+
+    Args:
+        streaming_dispatch: Replace the segregator → agents fan-out with
+            the dispatcher node, which starts each agent as soon as its
+            pages are classified.
+        fused: Put the fused node in front of the pipeline. It handles
+            claims up to ``WORKFLOW_FUSED_MAX_TOKENS`` with a single LLM
+            call and runs the pipeline the other two flags select for
+            the rest.
+        combine_extraction: In the fan-out graph, run the agents in
+            ``EXTRACTION_SCHEMAS`` as one ``extraction`` node that can
+            answer several of them with a single LLM request.
+
+    Returns:
+        The compiled LangGraph workflow.
+    """
+    graph_builder = StateGraph(ClaimState)
+    graph_builder.add_node("aggregator", aggregator_node)
+    graph_builder.add_edge("aggregator", END)
+
+    if fused:
+        fallback = _pipeline_node(streaming_dispatch, combine_extraction)
+        graph_builder.add_node("fused", make_fused_node(fallback))
+        graph_builder.add_edge(START, "fused")
+        graph_builder.add_edge("fused", "aggregator")
+    else:
+        _add_pipeline(graph_builder, streaming_dispatch, combine_extraction, "aggregator")
+    return graph_builder.compile()
+
+
+def _add_pipeline(graph_builder: StateGraph, streaming_dispatch: bool, combine_extraction: bool, end: str) -> None:
+    """Add the classification and extraction nodes, from ``START`` to ``end``."""
+    if streaming_dispatch:
+        graph_builder.add_node("dispatcher", dispatcher_node)
+        graph_builder.add_edge(START, "dispatcher")
+        graph_builder.add_edge("dispatcher", end)
+        return
+
+    # Nodes
+    graph_builder.add_node("segregator", segregator_node)
+    agents = ["bill_agent"]
+    graph_builder.add_node("bill_agent", bill_agent_node)
+    if combine_extraction:
+        agents.append("extraction")
+        graph_builder.add_node("extraction", make_extraction_node(EXTRACTION_SCHEMAS))
+    else:
+        agents += ["id_agent", "discharge_agent"]
+        graph_builder.add_node("id_agent", id_agent_node)
+        graph_builder.add_node("discharge_agent", discharge_agent_node)
+
+    # Edges
+    graph_builder.add_edge(START, "segregator")
+    for agent in agents:
+        graph_builder.add_edge("segregator", agent)
+        graph_builder.add_edge(agent, end)
+
+
+# State keys the classification and extraction pipeline produces.
+_PIPELINE_KEYS = ("classified_pages", "id_data", "discharge_data", "bill_data")
+
+
+def _pipeline_node(streaming_dispatch: bool, combine_extraction: bool) -> Callable[[ClaimState], dict[str, Any]]:
+    """Compile the pipeline without the aggregator and wrap it as one node function."""
+    graph_builder = StateGraph(ClaimState)
+    _add_pipeline(graph_builder, streaming_dispatch, combine_extraction, END)
+    pipeline = graph_builder.compile()
+
+    def pipeline_node(state: ClaimState) -> dict[str, Any]:
+        """Run the pipeline and return its updates to the outer graph."""
+        result = pipeline.invoke(state)
+        update: dict[str, Any] = {key: result[key] for key in _PIPELINE_KEYS}
+        # ``degraded_nodes`` is concatenated, so only the new entries go back.
+        update["degraded_nodes"] = result["degraded_nodes"][len(state.get("degraded_nodes", [])):]
+        return update
+
+    return pipeline_node
+
 
 # Compile once at module level
-workflow = graph_builder.compile()
+workflow = build_workflow()
 
 # ---------------------------------------------------------------------------
 # Public API
@@ -48,12 +129,15 @@ workflow = graph_builder.compile()
 def run_claim_workflow(
     claim_id: str,
     pages: list[dict[str, Any]],
+    deadline: float | None = None,
 ) -> dict[str, Any]:
     """Execute the full claim processing graph.
 
     Args:
         claim_id: Unique identifier for the claim.
         pages: Page-level extracted text from the uploaded PDF.
+        deadline: ``time.monotonic()`` value by which the result is
+            needed. Nodes that run out of time return partial results.
 
     Returns:
         The ``final_output`` dict produced by the aggregator node.
@@ -66,10 +150,19 @@ def run_claim_workflow(
         "discharge_data": {},
         "bill_data": {},
         "final_output": {},
+        "degraded_nodes": [],
+        "deadline": deadline,
     }
 
     logger.info("Workflow started — claim_id=%s pages=%d", claim_id, len(pages))
-    result = workflow.invoke(initial_state)
+    # LLM calls made by every node share this claim's retry budget and deadline.
+    with llm_call_context(claim_id, deadline):
+        result = workflow.invoke(initial_state)
+    record_layout_samples(
+        pages,
+        result["classified_pages"],
+        {"identity_document": result["id_data"], "discharge_summary": result["discharge_data"]},
+    )
     logger.info("Workflow completed — claim_id=%s", claim_id)
 
     return result["final_output"]
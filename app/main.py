@@ -3,15 +3,23 @@
 import logging
 import os
 import sys
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
 
-import uvicorn
 from dotenv import load_dotenv
-from fastapi import FastAPI
-
-from app.api.routes import router
 
+# The app's modules read their settings from the environment at import,
+# so .env must be loaded before any of them.
 load_dotenv()
 
+import uvicorn  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+
+from app.api.routes import router  # noqa: E402
+from app.graph.nodes.llm_client import close_llm_client  # noqa: E402
+from app.services.layout_templates import get_template_index  # noqa: E402
+from app.services.text_classifier import get_text_classifier  # noqa: E402
+
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s | %(levelname)-8s | %(name)s | %(message)s",
@@ -20,10 +28,21 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    """Load the local page classifier and layout templates at startup; release LLM connections at shutdown."""
+    get_text_classifier()
+    get_template_index()
+    yield
+    close_llm_client()
+
+
 app = FastAPI(
     title="Claim Processing Pipeline",
     description="Production-ready API for processing insurance claim documents.",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 app.include_router(router)
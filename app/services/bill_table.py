@@ -0,0 +1,231 @@
+"""Geometry-based itemized bill parser over PyMuPDF word positions.
+
+Words are grouped into rows by their vertical position. A header row
+naming columns such as qty, rate and amount, when present, fixes where
+each number belongs; otherwise trailing numbers are read as
+``rate amount``, ``qty rate amount`` or ``qty x rate = amount``. A lone
+trailing number is only read as an amount under a header, since
+headerless pages also carry rows such as "Age 45" or "Bill No 12345".
+Each row with trailing numbers is a candidate line item, and the share
+of candidates that parse consistently is the parser's confidence.
+"""
+
+import logging
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+BILL_TABLE_ENABLED = os.getenv("BILL_TABLE_ENABLED", "0") == "1"
+
+# Share of a page's candidate rows that must parse for the LLM to be skipped.
+MIN_CONFIDENCE = float(os.getenv("BILL_TABLE_MIN_CONFIDENCE", "0.9"))
+
+_COLUMN_KEYWORDS: dict[str, set[str]] = {
+    "description": {"description", "particulars", "item", "items", "service", "services", "details"},
+    "quantity": {"qty", "quantity", "units", "nos"},
+    "unit_price": {"rate", "price", "mrp", "unit"},
+    "amount": {"amount", "amt", "total", "value"},
+}
+
+_NUMBER_RE = re.compile(r"(?i)^(?:rs\.?|₹|inr)?(\d{1,3}(?:,\d{2,3})+|\d+)(\.\d{1,2})?(?:/-)?$")
+_WORDS_RE = re.compile(r"[a-z]+")
+_CURRENCY = {"rs", "rs.", "₹", "inr", "inr."}
+_SEPARATORS = _CURRENCY | {"x", "×", "*", "=", "@", "/-", ":", "-"}
+
+# A row whose description is only one of these holds the printed total.
+_TOTAL_RE = re.compile(
+    r"(?i)(?:grand\s+)?total(?:\s+amount)?(?:\s+payable)?|net\s+(?:amount|payable)|amount\s+payable|bill\s+amount"
+)
+# Running totals that repeat amounts already counted in the item rows.
+_SUBTOTAL_RE = re.compile(
+    r"(?i)\b(?:sub[\s-]?total|carried\s+(?:forward|over)|brought\s+forward|c/f|b/f|balance\s+forward)\b"
+)
+
+
+@dataclass
+class BillTable:
+    """Line items read from one page's geometry.
+
+    Attributes:
+        items: ``description``/``quantity``/``unit_price``/``total_price``
+            dicts, ready for ``bill_agent._validate_item``.
+        printed_total: The total printed on the page, if any.
+        candidates: Rows that looked like line items.
+        confidence: Share of candidate rows that parsed consistently.
+    """
+
+    items: list[dict[str, Any]] = field(default_factory=list)
+    printed_total: float | None = None
+    candidates: int = 0
+    confidence: float = 0.0
+
+
+def is_running_total(description: str) -> bool:
+    """Whether a bill row is a subtotal or a total carried between pages."""
+    return _SUBTOTAL_RE.search(description) is not None
+
+
+def is_header_row(description: str) -> bool:
+    """Whether a bill row is a column header, as repeated at the top of each page.
+
+    Every word must be a column keyword, naming at least two columns
+    ("Description Qty Rate Amount"), so a charge such as "Room Rent" is
+    never taken for a header.
+    """
+    words = _WORDS_RE.findall(description.lower())
+    columns = {column for column, keywords in _COLUMN_KEYWORDS.items() for word in words if word in keywords}
+    return len(columns) >= 2 and all(any(word in keywords for keywords in _COLUMN_KEYWORDS.values()) for word in words)
+
+
+def _to_number(token: str) -> float | None:
+    match = _NUMBER_RE.match(token)
+    if match is None:
+        return None
+    return float(match.group(1).replace(",", "") + (match.group(2) or ""))
+
+
+def _group_rows(words: list[list[Any]]) -> list[list[list[Any]]]:
+    """Group words into rows by vertical centre, each row left to right."""
+    rows: list[list[list[Any]]] = []
+    centres: list[float] = []
+    for word in sorted(words, key=lambda w: ((w[1] + w[3]) / 2, w[0])):
+        centre = (word[1] + word[3]) / 2
+        tolerance = max(word[3] - word[1], 0.004) / 2
+        if rows and abs(centre - centres[-1]) <= tolerance:
+            rows[-1].append(word)
+        else:
+            rows.append([word])
+            centres.append(centre)
+    return [sorted(row, key=lambda w: w[0]) for row in rows]
+
+
+def _split_row(row: list[list[Any]]) -> tuple[str, list[tuple[float, float]], set[str]]:
+    """Split a row into its description and trailing ``(number, x-centre)`` pairs.
+
+    Returns:
+        The description text, the numbers in order and the separator
+        tokens (``x``, ``=``, currency) seen among them.
+    """
+    cut = len(row)
+    while cut > 0 and (_to_number(row[cut - 1][4]) is not None or row[cut - 1][4].lower() in _SEPARATORS):
+        cut -= 1
+    numbers: list[tuple[float, float]] = []
+    markers: set[str] = set()
+    for word in row[cut:]:
+        value = _to_number(word[4])
+        if value is None:
+            markers.add(word[4].lower())
+        else:
+            numbers.append((value, (word[0] + word[2]) / 2))
+            if not word[4][0].isdigit():
+                markers.add("rs")
+    return " ".join(word[4] for word in row[:cut]), numbers, markers
+
+
+def _header_columns(row: list[list[Any]]) -> dict[str, float]:
+    """Return column x-centres if ``row`` is a table header, else ``{}``."""
+    positions: dict[str, list[float]] = {}
+    for word in row:
+        token = word[4].lower().strip(".:()")
+        if _to_number(word[4]) is not None:
+            return {}
+        for column, keywords in _COLUMN_KEYWORDS.items():
+            if token in keywords:
+                positions.setdefault(column, []).append((word[0] + word[2]) / 2)
+    if "amount" not in positions or len(positions) < 2:
+        return {}
+    return {column: sum(xs) / len(xs) for column, xs in positions.items()}
+
+
+def _close(expected: float, actual: float) -> bool:
+    return abs(expected - actual) <= max(0.01, 0.005 * actual)
+
+
+def _infer_item(
+    numbers: list[tuple[float, float]],
+    columns: dict[str, float],
+    markers: set[str],
+) -> tuple[float, float, float] | None:
+    """Work out ``(quantity, unit_price, amount)`` from a row's numbers."""
+    values = [value for value, _ in numbers]
+    if len(values) >= 3:
+        quantity, rate, amount = values[-3:]
+        return (quantity, rate, amount) if _close(quantity * rate, amount) else None
+
+    numeric_columns = {c: x for c, x in columns.items() if c != "description"}
+    mapped: dict[str, float] = {}
+    if numeric_columns:
+        for value, x in numbers:
+            column = min(numeric_columns, key=lambda c: abs(numeric_columns[c] - x))
+            if column in mapped:
+                return None
+            mapped[column] = value
+
+    if len(values) == 2:
+        if {"quantity", "amount"} <= mapped.keys() and mapped["quantity"] > 0:
+            return mapped["quantity"], mapped["amount"] / mapped["quantity"], mapped["amount"]
+        if {"unit_price", "amount"} <= mapped.keys() and mapped["unit_price"] > 0:
+            quantity = mapped["amount"] / mapped["unit_price"]
+            return (round(quantity), mapped["unit_price"], mapped["amount"]) if _close(round(quantity), quantity) else None
+        if {"quantity", "unit_price"} <= mapped.keys():
+            return mapped["quantity"], mapped["unit_price"], mapped["quantity"] * mapped["unit_price"]
+        if not mapped and values[0] == values[1]:
+            return 1.0, values[0], values[0]
+        if not mapped and "x" in markers and "=" not in markers:
+            return values[0], values[1], values[0] * values[1]
+        return None
+
+    if len(values) == 1 and columns and mapped.get("quantity") is None:
+        return 1.0, values[0], values[0]
+    return None
+
+
+def parse_bill_table(words: list[list[Any]]) -> BillTable:
+    """Read line items from one bill page's word boxes.
+
+    Args:
+        words: The page's ``[x0, y0, x1, y1, word]`` list.
+
+    Returns:
+        The :class:`BillTable`; check ``confidence`` before trusting it.
+    """
+    table = BillTable()
+    columns: dict[str, float] = {}
+    for row in _group_rows(words):
+        if not columns and (header := _header_columns(row)):
+            # Rows above the header (hospital, patient, dates) are not items.
+            columns = header
+            table.items.clear()
+            table.candidates = 0
+            continue
+        description, numbers, markers = _split_row(row)
+        label = description.strip(" :-()").lower()
+        for currency in _CURRENCY:
+            label = label.removesuffix(currency).strip(" :-()")
+        if not numbers or not any(c.isalpha() for c in description):
+            continue
+        if _TOTAL_RE.fullmatch(label):
+            table.printed_total = numbers[-1][0]
+            continue
+        if is_running_total(description):
+            continue
+        if not columns and description.rstrip().endswith(":") and not markers and len(numbers) == 1:
+            continue  # a labelled field such as "Patient ID: 12345"
+        table.candidates += 1
+        item = _infer_item(numbers, columns, markers)
+        if item is None or item[0] <= 0 or item[1] < 0:
+            logger.debug("Bill table — could not parse row %r", description)
+            continue
+        quantity, unit_price, amount = item
+        table.items.append({
+            "description": description.strip(" :-"),
+            "quantity": quantity,
+            "unit_price": round(unit_price, 2),
+            "total_price": round(amount, 2),
+        })
+    if table.candidates:
+        table.confidence = round(len(table.items) / table.candidates, 3)
+    return table
@@ -0,0 +1,192 @@
+"""Deterministic identity field extraction with format and checksum validation.
+
+Runs before the ID agent's LLM call. Labeled fields (name, date of
+birth, policy and member IDs, insurer) are read with precompiled
+patterns and validated; Aadhaar numbers are accepted only with a valid
+Verhoeff check digit and PAN numbers only in the issued format.
+"""
+
+import logging
+import os
+import re
+from dataclasses import dataclass, field
+from datetime import date, datetime
+
+logger = logging.getLogger(__name__)
+
+ID_PREFILL_ENABLED = os.getenv("ID_PREFILL_ENABLED", "1") == "1"
+
+# ---------------------------------------------------------------------------
+# Checksums and formats
+# ---------------------------------------------------------------------------
+
+_VERHOEFF_MULTIPLY = (
+    (0, 1, 2, 3, 4, 5, 6, 7, 8, 9),
+    (1, 2, 3, 4, 0, 6, 7, 8, 9, 5),
+    (2, 3, 4, 0, 1, 7, 8, 9, 5, 6),
+    (3, 4, 0, 1, 2, 8, 9, 5, 6, 7),
+    (4, 0, 1, 2, 3, 9, 5, 6, 7, 8),
+    (5, 9, 8, 7, 6, 0, 4, 3, 2, 1),
+    (6, 5, 9, 8, 7, 1, 0, 4, 3, 2),
+    (7, 6, 5, 9, 8, 2, 1, 0, 4, 3),
+    (8, 7, 6, 5, 9, 3, 2, 1, 0, 4),
+    (9, 8, 7, 6, 5, 4, 3, 2, 1, 0),
+)
+_VERHOEFF_PERMUTE = (
+    (0, 1, 2, 3, 4, 5, 6, 7, 8, 9),
+    (1, 5, 7, 6, 2, 8, 3, 0, 9, 4),
+    (5, 8, 0, 3, 7, 9, 6, 1, 4, 2),
+    (8, 9, 1, 6, 0, 4, 3, 5, 2, 7),
+    (9, 4, 5, 3, 1, 2, 6, 8, 7, 0),
+    (4, 2, 8, 6, 5, 7, 3, 9, 0, 1),
+    (2, 7, 9, 3, 8, 0, 6, 4, 1, 5),
+    (7, 0, 4, 6, 9, 1, 3, 2, 5, 8),
+)
+
+
+def verhoeff_valid(number: str) -> bool:
+    """Check a digit string against its trailing Verhoeff check digit.
+
+    Args:
+        number: Digits only, check digit last.
+
+    Returns:
+        ``True`` if the check digit matches.
+    """
+    if not number.isdigit():
+        return False
+    check = 0
+    for position, digit in enumerate(reversed(number)):
+        check = _VERHOEFF_MULTIPLY[check][_VERHOEFF_PERMUTE[position % 8][int(digit)]]
+    return check == 0
+
+
+# Aadhaar numbers never start with 0 or 1.
+_AADHAAR_RE = re.compile(r"(?<![\d-])([2-9]\d{3})[\s-]?(\d{4})[\s-]?(\d{4})(?![\d-])")
+# Fourth letter is the holder type (P = person, C = company, ...).
+_PAN_RE = re.compile(r"\b[A-Z]{3}[ABCFGHJLPT][A-Z]\d{4}[A-Z]\b")
+
+_DATE_FORMATS = ("%d-%m-%Y", "%d/%m/%Y", "%d.%m.%Y", "%d-%b-%Y", "%d %b %Y", "%d %B %Y", "%Y-%m-%d")
+_DATE_VALUE = r"(?:\d{1,2}[-/.]\d{1,2}[-/.]\d{4}|\d{1,2}[- ][A-Za-z]{3,9}[- ]\d{4}|\d{4}-\d{2}-\d{2})"
+
+# Field patterns: a line-anchored label, then the value to the end of the line.
+_SEP = r"\s*(?:[:\-]\s*|\s+)"
+_FIELD_PATTERNS: dict[str, re.Pattern[str]] = {
+    "patient_name": re.compile(
+        r"(?im)^[ \t]*(?:name\s+of\s+(?:the\s+)?(?:patient|insured)|(?:patient|insured|member|beneficiary)\s+name"
+        r"|name)\s*[:\-]\s*(?P<value>[A-Za-z][A-Za-z .']{1,60}?)[ \t]*$"
+    ),
+    "date_of_birth": re.compile(
+        r"(?im)\b(?:date\s+of\s+birth|d\.?\s?o\.?\s?b\.?|birth\s+date)" + _SEP + r"(?P<value>" + _DATE_VALUE + r")"
+    ),
+    "policy_number": re.compile(
+        r"(?im)\bpolicy\s*(?:no\.?|number|#)" + _SEP + r"(?P<value>[A-Z0-9][A-Z0-9/\-]{4,29})\b"
+    ),
+    "member_id": re.compile(
+        r"(?im)\b(?:member(?:ship)?|tpa|health\s+card)\s*(?:id|no\.?|number)(?:\s*no\.?)?"
+        + _SEP + r"(?P<value>[A-Z0-9][A-Z0-9/\-]{2,29})\b"
+    ),
+    "insurance_provider": re.compile(
+        r"(?im)^[ \t]*(?:insurer|insurance\s+(?:company|provider)|insured\s+with)\s*[:\-]\s*"
+        r"(?P<value>[A-Za-z][A-Za-z&.,' ]{2,80}?)[ \t]*$"
+    ),
+}
+
+# An insurer's name on a line of its own, e.g. "Star Health and Allied Insurance Co. Ltd."
+_INSURER_LINE_RE = re.compile(
+    r"(?m)^[ \t]*(?P<value>[A-Z][A-Za-z&.' ]{1,60}\s(?:General\s+|Health\s+)?Insurance"
+    r"(?:\s+Co(?:mpany)?\.?)?(?:\s+(?:Ltd|Limited)\.?)?)[ \t]*$"
+)
+
+# Labels whose value failed validation; the LLM should have a look.
+_LABEL_ONLY: dict[str, re.Pattern[str]] = {
+    "date_of_birth": re.compile(r"(?i)\b(?:date\s+of\s+birth|d\.o\.b\.?|dob)\b"),
+    "policy_number": re.compile(r"(?i)\bpolicy\s*(?:no\.?|number|#)"),
+    "member_id": re.compile(r"(?i)\b(?:member(?:ship)?|tpa)\s*(?:id|no\.?|number)\b"),
+}
+
+
+def _valid_date(value: str) -> bool:
+    """Whether ``value`` is a real past date in a known format."""
+    for fmt in _DATE_FORMATS:
+        try:
+            parsed = datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+        return date(1900, 1, 1) <= parsed <= date.today()
+    return False
+
+
+# ---------------------------------------------------------------------------
+# Extraction
+# ---------------------------------------------------------------------------
+
+
+@dataclass
+class IdFindings:
+    """Identity fields found deterministically on a claim's ID pages.
+
+    Attributes:
+        fields: Validated values by ID agent field name.
+        aadhaar: Aadhaar numbers with a valid Verhoeff check digit.
+        pan: PAN numbers in the issued format.
+        unresolved: Fields whose label is present but whose value did
+            not validate (e.g. a malformed date).
+    """
+
+    fields: dict[str, str] = field(default_factory=dict)
+    aadhaar: list[str] = field(default_factory=list)
+    pan: list[str] = field(default_factory=list)
+    unresolved: set[str] = field(default_factory=set)
+
+    def hints(self) -> str:
+        """Describe the findings for the LLM prompt, or ``""`` if there are none."""
+        lines = [f"- {name}: {value}" for name, value in self.fields.items()]
+        lines += [f"- Aadhaar number {number} (not a policy or member ID)" for number in self.aadhaar]
+        lines += [f"- PAN {number} (not a policy or member ID)" for number in self.pan]
+        return "\n".join(lines)
+
+
+def extract_id_fields(text: str, field_names: list[str]) -> IdFindings:
+    """Read identity fields from page text with patterns and checksums.
+
+    Args:
+        text: The combined text of the identity pages.
+        field_names: The fields the ID agent returns.
+
+    Returns:
+        The :class:`IdFindings`. A field is only reported when its
+        value validates; the first valid occurrence wins.
+    """
+    findings = IdFindings()
+    for name in field_names:
+        pattern = _FIELD_PATTERNS.get(name)
+        if pattern is None:
+            continue
+        for match in pattern.finditer(text):
+            value = match.group("value").strip(" .,")
+            if name == "date_of_birth" and not _valid_date(value):
+                continue
+            if name in ("policy_number", "member_id") and not any(c.isdigit() for c in value):
+                continue
+            findings.fields[name] = value
+            break
+        if name == "insurance_provider" and name not in findings.fields:
+            if (line := _INSURER_LINE_RE.search(text)) is not None:
+                findings.fields[name] = line.group("value").strip()
+        if name not in findings.fields and name in _LABEL_ONLY and _LABEL_ONLY[name].search(text):
+            findings.unresolved.add(name)
+
+    for match in _AADHAAR_RE.finditer(text):
+        digits = "".join(match.groups())
+        if verhoeff_valid(digits):
+            findings.aadhaar.append(" ".join(match.groups()))
+    findings.pan = list(dict.fromkeys(_PAN_RE.findall(text)))
+
+    # A PAN or Aadhaar number is never the policy or member ID.
+    document_numbers = {re.sub(r"\W", "", number) for number in findings.aadhaar + findings.pan}
+    for name in ("policy_number", "member_id"):
+        if re.sub(r"\W", "", findings.fields.get(name, "")) in document_numbers:
+            del findings.fields[name]
+    logger.debug("Deterministic ID fields: %s", sorted(findings.fields))
+    return findings
@@ -0,0 +1,630 @@
+"""Layout template registry for recurring hospital and insurer forms.
+
+When ``LAYOUT_SAMPLES_PATH`` is set, processed pages are logged with
+their text blocks (see ``pdf_parser.page_blocks``), document type and
+extracted fields; identity pages without their personal data. The
+``learn`` command clusters pages by layout, keeps the blocks whose
+position and static text recur as anchors, and records where each field
+sits relative to an anchor. At runtime a page whose anchors match a
+template gets its type without classification, and the agents read its
+fields at the stored positions. Run ``python -m app.services.layout_templates
+--help`` for the CLI.
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import re
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+LAYOUT_TEMPLATES_ENABLED = os.getenv("LAYOUT_TEMPLATES_ENABLED", "1") == "1"
+
+_TEMPLATES_PATH = os.getenv("LAYOUT_TEMPLATES_PATH", ".cache/layout_templates.json")
+# Logging processed pages for ``learn`` is opt-in: the log holds page text.
+_SAMPLES_PATH = os.getenv("LAYOUT_SAMPLES_PATH", "")
+
+# The sample log is rotated to ``<path>.1`` once it reaches this size.
+_SAMPLES_MAX_BYTES = int(os.getenv("LAYOUT_SAMPLES_MAX_BYTES", str(50 * 1024 * 1024)))
+
+# Blocks holding these fields' values, on any page of the claim, are
+# never logged (see :func:`_redact`). The insurer's name is not
+# personal and stays, as it is usually an anchor of the form.
+_PERSONAL_FIELDS = {"patient_name", "date_of_birth", "policy_number", "member_id"}
+
+# Share of a template's anchors a page must contain to match it.
+_MATCH_RATIO = float(os.getenv("LAYOUT_MATCH_RATIO", "0.8"))
+
+# Block positions are bucketed into a grid this many cells per side.
+_GRID = 40
+
+# Static text compared per block; longer blocks are cut.
+_KEY_CHARS = 48
+
+_MIN_ANCHORS = 3
+_MIN_SUPPORT = 2
+
+# Pages whose anchor sets overlap this much are one layout.
+_CLUSTER_SIMILARITY = 0.5
+
+# Share of a layout's pages an anchor or field position must appear on.
+_AGREEMENT = 0.8
+
+# How far (as a fraction of the page) a value block may drift from its
+# learned offset.
+_POSITION_TOLERANCE = 0.02
+
+_DIGIT_RE = re.compile(r"\d")
+
+Cell = tuple[int, int, str]
+
+
+def _mask(text: str) -> str:
+    """Lowercase and mask digits, keeping the string's length."""
+    return _DIGIT_RE.sub("0", text.lower())
+
+
+def block_cell(block: list[Any]) -> Cell | None:
+    """Return a block's grid cell and normalised text, the unit anchors are made of.
+
+    Blocks with fewer than three letters (numbers, dates) carry no
+    static text and are skipped.
+    """
+    text = " ".join(_mask(block[4]).split())[:_KEY_CHARS]
+    if sum(c.isalpha() for c in text) < 3:
+        return None
+    return int(block[0] * _GRID), int(block[1] * _GRID), text
+
+
+@dataclass
+class FieldRule:
+    """Where a field's value sits relative to one of the template's anchors.
+
+    Attributes:
+        anchor: Index of the anchor in ``LayoutTemplate.anchors``.
+        dx: Horizontal offset from the anchor block to the value block.
+        dy: Vertical offset from the anchor block to the value block.
+        prefix: Masked label text before the value on its line.
+        stop: Masked word that follows the value on its line, if any.
+    """
+
+    anchor: int
+    dx: float
+    dy: float
+    prefix: str = ""
+    stop: str = ""
+
+
+@dataclass
+class LayoutTemplate:
+    """A recurring page layout learned from processed claims.
+
+    Attributes:
+        template_id: Stable identifier, ``<doc_type>-<n>``.
+        doc_type: Document type of pages with this layout.
+        anchors: Grid cells and static text present on every page.
+        fields: Extraction rules by field name.
+        support: Number of logged pages the template was learned from.
+    """
+
+    template_id: str
+    doc_type: str
+    anchors: list[Cell]
+    fields: dict[str, FieldRule] = field(default_factory=dict)
+    support: int = 0
+
+
+@dataclass
+class TemplateMatch:
+    """A page matched to a template, with the page block found for each anchor."""
+
+    template: LayoutTemplate
+    ratio: float
+    anchor_blocks: dict[int, list[Any]]
+
+
+class TemplateIndex:
+    """Inverted index from anchor cells to templates.
+
+    Matching looks up each page block's cell and its eight neighbours
+    (to absorb small position drift), counts the anchors found per
+    template and picks the template with the highest share at or above
+    ``match_ratio``. A page of a few dozen blocks matches in well under
+    a millisecond, however many templates are registered.
+    """
+
+    def __init__(self, templates: list[LayoutTemplate], match_ratio: float = _MATCH_RATIO) -> None:
+        self.templates = templates
+        self._match_ratio = match_ratio
+        self._postings: dict[Cell, list[tuple[int, int]]] = {}
+        for template_index, template in enumerate(templates):
+            for anchor_index, cell in enumerate(template.anchors):
+                self._postings.setdefault(cell, []).append((template_index, anchor_index))
+
+    def match(self, blocks: list[list[Any]]) -> TemplateMatch | None:
+        """Find the template a page's blocks belong to.
+
+        Args:
+            blocks: The page's ``[x0, y0, x1, y1, text]`` blocks.
+
+        Returns:
+            The best :class:`TemplateMatch`, or ``None`` if no template
+            reaches the match ratio.
+        """
+        found: dict[int, dict[int, list[Any]]] = {}
+        for block in blocks:
+            cell = block_cell(block)
+            if cell is None:
+                continue
+            x, y, text = cell
+            for nx in (x - 1, x, x + 1):
+                for ny in (y - 1, y, y + 1):
+                    for template_index, anchor_index in self._postings.get((nx, ny, text), ()):
+                        found.setdefault(template_index, {}).setdefault(anchor_index, block)
+
+        best: TemplateMatch | None = None
+        for template_index, anchor_blocks in found.items():
+            template = self.templates[template_index]
+            ratio = len(anchor_blocks) / len(template.anchors)
+            if ratio >= self._match_ratio and (best is None or ratio > best.ratio):
+                best = TemplateMatch(template, round(ratio, 3), anchor_blocks)
+        return best
+
+    def extract(self, match: TemplateMatch, blocks: list[list[Any]]) -> dict[str, str | None]:
+        """Read the template's fields from a matched page.
+
+        Args:
+            match: The page's template match.
+            blocks: The page's blocks.
+
+        Returns:
+            Field name to value, ``None`` where the value block or label
+            was not found.
+        """
+        values: dict[str, str | None] = {}
+        for name, rule in match.template.fields.items():
+            anchor = match.anchor_blocks.get(rule.anchor)
+            block = _block_near(blocks, anchor[0] + rule.dx, anchor[1] + rule.dy) if anchor else None
+            values[name] = _read_value(block[4], rule.prefix, rule.stop) if block else None
+        return values
+
+    def save(self, path: str | Path) -> None:
+        """Write the templates as JSON, replacing the file atomically."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        payload = {"version": 1, "templates": [asdict(template) for template in self.templates]}
+        tmp.write_text(json.dumps(payload, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: str | Path) -> "TemplateIndex":
+        """Read templates written by :meth:`save`."""
+        payload = json.loads(Path(path).read_text(encoding="utf-8"))
+        templates = [
+            LayoutTemplate(
+                template_id=raw["template_id"],
+                doc_type=raw["doc_type"],
+                anchors=[tuple(cell) for cell in raw["anchors"]],
+                fields={name: FieldRule(**rule) for name, rule in raw["fields"].items()},
+                support=raw.get("support", 0),
+            )
+            for raw in payload["templates"]
+        ]
+        return cls(templates)
+
+
+def _block_near(blocks: list[list[Any]], x: float, y: float) -> list[Any] | None:
+    """Return the block whose top-left corner is closest to ``(x, y)``, within tolerance."""
+    best = min(blocks, key=lambda block: max(abs(block[0] - x), abs(block[1] - y)), default=None)
+    if best is None or max(abs(best[0] - x), abs(best[1] - y)) > _POSITION_TOLERANCE:
+        return None
+    return best
+
+
+def _read_value(text: str, prefix: str, stop: str) -> str | None:
+    """Cut a field value out of a block's text between its label and stop word."""
+    for line in text.splitlines():
+        start = 0
+        if prefix:
+            position = _mask(line).find(prefix)
+            if position < 0:
+                continue
+            start = position + len(prefix)
+        rest = line[start:]
+        if stop:
+            end = _mask(rest).find(stop, 1)
+            if end > 0:
+                rest = rest[:end]
+        value = rest.strip(" \t:-,")
+        if value:
+            return value
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Sample log and learning
+# ---------------------------------------------------------------------------
+
+
+class LayoutSampleLog:
+    """Append-only JSONL log of processed pages: type, blocks and field values.
+
+    Once the file reaches ``max_bytes`` it is moved to ``<path>.1``,
+    replacing the previous one, so the log never exceeds twice that size.
+    """
+
+    def __init__(self, path: str | Path, max_bytes: int = _SAMPLES_MAX_BYTES) -> None:
+        self._path = Path(path)
+        self._rotated = self._path.with_name(self._path.name + ".1")
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def append(self, doc_type: str, blocks: list[list[Any]], fields: dict[str, Any]) -> None:
+        """Record one processed page; write failures are logged, not raised."""
+        line = json.dumps({"doc_type": doc_type, "blocks": blocks, "fields": fields}, ensure_ascii=False)
+        try:
+            with self._lock:
+                self._path.parent.mkdir(parents=True, exist_ok=True)
+                if self._path.exists() and self._path.stat().st_size >= self._max_bytes:
+                    os.replace(self._path, self._rotated)
+                with self._path.open("a", encoding="utf-8") as handle:
+                    handle.write(line + "\n")
+        except OSError as exc:
+            logger.warning("Could not append to layout sample log %s: %s", self._path, exc)
+
+    def read(self) -> list[dict[str, Any]]:
+        """Return the logged samples, oldest first, skipping unreadable lines."""
+        samples = []
+        for path in (self._rotated, self._path):
+            if not path.exists():
+                continue
+            with path.open(encoding="utf-8") as handle:
+                for line in handle:
+                    try:
+                        sample = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if isinstance(sample, dict) and sample.get("blocks"):
+                        samples.append(sample)
+        return samples
+
+
+_sample_log = LayoutSampleLog(_SAMPLES_PATH) if _SAMPLES_PATH else None
+
+
+def _redact(
+    blocks: list[list[Any]],
+    fields: dict[str, str],
+    personal: set[str],
+) -> tuple[list[list[Any]], dict[str, Any]]:
+    """Strip a page's personal data before it is logged.
+
+    Each field value is replaced by where it was found: the box of its
+    block, its label and its stop word, which is all
+    :func:`learn_templates` needs. Blocks containing a ``personal`` value
+    are dropped, and digits in the remaining blocks are masked, so IDs,
+    dates and amounts that are not fields are not logged either. Masking
+    does not change the blocks' anchor cells.
+
+    Args:
+        blocks: The page's text blocks.
+        fields: Field name to the value extracted from the page.
+        personal: Lower-cased ``_PERSONAL_FIELDS`` values found anywhere
+            in the claim, such as the patient's name.
+
+    Returns:
+        The blocks and the fields to log.
+    """
+    logged: dict[str, Any] = {}
+    for name, value in fields.items():
+        if (found := _locate(value, blocks)) is not None:
+            block, prefix, stop = found
+            logged[name] = {"box": block[:4], "prefix": prefix, "stop": stop}
+    kept = [
+        [*block[:4], _DIGIT_RE.sub("0", block[4])] for block in blocks
+        if not any(value in block[4].lower() for value in personal)
+    ]
+    return kept, logged
+
+
+def record_layout_samples(
+    pages: list[dict[str, Any]],
+    classified_pages: dict[str, list[int]],
+    extracted: dict[str, dict[str, Any]],
+) -> None:
+    """Log a processed claim's pages for template learning.
+
+    Does nothing unless ``LAYOUT_SAMPLES_PATH`` is set. Every page is
+    logged without field values or personal data (see :func:`_redact`).
+    Pages whose extraction was degraded or found no fields are skipped,
+    so defaults are never learned as field values.
+
+    Args:
+        pages: The claim's pages, with ``blocks``.
+        classified_pages: Document type to page numbers.
+        extracted: Document type to the fields its agent extracted.
+    """
+    if _sample_log is None or not LAYOUT_TEMPLATES_ENABLED:
+        return
+    types = {num: doc_type for doc_type, nums in classified_pages.items() for num in nums}
+    personal = {
+        value.strip().lower()
+        for data in extracted.values()
+        for name, value in data.items()
+        if name in _PERSONAL_FIELDS and isinstance(value, str) and value.strip()
+    }
+    for page in pages:
+        doc_type = types.get(page["page_number"])
+        data = extracted.get(doc_type, {})
+        if doc_type is None or not page.get("blocks") or data.get("degraded"):
+            continue
+        fields = {name: value for name, value in data.items() if isinstance(value, str) and value.strip()}
+        fields.pop("confidence", None)
+        if not fields:
+            continue
+        blocks, logged = _redact(page["blocks"], fields, personal)
+        _sample_log.append(doc_type, blocks, logged)
+
+
+def learn_templates(samples: list[dict[str, Any]], min_support: int = _MIN_SUPPORT) -> list[LayoutTemplate]:
+    """Cluster logged pages by layout and learn a template per recurring layout.
+
+    Args:
+        samples: Records from :class:`LayoutSampleLog`.
+        min_support: Pages a layout needs before it becomes a template.
+
+    Returns:
+        The learned templates, most supported first.
+    """
+    clusters: list[tuple[set[Cell], list[dict[str, Any]]]] = []
+    for sample in samples:
+        cells = {cell for cell in map(block_cell, sample["blocks"]) if cell is not None}
+        if not cells:
+            continue
+        best, best_similarity = None, 0.0
+        for cluster in clusters:
+            if cluster[1][0]["doc_type"] != sample["doc_type"]:
+                continue
+            similarity = len(cells & cluster[0]) / len(cells | cluster[0])
+            if similarity > best_similarity:
+                best, best_similarity = cluster, similarity
+        if best is not None and best_similarity >= _CLUSTER_SIMILARITY:
+            best[1].append(sample)
+        else:
+            clusters.append((cells, [sample]))
+
+    templates: list[LayoutTemplate] = []
+    per_type: Counter[str] = Counter()
+    for _, members in sorted(clusters, key=lambda cluster: -len(cluster[1])):
+        if len(members) < min_support:
+            continue
+        needed = math.ceil(_AGREEMENT * len(members))
+        counts = Counter(cell for sample in members for cell in {block_cell(b) for b in sample["blocks"]} - {None})
+        anchors = sorted(cell for cell, count in counts.items() if count >= needed)
+        if len(anchors) < _MIN_ANCHORS:
+            continue
+        doc_type = members[0]["doc_type"]
+        per_type[doc_type] += 1
+        templates.append(LayoutTemplate(
+            template_id=f"{doc_type}-{per_type[doc_type]}",
+            doc_type=doc_type,
+            anchors=anchors,
+            fields=_learn_fields(members, anchors),
+            support=len(members),
+        ))
+    return templates
+
+
+def _learn_fields(members: list[dict[str, Any]], anchors: list[Cell]) -> dict[str, FieldRule]:
+    """Find field positions that agree across a layout's pages."""
+    anchor_index = {cell: index for index, cell in enumerate(anchors)}
+    observations: dict[str, list[tuple[int, float, float, str, str]]] = {}
+    for sample in members:
+        anchor_blocks = {}
+        for block in sample["blocks"]:
+            index = anchor_index.get(block_cell(block))
+            if index is not None:
+                anchor_blocks.setdefault(index, block)
+        for name, value in sample.get("fields", {}).items():
+            if isinstance(value, dict):
+                # Logged as a location only (see ``_redact``).
+                located = value.get("box"), value.get("prefix", ""), value.get("stop", "")
+            else:
+                located = _locate(value, sample["blocks"])
+            if located is None or not located[0]:
+                continue
+            block, prefix, stop = located
+            above = [
+                (index, anchor) for index, anchor in anchor_blocks.items()
+                if anchor[1] <= block[1] + _POSITION_TOLERANCE
+            ]
+            if not above:
+                continue
+            index, anchor = min(above, key=lambda item: math.dist(item[1][:2], block[:2]))
+            observations.setdefault(name, []).append(
+                (index, block[0] - anchor[0], block[1] - anchor[1], prefix, stop)
+            )
+
+    rules: dict[str, FieldRule] = {}
+    for name, seen in observations.items():
+        (index, prefix, stop), _ = Counter((o[0], o[3], o[4]) for o in seen).most_common(1)[0]
+        agreeing = [o for o in seen if (o[0], o[3], o[4]) == (index, prefix, stop)]
+        dx = statistics.median(o[1] for o in agreeing)
+        dy = statistics.median(o[2] for o in agreeing)
+        close = [o for o in agreeing if abs(o[1] - dx) <= _POSITION_TOLERANCE and abs(o[2] - dy) <= _POSITION_TOLERANCE]
+        if len(close) >= max(_MIN_SUPPORT, math.ceil(_AGREEMENT * len(seen))):
+            rules[name] = FieldRule(index, round(dx, 4), round(dy, 4), prefix, stop)
+    return rules
+
+
+def _locate(value: str, blocks: list[list[Any]]) -> tuple[list[Any], str, str] | None:
+    """Find the block and line holding a field value, with its label and stop word."""
+    needle = value.strip().lower()
+    if not needle:
+        return None
+    for block in blocks:
+        for line in block[4].splitlines():
+            position = line.lower().find(needle)
+            if position < 0:
+                continue
+            prefix = _mask(line[:position]).strip()
+            following = _mask(line[position + len(needle):]).split()
+            return block, prefix, following[0] if following else ""
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Runtime lookup
+# ---------------------------------------------------------------------------
+
+_index: TemplateIndex | None = None
+_index_loaded = False
+_index_lock = threading.Lock()
+
+
+def get_template_index() -> TemplateIndex | None:
+    """Return the learned templates, loading them on first use.
+
+    Returns:
+        The index, or ``None`` when disabled or nothing has been learned.
+    """
+    global _index, _index_loaded
+    if _index_loaded:
+        return _index
+    with _index_lock:
+        if not _index_loaded:
+            if LAYOUT_TEMPLATES_ENABLED and _TEMPLATES_PATH and Path(_TEMPLATES_PATH).exists():
+                try:
+                    _index = TemplateIndex.load(_TEMPLATES_PATH)
+                    logger.info("Loaded %d layout templates from %s", len(_index.templates), _TEMPLATES_PATH)
+                except (OSError, KeyError, TypeError, ValueError) as exc:
+                    logger.warning("Could not load layout templates from %s: %s", _TEMPLATES_PATH, exc)
+            _index_loaded = True
+    return _index
+
+
+def match_layout(page: dict[str, Any]) -> TemplateMatch | None:
+    """Match a page to a learned template.
+
+    Args:
+        page: A page dict with ``blocks``.
+
+    Returns:
+        The :class:`TemplateMatch`, or ``None`` without templates, blocks
+        or a match.
+    """
+    index = get_template_index()
+    if index is None or not page.get("blocks"):
+        return None
+    return index.match(page["blocks"])
+
+
+def extract_with_templates(
+    pages: list[dict[str, Any]],
+    page_numbers: list[int],
+    field_names: list[str],
+) -> dict[str, str | None] | None:
+    """Read an agent's fields from template-matched pages.
+
+    Args:
+        pages: All extracted pages.
+        page_numbers: The pages the agent handles.
+        field_names: The fields the agent returns.
+
+    Returns:
+        Every field's value when all pages matched templates and together
+        yielded every field. ``None`` otherwise, in which case the agent
+        should fall back to the LLM.
+    """
+    index = get_template_index()
+    if index is None or not page_numbers:
+        return None
+    values: dict[str, str | None] = dict.fromkeys(field_names)
+    wanted = set(page_numbers)
+    for page in pages:
+        if page["page_number"] not in wanted:
+            continue
+        match = match_layout(page)
+        if match is None:
+            return None
+        for name, value in index.extract(match, page["blocks"]).items():
+            if name in values and values[name] is None:
+                values[name] = value
+    if any(value is None for value in values.values()):
+        return None
+    return values
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Entry point for ``python -m app.services.layout_templates``."""
+    parser = argparse.ArgumentParser(
+        prog="python -m app.services.layout_templates",
+        description="Learn layout templates from processed claims, or match a PDF against them.",
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+    learn = sub.add_parser("learn", help="Learn templates from the layout sample log")
+    learn.add_argument(
+        "--samples",
+        default=_SAMPLES_PATH or None,
+        required=not _SAMPLES_PATH,
+        help="JSONL sample log (default: LAYOUT_SAMPLES_PATH)",
+    )
+    learn.add_argument("--templates", default=_TEMPLATES_PATH, help="Template file (default: %(default)s)")
+    learn.add_argument("--min-support", type=int, default=_MIN_SUPPORT, help="Pages a layout needs")
+    match = sub.add_parser("match", help="Match each page of a PDF against the templates")
+    match.add_argument("pdf")
+    match.add_argument("--templates", default=_TEMPLATES_PATH, help="Template file (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    if args.command == "learn":
+        samples = LayoutSampleLog(args.samples).read()
+        templates = learn_templates(samples, args.min_support)
+        TemplateIndex(templates).save(args.templates)
+        report: Any = {
+            "samples": len(samples),
+            "templates": len(templates),
+            "by_type": dict(Counter(template.doc_type for template in templates)),
+            "fields": {template.template_id: sorted(template.fields) for template in templates},
+            "output": args.templates,
+        }
+    else:
+        from app.services.pdf_parser import extract_pages
+
+        if not Path(args.templates).exists():
+            print(f"No templates at {args.templates}; run 'learn' first.", file=sys.stderr)
+            return 1
+        index = TemplateIndex.load(args.templates)
+        report = []
+        for page in extract_pages(args.pdf):
+            started = time.perf_counter()
+            found = index.match(page["blocks"])
+            elapsed_us = round((time.perf_counter() - started) * 1e6, 1)
+            report.append({
+                "page_number": page["page_number"],
+                "template": found.template.template_id if found else None,
+                "ratio": found.ratio if found else None,
+                "fields": index.extract(found, page["blocks"]) if found else {},
+                "match_us": elapsed_us,
+            })
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,244 @@
+"""Near-duplicate page index that reuses past classifications (SimHash)."""
+
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_ENABLED = os.getenv("FINGERPRINT_ENABLED", "1") == "1"
+
+_PATH = os.getenv("FINGERPRINT_PATH", ".cache/page_fingerprints.sqlite3")
+_MAX_ENTRIES = int(os.getenv("FINGERPRINT_MAX_ENTRIES", "50000"))
+_MAX_DISTANCE = int(os.getenv("FINGERPRINT_MAX_DISTANCE", "3"))
+
+# Pages with fewer words are too short for a stable fingerprint.
+_MIN_WORDS = 8
+
+_BITS = 64
+_WORD_RE = re.compile(r"\w+")
+_DIGIT_RE = re.compile(r"\d")
+
+
+def normalize(text: str) -> str:
+    """Lowercase, mask digits and collapse whitespace.
+
+    Pages that differ only in names' case, numbers or layout spacing
+    normalise to (nearly) the same string.
+    """
+    return " ".join(_DIGIT_RE.sub("0", text.lower()).split())
+
+
+def simhash(text: str) -> int | None:
+    """Compute a 64-bit SimHash over word unigrams and bigrams.
+
+    Args:
+        text: Raw page text.
+
+    Returns:
+        The fingerprint, or ``None`` for pages under ``_MIN_WORDS`` words.
+    """
+    words = _WORD_RE.findall(normalize(text))
+    if len(words) < _MIN_WORDS:
+        return None
+    features = Counter(words)
+    features.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+    totals = [0] * _BITS
+    for feature, weight in features.items():
+        digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(_BITS):
+            totals[bit] += weight if digest >> bit & 1 else -weight
+    return sum(1 << bit for bit, total in enumerate(totals) if total > 0)
+
+
+def _to_signed(fingerprint: int) -> int:
+    """Map an unsigned 64-bit value onto SQLite's signed INTEGER range."""
+    return fingerprint - (1 << _BITS) if fingerprint >= 1 << (_BITS - 1) else fingerprint
+
+
+class PageFingerprintIndex:
+    """Bounded, persistent map from page SimHash to document type.
+
+    Lookups use banded Hamming search: the 64 bits are split into
+    ``max_distance + 1`` bands, so by the pigeonhole principle any
+    fingerprint within ``max_distance`` bits shares at least one band
+    exactly. Only fingerprints in a matching band bucket are compared.
+    Entries are evicted least recently used first. SQLite failures are
+    logged and never propagate to the caller.
+    """
+
+    def __init__(
+        self,
+        path: str | None,
+        max_entries: int = _MAX_ENTRIES,
+        max_distance: int = _MAX_DISTANCE,
+    ) -> None:
+        self._entries: OrderedDict[int, str] = OrderedDict()
+        self._max_entries = max_entries
+        self._max_distance = max_distance
+        bands = max_distance + 1
+        width = _BITS // bands
+        self._bands = [(i * width, width if i < bands - 1 else _BITS - i * width) for i in range(bands)]
+        self._buckets: list[dict[int, set[int]]] = [{} for _ in self._bands]
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._stats = {"lookups": 0, "hits": 0, "stores": 0, "evictions": 0, "candidates": 0}
+        self._db: sqlite3.Connection | None = None
+        if path:
+            self._open_disk(path)
+
+    def lookup(self, text: str) -> str | None:
+        """Return the document type of the closest stored near-duplicate.
+
+        Args:
+            text: The extracted text content of one PDF page.
+
+        Returns:
+            The stored type if a fingerprint lies within ``max_distance``
+            bits, else ``None``.
+        """
+        fingerprint = simhash(text)
+        if fingerprint is None:
+            return None
+        with self._lock:
+            self._stats["lookups"] += 1
+            candidates: set[int] = set()
+            for bucket, key in zip(self._buckets, self._band_keys(fingerprint)):
+                candidates |= bucket.get(key, set())
+            self._stats["candidates"] += len(candidates)
+            best = min(candidates, key=lambda c: (c ^ fingerprint).bit_count(), default=None)
+            if best is None or (best ^ fingerprint).bit_count() > self._max_distance:
+                return None
+            self._entries.move_to_end(best)
+            self._stats["hits"] += 1
+            doc_type = self._entries[best]
+        self._disk_execute(
+            "UPDATE page_fingerprints SET accessed_at = ? WHERE fingerprint = ?",
+            (time.time(), _to_signed(best)),
+        )
+        return doc_type
+
+    def store(self, text: str, doc_type: str) -> None:
+        """Remember the document type of a classified page."""
+        fingerprint = simhash(text)
+        if fingerprint is None:
+            return
+        evicted: list[int] = []
+        with self._lock:
+            self._stats["stores"] += 1
+            if fingerprint not in self._entries:
+                for bucket, key in zip(self._buckets, self._band_keys(fingerprint)):
+                    bucket.setdefault(key, set()).add(fingerprint)
+            self._entries[fingerprint] = doc_type
+            self._entries.move_to_end(fingerprint)
+            while len(self._entries) > self._max_entries:
+                oldest, _ = self._entries.popitem(last=False)
+                self._unindex(oldest)
+                evicted.append(oldest)
+                self._stats["evictions"] += 1
+        self._disk_execute(
+            "INSERT OR REPLACE INTO page_fingerprints VALUES (?, ?, ?)",
+            (_to_signed(fingerprint), doc_type, time.time()),
+        )
+        for oldest in evicted:
+            self._disk_execute("DELETE FROM page_fingerprints WHERE fingerprint = ?", (_to_signed(oldest),))
+
+    def stats(self) -> dict[str, Any]:
+        """Return lookup/hit counters and the index size."""
+        with self._lock:
+            stats: dict[str, Any] = dict(self._stats)
+            stats["size"] = len(self._entries)
+        stats["persistent"] = self._db is not None
+        return stats
+
+    def _band_keys(self, fingerprint: int) -> list[int]:
+        return [(fingerprint >> shift) & ((1 << width) - 1) for shift, width in self._bands]
+
+    def _unindex(self, fingerprint: int) -> None:
+        """Drop a fingerprint from its band buckets. Caller holds the lock."""
+        for bucket, key in zip(self._buckets, self._band_keys(fingerprint)):
+            members = bucket.get(key)
+            if members is not None:
+                members.discard(fingerprint)
+                if not members:
+                    del bucket[key]
+
+    def _open_disk(self, path: str) -> None:
+        """Open (or create) the SQLite store and load it, disabling it on failure."""
+        try:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS page_fingerprints ("
+                "fingerprint INTEGER PRIMARY KEY, doc_type TEXT NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            rows = db.execute(
+                "SELECT fingerprint, doc_type FROM page_fingerprints ORDER BY accessed_at DESC LIMIT ?",
+                (self._max_entries,),
+            ).fetchall()
+            db.execute(
+                "DELETE FROM page_fingerprints WHERE fingerprint NOT IN "
+                "(SELECT fingerprint FROM page_fingerprints ORDER BY accessed_at DESC LIMIT ?)",
+                (self._max_entries,),
+            )
+            self._db = db
+        except sqlite3.Error as exc:
+            logger.warning("Page fingerprints — disk store disabled (%s): %s", path, exc)
+            return
+        for signed, doc_type in reversed(rows):
+            fingerprint = signed & ((1 << _BITS) - 1)
+            self._entries[fingerprint] = doc_type
+            for bucket, key in zip(self._buckets, self._band_keys(fingerprint)):
+                bucket.setdefault(key, set()).add(fingerprint)
+        logger.info("Page fingerprints — loaded %d entries from %s", len(rows), path)
+
+    def _disk_execute(self, sql: str, params: tuple[Any, ...]) -> None:
+        if self._db is None:
+            return
+        try:
+            with self._db_lock:
+                self._db.execute(sql, params)
+        except sqlite3.Error as exc:
+            logger.warning("Page fingerprints — disk write failed: %s", exc)
+
+
+_index: PageFingerprintIndex | None = None
+_index_lock = threading.Lock()
+
+
+def get_fingerprint_index() -> PageFingerprintIndex | None:
+    """Return the process-wide fingerprint index, or ``None`` when disabled."""
+    global _index
+    if not FINGERPRINT_ENABLED:
+        return None
+    with _index_lock:
+        if _index is None:
+            _index = PageFingerprintIndex(_PATH or None)
+    return _index
+
+
+def lookup_page_type(text: str) -> str | None:
+    """Return the type of a previously classified near-duplicate page, if any."""
+    index = get_fingerprint_index()
+    return index.lookup(text) if index is not None else None
+
+
+def remember_page_type(text: str, doc_type: str) -> None:
+    """Record a page's classification for future near-duplicates."""
+    index = get_fingerprint_index()
+    if index is not None:
+        index.store(text, doc_type)
+
+
+def get_fingerprint_stats() -> dict[str, Any] | None:
+    """Return the index counters, or ``None`` when disabled."""
+    index = get_fingerprint_index()
+    return index.stats() if index is not None else None
@@ -0,0 +1,238 @@
+"""Rule-based page pre-classifier that labels unambiguous pages without the LLM."""
+
+import logging
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+PAGE_RULES_ENABLED = os.getenv("PAGE_RULES_ENABLED", "1") == "1"
+
+# Share of the rule evidence the best type needs before a page is labeled.
+_THRESHOLD = float(os.getenv("PAGE_RULES_THRESHOLD", "0.8"))
+
+# Hits in the first characters of a page (its title block) count double.
+_HEADER_CHARS = 160
+
+
+@dataclass(frozen=True)
+class PageRule:
+    """A keyword or regex that is evidence for one document type.
+
+    Attributes:
+        name: Identifier used in hit statistics and as the regex group name.
+        doc_type: The document type the pattern points to.
+        pattern: Regex source. Scope case-insensitivity with ``(?i:...)``.
+        weight: Evidence the rule adds when it matches (once per page).
+    """
+
+    name: str
+    doc_type: str
+    pattern: str
+    weight: float
+
+
+@dataclass
+class RuleVerdict:
+    """Result of scoring one page against the rules.
+
+    Attributes:
+        doc_type: The type to assign, or ``None`` if the page is ambiguous.
+        confidence: Share of the page's rule evidence behind the best type.
+        scores: Evidence per document type.
+        rules: Names of the rules that matched.
+    """
+
+    doc_type: str | None
+    confidence: float
+    scores: dict[str, float] = field(default_factory=dict)
+    rules: list[str] = field(default_factory=list)
+
+
+# Where patterns overlap, the rule listed first wins the match.
+DEFAULT_RULES: tuple[PageRule, ...] = (
+    # claim_forms
+    PageRule("claim_form_title", "claim_forms",
+             r"(?i:\bclaim\s+form\b|\bpre-?authori[sz]ation\s+(?:request\s+)?form\b|\breimbursement\s+claim\b)", 3),
+    PageRule("cashless", "claim_forms", r"(?i:\bcashless\b)", 1),
+    PageRule("insured_declaration", "claim_forms", r"(?i:\bi\s+hereby\s+declare\b)", 1),
+    PageRule("sum_insured", "claim_forms", r"(?i:\bsum\s+insured\b|\bname\s+of\s+(?:the\s+)?insured\b)", 1),
+    # identity_document (before bank rules: "Permanent Account Number")
+    PageRule("identity_card_title", "identity_document",
+             r"(?i:\b(?:aadhaa?r|pan|voter\s+id|identity)\s+card\b|\bpermanent\s+account\s+number\b)", 3),
+    PageRule("aadhaar_keyword", "identity_document",
+             r"(?i:\baadhaa?r\b|\bunique\s+identification\s+authority\b)", 2),
+    PageRule("aadhaar_number", "identity_document", r"\b\d{4}[\s-]\d{4}[\s-]\d{4}\b(?![\s-]?\d)", 2),
+    PageRule("pan_number", "identity_document", r"\b[A-Z]{5}\d{4}[A-Z]\b", 2),
+    PageRule("other_id_keyword", "identity_document",
+             r"(?i:\bpassport\b|\bdriving\s+licen[cs]e\b|\belection\s+commission\b|\bincome\s+tax\s+department\b)", 2),
+    PageRule("government_of_india", "identity_document", r"(?i:\bgovernment\s+of\s+india\b)", 1),
+    # cheque_or_bank_details
+    PageRule("cancelled_cheque", "cheque_or_bank_details", r"(?i:\bcancell?ed\s+cheque\b)", 3),
+    PageRule("bank_details_title", "cheque_or_bank_details",
+             r"(?i:\bbank\s+(?:account\s+)?details\b|\bmicr\b)", 2),
+    PageRule("ifsc_code", "cheque_or_bank_details", r"\b[A-Z]{4}0[A-Z0-9]{6}\b", 2),
+    PageRule("ifsc_keyword", "cheque_or_bank_details", r"(?i:\bifsc\b)", 1),
+    PageRule("account_number", "cheque_or_bank_details",
+             r"(?i:\b(?:a/?c|account)\s*(?:no\.?|number)\s*[:\-]?\s*\d[\d\s]{7,}\d)", 2),
+    # discharge_summary
+    PageRule("discharge_title", "discharge_summary", r"(?i:\bdischarge\s+(?:summary|card)\b)", 3),
+    PageRule("stay_dates", "discharge_summary",
+             r"(?i:\bdate\s+of\s+(?:admission|discharge)\b|\b(?:admission|discharge)\s+date\b)", 2),
+    PageRule("hospital_course", "discharge_summary",
+             r"(?i:\bcourse\s+in\s+(?:the\s+)?hospital\b|\bcondition\s+(?:at|on)\s+discharge\b"
+             r"|\bdischarge\s+(?:advice|instructions)\b)", 2),
+    PageRule("diagnosis", "discharge_summary", r"(?i:\b(?:final\s+|provisional\s+)?diagnosis\b)", 1),
+    # prescription
+    PageRule("prescription_title", "prescription", r"(?i:\bprescription\b)", 3),
+    PageRule("rx_symbol", "prescription", r"\bR[xX]\b", 2),
+    PageRule("dosage_schedule", "prescription", r"\b[0-2]\s*-\s*[0-2]\s*-\s*[0-2]\b", 2),
+    PageRule("dose_form", "prescription", r"(?i:\b(?:tab|cap|syp|inj)\b\.?\s+[a-z])", 1),
+    # investigation_report
+    PageRule("report_title", "investigation_report",
+             r"(?i:\b(?:laboratory|lab|investigation|pathology|radiology|diagnostic)\s+(?:investigation\s+)?report\b"
+             r"|\btest\s+report\b)", 3),
+    PageRule("reference_range", "investigation_report",
+             r"(?i:\b(?:biological\s+)?ref(?:erence)?\.?\s+(?:range|interval)\b)", 2),
+    PageRule("imaging", "investigation_report",
+             r"(?i:\b(?:ultrasound|ultrasonography|x-?ray|mri|ct\s+scan|usg|echocardiography)\b)", 1),
+    PageRule("findings", "investigation_report", r"(?i:\bimpression\s*:|\bfindings\s*:)", 1),
+    PageRule("specimen", "investigation_report", r"(?i:\bspecimen\b|\bsample\s+(?:type|collected)\b)", 1),
+    # cash_receipt
+    PageRule("receipt_title", "cash_receipt",
+             r"(?i:\b(?:payment|cash|money)\s+receipt\b|\breceipt\s+(?:no|number)\b)", 3),
+    PageRule("amount_received", "cash_receipt",
+             r"(?i:\breceived\s+(?:with\s+thanks\s+)?from\b|\bamount\s+received\b|\breceived\s+with\s+thanks\b)", 2),
+    PageRule("payment_mode", "cash_receipt",
+             r"(?i:\bmode\s+of\s+payment\b|\bpaid\s+by\s+(?:cash|card|upi|cheque)\b)", 1),
+    # itemized_bill
+    PageRule("bill_title", "itemized_bill",
+             r"(?i:\bitemi[sz]ed\s+(?:hospital\s+)?bill\b"
+             r"|\b(?:hospital|final|interim|ip|inpatient|pharmacy|centre|center)\s+bill\b"
+             r"|\btax\s+invoice\b|\bbill\s+of\s+supply\b)", 3),
+    PageRule("quantity_times_rate", "itemized_bill",
+             r"\b\d+\s*[xX×]\s*[\d,]+(?:\.\d+)?\s*=\s*(?:(?i:rs)\.?\s*|₹\s*)?[\d,]+", 2),
+    PageRule("charge_line", "itemized_bill",
+             r"(?i:\b(?:room|surgery|surgical|nursing|ot|consultation|pharmacy)\s+charges\b)", 1),
+    PageRule("bill_columns", "itemized_bill", r"(?i:\bqty\b|\bunit\s+price\b|\brate\s+amount\b)", 1),
+)
+
+
+class PageRuleClassifier:
+    """Score pages against keyword/regex rules in a single regex pass.
+
+    All rules are compiled into one alternation with a named group per
+    rule, so each page is scanned once however many rules there are.
+    Each rule counts once per page, double when it matches in the
+    header. The best type is assigned when its share of the total
+    evidence (with a prior of one point against) reaches ``threshold``.
+    """
+
+    def __init__(
+        self,
+        rules: tuple[PageRule, ...] = DEFAULT_RULES,
+        threshold: float = _THRESHOLD,
+        header_chars: int = _HEADER_CHARS,
+    ) -> None:
+        self._rules = {rule.name: rule for rule in rules}
+        self._pattern = re.compile("|".join(f"(?P<{rule.name}>{rule.pattern})" for rule in rules))
+        self._threshold = threshold
+        self._header_chars = header_chars
+        self._lock = threading.Lock()
+        self._rule_hits = dict.fromkeys(self._rules, 0)
+        self._labeled: dict[str, int] = {}
+        self._pages = 0
+        self._deferred = 0
+
+    def classify(self, text: str) -> RuleVerdict:
+        """Score one page's text and decide whether the rules settle it.
+
+        Args:
+            text: The extracted text content of one PDF page.
+
+        Returns:
+            A :class:`RuleVerdict`; ``doc_type`` is ``None`` when the
+            page should go to the LLM.
+        """
+        verdict = self.score(text)
+        self._record(verdict)
+        return verdict
+
+    def score(self, text: str) -> RuleVerdict:
+        """Score one page like :meth:`classify`, without counting it in the stats."""
+        weights: dict[str, float] = {}
+        for match in self._pattern.finditer(text):
+            rule = self._rules[match.lastgroup]
+            weight = rule.weight * (2 if match.start() < self._header_chars else 1)
+            weights[rule.name] = max(weights.get(rule.name, 0.0), weight)
+
+        scores: dict[str, float] = {}
+        for name, weight in weights.items():
+            doc_type = self._rules[name].doc_type
+            scores[doc_type] = scores.get(doc_type, 0.0) + weight
+
+        verdict = RuleVerdict(doc_type=None, confidence=0.0, scores=scores, rules=sorted(weights))
+        if scores:
+            best = max(scores, key=scores.get)
+            verdict.confidence = round(scores[best] / (sum(scores.values()) + 1), 3)
+            if verdict.confidence >= self._threshold:
+                verdict.doc_type = best
+                logger.debug("Rules labeled page as %s (confidence=%s)", best, verdict.confidence)
+        return verdict
+
+    def stats(self) -> dict[str, Any]:
+        """Return per-rule hit counts and how many pages the rules settled."""
+        with self._lock:
+            return {
+                "pages": self._pages,
+                "labeled": sum(self._labeled.values()),
+                "deferred": self._deferred,
+                "labeled_by_type": dict(self._labeled),
+                "rule_hits": dict(self._rule_hits),
+                "threshold": self._threshold,
+            }
+
+    def _record(self, verdict: RuleVerdict) -> None:
+        with self._lock:
+            self._pages += 1
+            for name in verdict.rules:
+                self._rule_hits[name] += 1
+            if verdict.doc_type is None:
+                self._deferred += 1
+            else:
+                self._labeled[verdict.doc_type] = self._labeled.get(verdict.doc_type, 0) + 1
+
+
+_classifier = PageRuleClassifier()
+
+
+def classify_by_rules(text: str) -> RuleVerdict:
+    """Score a page with the default rules.
+
+    Args:
+        text: The extracted text content of one PDF page.
+
+    Returns:
+        The :class:`RuleVerdict` for the page.
+    """
+    return _classifier.classify(text)
+
+
+def score_by_rules(text: str) -> RuleVerdict:
+    """Score a page with the default rules without counting it in the stats.
+
+    Args:
+        text: The extracted text content of one PDF page.
+
+    Returns:
+        The :class:`RuleVerdict` for the page.
+    """
+    return _classifier.score(text)
+
+
+def get_rule_stats() -> dict[str, Any]:
+    """Return hit statistics for the default rules."""
+    return _classifier.stats()
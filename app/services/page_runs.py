@@ -0,0 +1,116 @@
+"""Cheap local detection of multi-page document runs in a claim PDF.
+
+Multi-page documents arrive as contiguous pages: a three-page discharge
+summary, a ten-page bill. ``continuation_score`` estimates whether a
+page continues the document on the previous page from signals that need
+no model: "Page x of y" markers, header lines repeated at the top of
+both pages, and word overlap between the pages.
+"""
+
+import os
+import re
+
+# Minimum continuation score for a page to inherit the previous page's type.
+RUN_THRESHOLD = float(os.getenv("SEGREGATOR_RUN_THRESHOLD", "0.8"))
+
+# Lines at the top of a page compared as a repeated running header.
+_HEADER_LINES = 4
+
+# Shorter header lines ("Page", a date) are too generic to link pages.
+_MIN_HEADER_CHARS = 12
+
+# A shared header is added to the other evidence. It stays below
+# ``RUN_THRESHOLD`` on its own, since a hospital prints its bills,
+# summaries and reports on the same letterhead.
+_SHARED_HEADER_SCORE = 0.4
+_ORPHAN_MARKER_SCORE = 0.6
+
+_MARKER_RE = re.compile(r"(?i)\bpage\s*(\d{1,3})\s*(?:of|/)\s*(\d{1,3})\b")
+_WORD_RE = re.compile(r"[a-z]{2,}|\d+")
+_DIGIT_RE = re.compile(r"\d+")
+
+
+def page_marker(text: str) -> tuple[int, int] | None:
+    """Return the ``(x, y)`` of the first "Page x of y" marker on a page.
+
+    Args:
+        text: The extracted text content of one PDF page.
+
+    Returns:
+        The page number and page count, or ``None`` without a
+        well-formed marker.
+    """
+    match = _MARKER_RE.search(text)
+    if match is None:
+        return None
+    number, total = int(match.group(1)), int(match.group(2))
+    return (number, total) if 1 <= number <= total else None
+
+
+def header_lines(text: str) -> set[str]:
+    """Return the normalised top lines of a page that could be a running header."""
+    lines = set()
+    for line in [line for line in text.splitlines() if line.strip()][:_HEADER_LINES]:
+        if _MARKER_RE.search(line):
+            continue
+        normalised = " ".join(_DIGIT_RE.sub("0", line.lower()).split())
+        if len(normalised) >= _MIN_HEADER_CHARS:
+            lines.add(normalised)
+    return lines
+
+
+def word_overlap(previous: str, current: str) -> float:
+    """Jaccard similarity of the two pages' word sets, digits masked."""
+    a = {_DIGIT_RE.sub("0", word) for word in _WORD_RE.findall(previous.lower())}
+    b = {_DIGIT_RE.sub("0", word) for word in _WORD_RE.findall(current.lower())}
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def continuation_score(previous: str, current: str) -> float:
+    """Estimate how likely ``current`` continues the document on ``previous``.
+
+    Page markers decide when present: "Page 1 of y" always starts a new
+    document, and "Page x of y" right after "Page x-1 of y" always
+    continues one. Otherwise the score is the word overlap of the pages
+    below any shared running header, or more for a marker that does not
+    start a document, raised by ``_SHARED_HEADER_SCORE`` when there is a
+    shared header. A shared header alone does not link pages.
+
+    Args:
+        previous: Text of the preceding page.
+        current: Text of the page being scored.
+
+    Returns:
+        A score in ``[0, 1]``; ``0`` for an empty page.
+    """
+    if not previous.strip() or not current.strip():
+        return 0.0
+    marker = page_marker(current)
+    if marker is not None:
+        previous_marker = page_marker(previous)
+        if marker[0] == 1:
+            return 0.0
+        if previous_marker == (marker[0] - 1, marker[1]):
+            return 1.0
+        if previous_marker is not None:
+            # Both pages are numbered, but not as one document.
+            return 0.0
+    shared = header_lines(previous) & header_lines(current)
+    # The shared header counts once, through its bonus, not again as overlap.
+    score = word_overlap(_without_lines(previous, shared), _without_lines(current, shared))
+    if marker is not None:
+        score = max(score, _ORPHAN_MARKER_SCORE)
+    if shared:
+        score = min(1.0, score + _SHARED_HEADER_SCORE)
+    return score
+
+
+def _without_lines(text: str, normalised: set[str]) -> str:
+    """Drop the lines of ``text`` whose normalised form is in ``normalised``."""
+    if not normalised:
+        return text
+    return "\n".join(
+        line for line in text.splitlines() if " ".join(_DIGIT_RE.sub("0", line.lower()).split()) not in normalised
+    )
@@ -16,8 +16,9 @@ def extract_pages(file_path: str) -> list[dict[str, Any]]:
         file_path: Absolute path to the PDF file on disk.
 
     Returns:
-        A list of dicts, each containing ``page_number`` (1-indexed)
-        and the extracted ``text`` for that page.
+        A list of dicts, each containing ``page_number`` (1-indexed),
+        the extracted ``text`` for that page, its text ``blocks``
+        (see :func:`page_blocks`) and its ``words`` (see :func:`page_words`).
 
     Raises:
         ValueError: If the PDF is corrupt, has zero pages, or contains
@@ -44,6 +45,8 @@ def extract_pages(file_path: str) -> list[dict[str, Any]]:
         pages.append({
             "page_number": page_num + 1,
             "text": text,
+            "blocks": page_blocks(page),
+            "words": page_words(page),
         })
 
     doc.close()
@@ -63,3 +66,46 @@ def extract_pages(file_path: str) -> list[dict[str, Any]]:
         path.name,
     )
     return pages
+
+
+def page_blocks(page: fitz.Page) -> list[list[Any]]:
+    """Return a page's text blocks with positions relative to the page size.
+
+    Args:
+        page: A loaded PyMuPDF page.
+
+    Returns:
+        ``[x0, y0, x1, y1, text]`` per text block in reading order, with
+        coordinates as fractions of the page width and height so layouts
+        compare across page sizes.
+    """
+    width, height = page.rect.width or 1.0, page.rect.height or 1.0
+    blocks: list[list[Any]] = []
+    for x0, y0, x1, y1, text, _block_no, block_type in page.get_text("blocks"):
+        if block_type != 0 or not text.strip():
+            continue  # image block or whitespace
+        blocks.append([
+            round(x0 / width, 4),
+            round(y0 / height, 4),
+            round(x1 / width, 4),
+            round(y1 / height, 4),
+            text.strip(),
+        ])
+    return blocks
+
+
+def page_words(page: fitz.Page) -> list[list[Any]]:
+    """Return a page's words with positions relative to the page size.
+
+    Args:
+        page: A loaded PyMuPDF page.
+
+    Returns:
+        ``[x0, y0, x1, y1, word]`` per word in reading order, with
+        coordinates as fractions of the page width and height.
+    """
+    width, height = page.rect.width or 1.0, page.rect.height or 1.0
+    return [
+        [round(x0 / width, 4), round(y0 / height, 4), round(x1 / width, 4), round(y1 / height, 4), word]
+        for x0, y0, x1, y1, word, *_ in page.get_text("words")
+    ]
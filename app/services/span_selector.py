@@ -0,0 +1,103 @@
+"""Keyword-indexed span selection over page text.
+
+A :class:`SpanSelector` is built once from per-field keyword patterns.
+For a document, it indexes which lines mention which field in one pass
+and keeps only those lines plus a margin of context. It also keeps each
+page's marker and first lines, where the letterhead is. The extraction
+engine sends the kept lines to the LLM instead of the whole document.
+"""
+
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+# Off by default: it changes the discharge prompt, and fields the spans
+# miss cost a second, full-text call.
+SPAN_SELECTION_ENABLED = os.getenv("SPAN_SELECTION_ENABLED", "0") == "1"
+
+# Lines of context kept above and below each keyword line.
+MARGIN_LINES = int(os.getenv("SPAN_MARGIN_LINES", "2"))
+
+# Spans longer than this share of the full text are not worth it; the
+# full text is sent instead.
+MAX_RATIO = float(os.getenv("SPAN_MAX_RATIO", "0.6"))
+
+# ``collect_page_texts`` marker line.
+_PAGE_MARKER_RE = re.compile(r"^--- Page \d+ ---$")
+_GAP = "[...]"
+
+
+class SpanSelector:
+    """Select the lines of a document that can hold given fields.
+
+    Args:
+        keywords: Regex patterns per field, matched case-insensitively.
+        letterhead_lines: Non-empty lines kept from the top of each page.
+    """
+
+    def __init__(self, keywords: dict[str, list[str]], letterhead_lines: int = 3) -> None:
+        self._pattern = re.compile(
+            "|".join(f"(?P<{name}>{'|'.join(patterns)})" for name, patterns in keywords.items()),
+            re.IGNORECASE,
+        )
+        self._letterhead_lines = letterhead_lines
+
+    def index(self, lines: list[str]) -> dict[str, list[int]]:
+        """Map each field to the numbers of the lines mentioning it."""
+        hits: dict[str, list[int]] = {}
+        for number, line in enumerate(lines):
+            for match in self._pattern.finditer(line):
+                found = hits.setdefault(match.lastgroup or "", [])
+                if not found or found[-1] != number:
+                    found.append(number)
+        return hits
+
+    def select(self, text: str) -> str | None:
+        """Return the parts of ``text`` around field keywords.
+
+        Skipped stretches are replaced by a ``[...]`` line.
+
+        Args:
+            text: A document's text, with ``collect_page_texts`` markers.
+
+        Returns:
+            The selected lines, or ``None`` if selection is disabled, no
+            keyword is found or the spans would not be shorter than
+            ``MAX_RATIO`` of the text.
+        """
+        if not SPAN_SELECTION_ENABLED:
+            return None
+        lines = text.splitlines()
+        hits = self.index(lines)
+        if not hits:
+            return None
+
+        keep: set[int] = set()
+        letterhead_left = self._letterhead_lines
+        for number, line in enumerate(lines):
+            if _PAGE_MARKER_RE.match(line.strip()):
+                keep.add(number)
+                letterhead_left = self._letterhead_lines
+            elif letterhead_left and line.strip():
+                keep.add(number)
+                letterhead_left -= 1
+        for numbers in hits.values():
+            for number in numbers:
+                keep.update(range(max(0, number - MARGIN_LINES), min(len(lines), number + MARGIN_LINES + 1)))
+
+        selected: list[str] = []
+        previous = -1
+        for number in sorted(keep):
+            if number != previous + 1:
+                selected.append(_GAP)
+            selected.append(lines[number])
+            previous = number
+        if previous != len(lines) - 1:
+            selected.append(_GAP)
+        spans = "\n".join(selected)
+        if len(spans) > MAX_RATIO * len(text):
+            return None
+        logger.debug("Span selection kept %d of %d characters", len(spans), len(text))
+        return spans
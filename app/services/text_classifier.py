@@ -0,0 +1,442 @@
+"""Local TF-IDF + linear page classifier trained from logged LLM labels.
+
+When ``CLASSIFIER_LABELS_PATH`` is set, every page the LLM classifies
+is appended to a JSONL label log. The
+``train`` command fits a multinomial logistic regression over sublinear
+TF-IDF features with NumPy only, and the segregator uses the saved model
+as a tier in front of the LLM. Run ``python -m app.services.text_classifier
+--help`` for the CLI.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import sys
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CLASSIFIER_ENABLED = os.getenv("CLASSIFIER_ENABLED", "1") == "1"
+
+_MODEL_PATH = os.getenv("CLASSIFIER_MODEL_PATH", ".cache/page_classifier.npz")
+# Logging LLM labels for ``train`` is opt-in: the log holds raw page text.
+_LABELS_PATH = os.getenv("CLASSIFIER_LABELS_PATH", "")
+
+# The label log is rotated to ``<path>.1`` once it reaches this size.
+_LABELS_MAX_BYTES = int(os.getenv("CLASSIFIER_LABELS_MAX_BYTES", str(50 * 1024 * 1024)))
+
+# Minimum predicted probability for a page to skip the LLM.
+_THRESHOLD = float(os.getenv("CLASSIFIER_THRESHOLD", "0.9"))
+
+_TOKEN_RE = re.compile(r"[a-z]{2,}|\d+")
+
+
+def tokenize(text: str) -> list[str]:
+    """Split text into lowercase word unigrams and bigrams, digits masked.
+
+    Args:
+        text: Raw page text.
+
+    Returns:
+        Feature tokens; numbers become ``"0"`` so IDs and amounts
+        generalise across claims.
+    """
+    words = ["0" if token.isdigit() else token for token in _TOKEN_RE.findall(text.lower())]
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+# ---------------------------------------------------------------------------
+# Label log
+# ---------------------------------------------------------------------------
+
+
+class LabelLog:
+    """Append-only JSONL log of ``(page text, document_type)`` pairs.
+
+    Once the file reaches ``max_bytes`` it is moved to ``<path>.1``,
+    replacing the previous one, so the log never exceeds twice that size.
+    """
+
+    def __init__(self, path: str | Path, max_bytes: int = _LABELS_MAX_BYTES) -> None:
+        self._path = Path(path)
+        self._rotated = self._path.with_name(self._path.name + ".1")
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def append(self, text: str, label: str) -> None:
+        """Record one labeled page; write failures are logged, not raised."""
+        line = json.dumps({"text": text, "label": label}, ensure_ascii=False)
+        try:
+            with self._lock:
+                self._path.parent.mkdir(parents=True, exist_ok=True)
+                if self._path.exists() and self._path.stat().st_size >= self._max_bytes:
+                    os.replace(self._path, self._rotated)
+                with self._path.open("a", encoding="utf-8") as handle:
+                    handle.write(line + "\n")
+        except OSError as exc:
+            logger.warning("Could not append to label log %s: %s", self._path, exc)
+
+    def read(self) -> list[tuple[str, str]]:
+        """Return the logged examples, one per distinct text (latest label wins)."""
+        examples: dict[str, str] = {}
+        for path in (self._rotated, self._path):
+            if not path.exists():
+                continue
+            with path.open(encoding="utf-8") as handle:
+                for line in handle:
+                    try:
+                        record = json.loads(line)
+                        examples[str(record["text"])] = str(record["label"])
+                    except (json.JSONDecodeError, KeyError, TypeError):
+                        continue
+        return list(examples.items())
+
+
+_label_log = LabelLog(_LABELS_PATH) if _LABELS_PATH else None
+
+
+def record_label(text: str, label: str) -> None:
+    """Log a page the LLM classified, as training data for the local model.
+
+    Does nothing unless ``CLASSIFIER_LABELS_PATH`` is set.
+
+    Args:
+        text: The page text that was classified.
+        label: The document type the LLM assigned.
+    """
+    if _label_log is not None and text.strip():
+        _label_log.append(text, label)
+
+
+# ---------------------------------------------------------------------------
+# Model
+# ---------------------------------------------------------------------------
+
+
+class TextClassifier:
+    """Multinomial logistic regression over sublinear TF-IDF features.
+
+    Documents are kept sparse as ``(row, column, value)`` triples, and
+    products with the weight matrix are done per class with
+    ``np.bincount``, so memory stays proportional to the number of
+    non-zero features.
+    """
+
+    def __init__(
+        self,
+        vocabulary: list[str],
+        idf: np.ndarray,
+        weights: np.ndarray,
+        bias: np.ndarray,
+        classes: list[str],
+    ) -> None:
+        self.vocabulary = vocabulary
+        self.classes = classes
+        self._index = {token: i for i, token in enumerate(vocabulary)}
+        self._idf = idf
+        self._weights = weights
+        self._bias = bias
+
+    @classmethod
+    def fit(
+        cls,
+        texts: list[str],
+        labels: list[str],
+        max_features: int = 20000,
+        min_df: int = 2,
+        epochs: int = 200,
+        learning_rate: float = 0.1,
+        l2: float = 1e-4,
+    ) -> "TextClassifier":
+        """Train a model on labeled page texts.
+
+        Args:
+            texts: Page texts.
+            labels: Document type of each text.
+            max_features: Vocabulary size cap (most frequent tokens kept).
+            min_df: Minimum number of documents a token must appear in.
+            epochs: Full-batch Adam steps.
+            learning_rate: Adam step size.
+            l2: Weight decay.
+
+        Returns:
+            The trained classifier.
+
+        Raises:
+            ValueError: If fewer than two classes are given.
+        """
+        classes = sorted(set(labels))
+        if len(classes) < 2:
+            raise ValueError("Need examples of at least two document types.")
+
+        tokenized = [tokenize(text) for text in texts]
+        df = Counter(token for tokens in tokenized for token in set(tokens))
+        ranked = sorted((t for t, n in df.items() if n >= min_df), key=lambda t: (-df[t], t))
+        vocabulary = ranked[:max_features]
+        idf = np.array(
+            [math.log((1 + len(texts)) / (1 + df[t])) + 1.0 for t in vocabulary],
+            dtype=np.float32,
+        )
+        model = cls(
+            vocabulary,
+            idf,
+            np.zeros((len(vocabulary), len(classes)), dtype=np.float32),
+            np.zeros(len(classes), dtype=np.float32),
+            classes,
+        )
+
+        rows, cols, vals = model._vectorize(tokenized)
+        n = len(texts)
+        targets = np.zeros((n, len(classes)), dtype=np.float32)
+        class_index = {label: i for i, label in enumerate(classes)}
+        targets[np.arange(n), [class_index[label] for label in labels]] = 1.0
+
+        # Adam on the mean cross-entropy.
+        params = [model._weights, model._bias]
+        moments = [np.zeros_like(p) for p in params]
+        velocities = [np.zeros_like(p) for p in params]
+        beta1, beta2, eps = 0.9, 0.999, 1e-8
+        for step in range(1, epochs + 1):
+            probs = _softmax(model._logits(rows, cols, vals, n))
+            error = (probs - targets) / n
+            grad_w = np.stack(
+                [np.bincount(cols, weights=vals * error[rows, c], minlength=len(vocabulary))
+                 for c in range(len(classes))],
+                axis=1,
+            ).astype(np.float32) + l2 * model._weights
+            grads = [grad_w, error.sum(axis=0)]
+            for param, grad, m, v in zip(params, grads, moments, velocities):
+                m *= beta1
+                m += (1 - beta1) * grad
+                v *= beta2
+                v += (1 - beta2) * grad * grad
+                m_hat = m / (1 - beta1 ** step)
+                v_hat = v / (1 - beta2 ** step)
+                param -= learning_rate * m_hat / (np.sqrt(v_hat) + eps)
+        return model
+
+    def predict_proba(self, texts: list[str]) -> np.ndarray:
+        """Return class probabilities, one row per text, columns in ``classes`` order."""
+        rows, cols, vals = self._vectorize([tokenize(text) for text in texts])
+        return _softmax(self._logits(rows, cols, vals, len(texts)))
+
+    def predict(self, text: str) -> tuple[str, float]:
+        """Return the most likely document type and its probability.
+
+        A text with no known features scores 0, so the class prior alone
+        never labels a page.
+        """
+        if not any(token in self._index for token in tokenize(text)):
+            return "other", 0.0
+        probs = self.predict_proba([text])[0]
+        best = int(probs.argmax())
+        return self.classes[best], float(probs[best])
+
+    def save(self, path: str | Path) -> None:
+        """Write the model as a compressed ``.npz`` file, atomically."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp.npz")
+        np.savez_compressed(
+            tmp,
+            vocabulary=np.array(self.vocabulary, dtype=str),
+            idf=self._idf.astype(np.float32),
+            weights=self._weights.astype(np.float16),
+            bias=self._bias.astype(np.float32),
+            classes=np.array(self.classes, dtype=str),
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str | Path) -> "TextClassifier":
+        """Load a model written by :meth:`save`."""
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                data["vocabulary"].tolist(),
+                data["idf"],
+                data["weights"].astype(np.float32),
+                data["bias"],
+                data["classes"].tolist(),
+            )
+
+    def _vectorize(self, tokenized: list[list[str]]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Build L2-normalised sublinear TF-IDF rows as sparse triples."""
+        rows: list[int] = []
+        cols: list[int] = []
+        vals: list[float] = []
+        for row, tokens in enumerate(tokenized):
+            counts = Counter(self._index[t] for t in tokens if t in self._index)
+            if not counts:
+                continue
+            weights = {col: (1.0 + math.log(count)) * float(self._idf[col]) for col, count in counts.items()}
+            norm = math.sqrt(sum(w * w for w in weights.values()))
+            for col, weight in weights.items():
+                rows.append(row)
+                cols.append(col)
+                vals.append(weight / norm)
+        return (
+            np.array(rows, dtype=np.int64),
+            np.array(cols, dtype=np.int64),
+            np.array(vals, dtype=np.float32),
+        )
+
+    def _logits(self, rows: np.ndarray, cols: np.ndarray, vals: np.ndarray, n: int) -> np.ndarray:
+        """Compute ``X @ W + b`` for sparse ``X``."""
+        columns = [
+            np.bincount(rows, weights=vals * self._weights[cols, c], minlength=n)
+            for c in range(len(self.classes))
+        ]
+        return np.stack(columns, axis=1).astype(np.float32) + self._bias
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    shifted = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(shifted)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+_model: TextClassifier | None = None
+_model_loaded = False
+_model_lock = threading.Lock()
+
+
+def get_text_classifier() -> TextClassifier | None:
+    """Return the trained model, loading it on first use.
+
+    Returns:
+        The model, or ``None`` when it is disabled or no model has been
+        trained yet.
+    """
+    global _model, _model_loaded
+    if _model_loaded:
+        return _model
+    with _model_lock:
+        if not _model_loaded:
+            if CLASSIFIER_ENABLED and Path(_MODEL_PATH).exists():
+                try:
+                    _model = TextClassifier.load(_MODEL_PATH)
+                    logger.info("Loaded page classifier from %s (%d features)", _MODEL_PATH, len(_model.vocabulary))
+                except (OSError, KeyError, ValueError) as exc:
+                    logger.warning("Could not load page classifier from %s: %s", _MODEL_PATH, exc)
+            _model_loaded = True
+    return _model
+
+
+def classify_locally(text: str) -> tuple[str, float] | None:
+    """Label a page with the local model if it is confident enough.
+
+    Args:
+        text: The extracted text content of one PDF page.
+
+    Returns:
+        ``(document_type, probability)`` at or above
+        ``CLASSIFIER_THRESHOLD``, otherwise ``None``.
+    """
+    model = get_text_classifier()
+    if model is None or not text.strip():
+        return None
+    doc_type, probability = model.predict(text)
+    return (doc_type, probability) if probability >= _THRESHOLD else None
+
+
+# ---------------------------------------------------------------------------
+# Evaluation and CLI
+# ---------------------------------------------------------------------------
+
+
+def split_holdout(
+    examples: list[tuple[str, str]],
+    holdout: float,
+) -> tuple[list[tuple[str, str]], list[tuple[str, str]]]:
+    """Split examples into train and held-out sets by a hash of the text.
+
+    The split is stable, so ``evaluate`` scores exactly the examples
+    ``train`` held out, even after more labels are logged.
+    """
+    train: list[tuple[str, str]] = []
+    held: list[tuple[str, str]] = []
+    for text, label in examples:
+        bucket = int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:8], 16) / 0xFFFFFFFF
+        (held if bucket < holdout else train).append((text, label))
+    return train, held
+
+
+def evaluate(model: TextClassifier, examples: list[tuple[str, str]], threshold: float = _THRESHOLD) -> dict[str, Any]:
+    """Score the model against LLM labels.
+
+    Args:
+        model: The classifier to evaluate.
+        examples: ``(text, label)`` pairs.
+        threshold: Probability at which the segregator trusts the model.
+
+    Returns:
+        Overall accuracy, the share of pages that would skip the LLM
+        (``coverage``) and the accuracy on those pages.
+    """
+    if not examples:
+        return {"examples": 0}
+    texts, labels = zip(*examples)
+    probs = model.predict_proba(list(texts))
+    predicted = [model.classes[i] for i in probs.argmax(axis=1)]
+    confident = probs.max(axis=1) >= threshold
+    correct = np.array([p == label for p, label in zip(predicted, labels)])
+    return {
+        "examples": len(examples),
+        "accuracy": round(float(correct.mean()), 4),
+        "threshold": threshold,
+        "coverage": round(float(confident.mean()), 4),
+        "accuracy_above_threshold": round(float(correct[confident].mean()), 4) if confident.any() else None,
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Entry point for ``python -m app.services.text_classifier``."""
+    parser = argparse.ArgumentParser(
+        prog="python -m app.services.text_classifier",
+        description="Train or evaluate the local page classifier from logged LLM labels.",
+    )
+    parser.add_argument("command", choices=("train", "evaluate"))
+    parser.add_argument(
+        "--labels",
+        default=_LABELS_PATH or None,
+        required=not _LABELS_PATH,
+        help="JSONL label log (default: CLASSIFIER_LABELS_PATH)",
+    )
+    parser.add_argument("--model", default=_MODEL_PATH, help="Model file (default: %(default)s)")
+    parser.add_argument("--holdout", type=float, default=0.2, help="Share of labels held out for evaluation")
+    parser.add_argument("--threshold", type=float, default=_THRESHOLD, help="Confidence needed to skip the LLM")
+    parser.add_argument("--epochs", type=int, default=200, help="Training steps")
+    args = parser.parse_args(argv)
+
+    train_set, held_out = split_holdout(LabelLog(args.labels).read(), args.holdout)
+
+    if args.command == "train":
+        if len({label for _, label in train_set}) < 2:
+            print(f"Not enough labeled pages in {args.labels} to train.", file=sys.stderr)
+            return 1
+        texts, labels = zip(*train_set)
+        model = TextClassifier.fit(list(texts), list(labels), epochs=args.epochs)
+        model.save(args.model)
+        report = {"trained_on": len(train_set), "features": len(model.vocabulary), "model": args.model}
+    else:
+        if not Path(args.model).exists():
+            print(f"No model at {args.model}; run 'train' first.", file=sys.stderr)
+            return 1
+        model = TextClassifier.load(args.model)
+        report = {"model": args.model}
+    report["holdout"] = evaluate(model, held_out, args.threshold)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+"""Unit tests for the claim processing route.
+
+The workflow is mocked — these tests cover how the route runs it, not
+what it extracts.
+"""
+
+import threading
+from unittest.mock import patch
+
+import fitz  # PyMuPDF
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import routes
+
+# ─── helpers ──────────────────────────────────────────────────────────────────
+
+
+def _pdf() -> bytes:
+    """A one-page PDF with a line of text."""
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), "DISCHARGE SUMMARY", fontsize=11)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def _client() -> TestClient:
+    """A test client for an app serving only the claim routes."""
+    app = FastAPI()
+    app.include_router(routes.router)
+    return TestClient(app)
+
+
+# ─── Process claim ───────────────────────────────────────────────────────────
+
+
+def test_workflow_runs_off_the_event_loop():
+    """The blocking workflow runs on a worker thread, not the event loop's."""
+    seen: dict[str, threading.Thread] = {}
+    output = {"processing_metadata": {"degraded_nodes": [], "deadline_exceeded": False}}
+
+    def workflow(claim_id, pages, deadline):
+        """Record the calling thread and return an empty result."""
+        seen["thread"] = threading.current_thread()
+        return output
+
+    with patch.object(routes, "run_claim_workflow", side_effect=workflow):
+        response = _client().post(
+            "/api/process",
+            data={"claim_id": "CLM-1"},
+            files={"file": ("claim.pdf", _pdf(), "application/pdf")},
+        )
+
+    assert response.status_code == 200 and response.json()["status"] == "processed"
+    assert seen["thread"] is not threading.main_thread()
+    assert seen["thread"].name.startswith("AnyIO worker thread")
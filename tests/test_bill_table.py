@@ -0,0 +1,244 @@
+"""Unit tests for the geometry-based bill table parser and its use in the bill agent.
+
+Pages are real PyMuPDF renders; the LLM is mocked.
+"""
+
+import json
+from unittest.mock import patch
+
+import fitz  # PyMuPDF
+import pytest
+
+from app.graph.nodes import bill_agent
+from app.services.bill_table import is_header_row, parse_bill_table
+from app.services.pdf_parser import page_words
+
+_TABLE_BILL = (
+    "ITEMIZED HOSPITAL BILL\n"
+    "Patient: Priya Sharma\n"
+    "Date: 05-Mar-2024\n"
+    "Description          Qty   Rate   Amount\n"
+    "Consultation          1    1500    1500\n"
+    "Blood Test (CBC)      1     800     800\n"
+    "Paracetamol 500mg    10       2      20\n"
+    "TOTAL:  Rs. 2320"
+)
+
+_INLINE_BILL = (
+    "DIAGNOSTIC CENTER BILL\n"
+    "Patient ID: 55121\n"
+    "MRI Brain Scan                  Rs. 12000\n"
+    "Bandage (pack of 5)   5 x 50  = Rs.   250\n"
+    "Sub Total                       Rs. 12250\n"
+    "Total: Rs. 12250"
+)
+
+# No header: the lone numbers could be amounts or patient details.
+_HEADERLESS_BILL = (
+    "CITY HOSPITAL BILL\n"
+    "Bill No 12345\n"
+    "IP No 998\n"
+    "Age 45\n"
+    "Consultation 1500\n"
+    "Room Charges 3500\n"
+    "Total: Rs. 5000"
+)
+
+# Columns the parser cannot reconcile: qty x rate != amount.
+_MESSY_BILL = (
+    "PHARMACY BILL\n"
+    "Description          Qty   Rate   Amount\n"
+    "Amoxicillin           2     120     200\n"
+    "Cough Syrup           1      95      95\n"
+)
+
+
+@pytest.fixture(autouse=True)
+def table_parser_enabled():
+    """Turn on the opt-in table path for every test."""
+    with patch.object(bill_agent, "BILL_TABLE_ENABLED", True):
+        yield
+
+
+def _page(text: str, page_number: int = 1) -> dict:
+    """Render ``text`` on a PDF page and return it as an extracted page."""
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 72), text, fontsize=11)
+    extracted = {"page_number": page_number, "text": page.get_text("text").strip(), "words": page_words(page)}
+    doc.close()
+    return extracted
+
+
+def _item(description: str, price: float) -> dict:
+    """A single-unit line item as the LLM reports it."""
+    return {"description": description, "quantity": 1, "unit_price": price, "total_price": price}
+
+
+# ─── Parser ──────────────────────────────────────────────────────────────────
+
+
+def test_header_columns_give_items_and_printed_total():
+    """Rows under a Qty/Rate/Amount header become items; the total row does not."""
+    table = parse_bill_table(_page(_TABLE_BILL)["words"])
+
+    assert [item["description"] for item in table.items] == ["Consultation", "Blood Test (CBC)", "Paracetamol 500mg"]
+    assert table.items[2] == {"description": "Paracetamol 500mg", "quantity": 10, "unit_price": 2, "total_price": 20}
+    assert table.printed_total == 2320
+    assert table.confidence == 1.0
+
+
+def test_inline_quantities_and_subtotals():
+    """``qty x rate = amount`` rows parse; subtotals and labelled IDs are skipped."""
+    table = parse_bill_table(_page(_INLINE_BILL)["words"])
+
+    # Without a header, the lone amount of the scan row is not trusted.
+    assert [(item["quantity"], item["total_price"]) for item in table.items] == [(5, 250)]
+    assert table.printed_total == 12250 and table.candidates == 2
+
+
+def test_headerless_single_numbers_are_not_items():
+    """Rows like "Age 45" on a page without a header never become line items."""
+    table = parse_bill_table(_page(_HEADERLESS_BILL)["words"])
+    assert table.items == [] and table.confidence == 0.0
+
+
+def test_header_rows_are_recognised_by_column_names():
+    """A row of column names is a header; a charge with one column word is not."""
+    assert is_header_row("Particulars Qty Rate Amount")
+    assert is_header_row("Service Charges") is False
+    assert is_header_row("Room Rent") is False
+    assert is_header_row("Unit") is False
+
+
+def test_inconsistent_rows_lower_confidence():
+    """A row whose quantity times rate is not its amount is not an item."""
+    table = parse_bill_table(_page(_MESSY_BILL)["words"])
+    assert len(table.items) == 1 and table.confidence == 0.5
+
+
+# ─── Bill agent ──────────────────────────────────────────────────────────────
+
+
+def test_confident_pages_skip_llm():
+    """A cleanly parsed bill matching its printed total needs no LLM call."""
+    with patch.object(bill_agent, "call_llm") as mock_call, patch.object(bill_agent, "STREAMING_ENABLED", False):
+        result = bill_agent.extract_bill([_page(_TABLE_BILL)], [1])
+
+    mock_call.assert_not_called()
+    assert result["verified_total"] == 2320 and result["calculated_total"] == 2320
+    assert result["total_mismatch"] is False and result["confidence"] == "high"
+
+
+def test_items_missing_the_printed_total_go_to_llm():
+    """A page whose parsed items do not add up to its printed total is re-read by the LLM."""
+    page = _page(_TABLE_BILL.replace("Rs. 2320", "Rs. 9999"))
+    answer = {"items": [_item("Consultation", 1500)], "calculated_total": 1500}
+    with patch.object(bill_agent, "call_llm", return_value=json.dumps(answer)) as mock_call, \
+         patch.object(bill_agent, "STREAMING_ENABLED", False):
+        result = bill_agent.extract_bill([page], [1])
+
+    mock_call.assert_called_once()
+    assert result["items"] == [_item("Consultation", 1500)]
+
+
+def test_headerless_page_with_metadata_goes_to_llm():
+    """Patient and bill numbers on a headerless page are left to the LLM, not summed."""
+    answer = {"items": [_item("Consultation", 1500), _item("Room Charges", 3500)], "calculated_total": 5000}
+    with patch.object(bill_agent, "call_llm", return_value=json.dumps(answer)) as mock_call, \
+         patch.object(bill_agent, "STREAMING_ENABLED", False):
+        result = bill_agent.extract_bill([_page(_HEADERLESS_BILL)], [1])
+
+    mock_call.assert_called_once()
+    assert result["verified_total"] == 5000 and result["total_mismatch"] is False
+
+
+def test_only_low_confidence_pages_go_to_llm():
+    """The LLM sees just the page the parser could not read; items are merged."""
+    pages = [_page(_TABLE_BILL, 1), _page(_MESSY_BILL, 2)]
+    answer = {"items": [{"description": "Amoxicillin", "quantity": 2, "unit_price": 100, "total_price": 200},
+                        {"description": "Cough Syrup", "quantity": 1, "unit_price": 95, "total_price": 95}],
+              "calculated_total": 295}
+    with patch.object(bill_agent, "call_llm", return_value=json.dumps(answer)) as mock_call, \
+         patch.object(bill_agent, "STREAMING_ENABLED", False):
+        result = bill_agent.extract_bill(pages, [1, 2])
+
+    prompt = mock_call.call_args.args[1]
+    assert "Amoxicillin" in prompt and "Consultation" not in prompt
+    assert len(result["items"]) == 5
+    assert result["verified_total"] == 2615 and result["calculated_total"] == 2320 + 295
+
+
+def test_llm_failure_keeps_the_parsed_pages():
+    """A bad answer for the unreadable page keeps the parsed page's items, flagged degraded."""
+    pages = [_page(_TABLE_BILL, 1), _page(_MESSY_BILL, 2)]
+    with patch.object(bill_agent, "call_llm", return_value="not json"), \
+         patch.object(bill_agent, "STREAMING_ENABLED", False):
+        result = bill_agent.bill_agent_node({"claim_id": "CLM-T", "pages": pages,
+                                             "classified_pages": {"itemized_bill": [1, 2]}})
+
+    assert len(result["bill_data"]["items"]) == 3 and result["bill_data"]["verified_total"] == 2320
+    assert result["degraded_nodes"] == ["bill_agent"]
+
+
+# ─── Chunked extraction ──────────────────────────────────────────────────────
+
+
+def test_long_bill_is_extracted_in_chunks_and_merged():
+    """Each chunk is its own request; carried-forward and repeated header rows are dropped."""
+    pages = [{"page_number": n, "text": f"PHARMACY BILL page {n} " + "tablet 10 " * 20} for n in (1, 2, 3)]
+    header = {"description": "Description Qty Rate Amount", "quantity": 1, "unit_price": 0, "total_price": 0}
+    answers = {
+        "page 1": {"items": [_item("Paracetamol", 20), _item("Saline", 150)], "calculated_total": 170},
+        "page 2": {"items": [header, _item("Carried forward", 170), _item("Gauze", 40)], "calculated_total": 210},
+        "page 3": {"items": [_item("Insulin", 400)], "calculated_total": 400},
+    }
+
+    def answer(_system: str, content: str) -> str:
+        """Answer for whichever page the chunk holds."""
+        return json.dumps(next(value for key, value in answers.items() if key in content))
+
+    with patch.object(bill_agent, "_CHUNK_TOKENS", 60), \
+         patch.object(bill_agent, "call_llm", side_effect=answer) as mock_call:
+        result = bill_agent.extract_bill(pages, [1, 2, 3])
+
+    prompts = sorted(call.args[1] for call in mock_call.call_args_list)
+    assert [prompt[:11] for prompt in prompts] == ["Part 1 of 3", "Part 2 of 3", "Part 3 of 3"]
+    assert [item["description"] for item in result["items"]] == ["Paracetamol", "Saline", "Gauze", "Insulin"]
+    assert result["verified_total"] == 610 and result["calculated_total"] == 610
+    assert result["total_mismatch"] is False
+
+
+def test_charges_repeated_across_chunks_are_kept():
+    """The same daily charge ending one chunk and starting the next is billed twice."""
+    pages = [{"page_number": n, "text": f"WARD BILL page {n} " + "room 10 " * 20} for n in (1, 2)]
+    answers = iter([
+        json.dumps({"items": [_item("Consultation", 500), _item("Room Rent", 2000)], "calculated_total": 2500}),
+        json.dumps({"items": [_item("Room Rent", 2000), _item("Nursing", 300)], "calculated_total": 2300}),
+    ])
+    with patch.object(bill_agent, "_CHUNK_TOKENS", 60), \
+         patch.object(bill_agent, "_CHUNK_CONCURRENCY", 1), \
+         patch.object(bill_agent, "call_llm", side_effect=lambda *_: next(answers)):
+        result = bill_agent.extract_bill(pages, [1, 2])
+
+    assert [item["description"] for item in result["items"]] == ["Consultation", "Room Rent", "Room Rent", "Nursing"]
+    assert result["verified_total"] == 4800 and result["total_mismatch"] is False
+
+
+def test_failed_chunk_keeps_the_others_and_degrades():
+    """A chunk without an item list is left out, and the bill is flagged partial."""
+    pages = [{"page_number": n, "text": f"PHARMACY BILL page {n} " + "tablet 10 " * 20} for n in (1, 2)]
+    answers = iter([json.dumps({"items": [_item("Saline", 150)], "calculated_total": 150}), "{}"])
+    with patch.object(bill_agent, "_CHUNK_TOKENS", 60), \
+         patch.object(bill_agent, "_CHUNK_CONCURRENCY", 1), \
+         patch.object(bill_agent, "call_llm", side_effect=lambda *_: next(answers)):
+        result = bill_agent.extract_bill(pages, [1, 2])
+    assert result["items"] == [_item("Saline", 150)] and result["degraded"] is True
+
+
+def test_all_chunks_failing_gives_the_default_bill():
+    """With no chunk answered, nothing is made up."""
+    pages = [{"page_number": n, "text": f"PHARMACY BILL page {n} " + "tablet 10 " * 20} for n in (1, 2)]
+    with patch.object(bill_agent, "_CHUNK_TOKENS", 60), patch.object(bill_agent, "call_llm", return_value="{}"):
+        result = bill_agent.extract_bill(pages, [1, 2])
+    assert result["items"] == [] and result["confidence"] == "low"
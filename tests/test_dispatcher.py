@@ -0,0 +1,153 @@
+"""Unit tests for the streaming dispatcher node.
+
+Page classification and the agents are mocked — these tests cover when
+each agent starts and which pages it gets, not what it extracts.
+"""
+
+import json
+import threading
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.graph import workflow
+from app.graph.nodes import dispatcher, llm_client, segregator
+from app.graph.nodes.llm_client import LLMCallCancelledError, LLMResponseCache
+from app.services import page_fingerprint, text_classifier
+from app.services.page_fingerprint import PageFingerprintIndex
+
+# ─── helpers ──────────────────────────────────────────────────────────────────
+
+
+@pytest.fixture(autouse=True)
+def isolated_local_tiers():
+    """Keep the fingerprint index and local model out of classification."""
+    with patch.object(page_fingerprint, "_index", PageFingerprintIndex(None)), \
+         patch.object(text_classifier, "_model", None), \
+         patch.object(text_classifier, "_model_loaded", True), \
+         patch.object(segregator, "remember_llm_label"):
+        yield
+
+
+def _state(*texts: str) -> dict:
+    """Build a minimal claim state with one page per text."""
+    pages = [{"page_number": i, "text": text} for i, text in enumerate(texts, start=1)]
+    return {"claim_id": "CLM-DISPATCH", "pages": pages, "classified_pages": {}, "degraded_nodes": []}
+
+
+def _labels(mapping: dict[str, str], wait: dict[str, threading.Event] | None = None):
+    """Build a fake ``call_llm`` answering by page text, optionally blocking first."""
+    def fake_call(_prompt, text):
+        if wait and text in wait:
+            wait[text].wait(timeout=2)
+        return json.dumps({"document_type": mapping[text]})
+    return fake_call
+
+
+def _fake_agents(calls: list, started: threading.Event | None = None) -> dict:
+    """Build agent stand-ins that record the pages each was given."""
+    def make(doc_type, key):
+        def agent(state):
+            calls.append((doc_type, state["classified_pages"].get(doc_type, [])))
+            if started is not None and doc_type == "identity_document":
+                started.set()
+            return {key: {"pages": state["classified_pages"].get(doc_type, [])}}
+        return agent
+    return {
+        "identity_document": make("identity_document", "id_data"),
+        "discharge_summary": make("discharge_summary", "discharge_data"),
+        "itemized_bill": make("itemized_bill", "bill_data"),
+    }
+
+
+# ─── Streaming dispatch ──────────────────────────────────────────────────────
+
+
+def test_agent_starts_before_classification_finishes():
+    """The ID agent runs while a later page is still being classified."""
+    started = threading.Event()
+    calls: list = []
+    mapping = {"card": "identity_document", "note a": "other", "note b": "other"}
+    fake_call = _labels(mapping, wait={"note b": started})
+    with patch.dict(dispatcher.AGENTS, _fake_agents(calls, started)), \
+         patch.object(segregator, "call_llm", side_effect=fake_call):
+        result = dispatcher.dispatcher_node(_state("card", "note a", "note b"))
+
+    assert started.is_set()
+    assert result["id_data"] == {"pages": [1]}
+    assert result["classified_pages"] == {"identity_document": [1], "other": [2, 3]}
+    assert calls.count(("identity_document", [1])) == 1
+
+
+def test_early_agent_is_rerun_when_more_pages_arrive():
+    """A type that reappears after its run gets the agent on all its pages."""
+    calls: list = []
+    mapping = {"card": "identity_document", "note": "other", "card back": "identity_document"}
+    with patch.dict(dispatcher.AGENTS, _fake_agents(calls)), \
+         patch.object(segregator, "_CLASSIFY_CONCURRENCY", 1), \
+         patch.object(segregator, "call_llm", side_effect=_labels(mapping)):
+        result = dispatcher.dispatcher_node(_state("card", "note", "card back"))
+
+    assert ("identity_document", [1]) in calls
+    assert result["id_data"] == {"pages": [1, 3]}
+    assert result["discharge_data"] == {"pages": []}
+
+
+def test_stale_early_runs_make_no_llm_calls():
+    """With interleaved types, each agent calls the LLM once, for its full page set."""
+    client = MagicMock()
+    client.chat.completions.create.return_value = SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content="{}"))], usage=None
+    )
+    classified = threading.Event()
+    on_page = dispatcher._StreamingDispatch.on_page
+
+    def record_page(self, index, doc_type):
+        """Note when the last page is classified."""
+        on_page(self, index, doc_type)
+        if None not in self._types:
+            classified.set()
+
+    def make(key):
+        def agent(state):
+            """Call the LLM once classification is over, as a slow agent would."""
+            classified.wait(timeout=2)
+            try:
+                llm_client.call_llm("extract", json.dumps(state["classified_pages"]))
+            except LLMCallCancelledError:
+                return {key: "cancelled"}
+            return {key: state["classified_pages"]}
+        return agent
+
+    agents = {"identity_document": make("id_data"), "discharge_summary": make("discharge_data"),
+              "itemized_bill": make("bill_data")}
+    mapping = {"card": "identity_document", "bill": "itemized_bill", "card back": "identity_document",
+               "bill page 2": "itemized_bill", "note": "other"}
+    with patch.dict(dispatcher.AGENTS, agents), \
+         patch.object(dispatcher._StreamingDispatch, "on_page", record_page), \
+         patch.object(segregator, "_CLASSIFY_CONCURRENCY", 1), \
+         patch.object(segregator, "call_llm", side_effect=_labels(mapping)), \
+         patch.object(llm_client, "get_cerebras_client", return_value=client), \
+         patch.object(llm_client, "_cache", LLMResponseCache(None)):
+        result = dispatcher.dispatcher_node(_state("card", "bill", "card back", "bill page 2", "note"))
+
+    assert result["id_data"] == {"identity_document": [1, 3]}
+    assert result["bill_data"] == {"itemized_bill": [2, 4]}
+    # One call per agent; the stale early runs on pages [1] and [2] made none.
+    assert client.chat.completions.create.call_count == 3
+
+
+def test_streaming_workflow_produces_final_output():
+    """The dispatcher graph feeds the aggregator like the fan-out graph."""
+    calls: list = []
+    with patch.dict(dispatcher.AGENTS, _fake_agents(calls)), \
+         patch.object(segregator, "call_llm", side_effect=_labels({"card": "identity_document"})):
+        state = {**_state("card"), "id_data": {}, "discharge_data": {}, "bill_data": {},
+                 "final_output": {}, "deadline": None}
+        result = workflow.build_workflow(streaming_dispatch=True).invoke(state)
+
+    output = result["final_output"]
+    assert output["identity_info"] == {"pages": [1]}
+    assert output["processing_metadata"]["classified_types"] == ["identity_document"]
+    assert output["processing_metadata"]["degraded_nodes"] == []
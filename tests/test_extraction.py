@@ -0,0 +1,160 @@
+"""Unit tests for the schema-driven extraction engine.
+
+The LLM is mocked — these tests cover how schemas compile, how they are
+grouped into requests, how combined answers are split and which spans of
+a discharge summary are sent.
+"""
+
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.graph import workflow
+from app.graph.nodes import extraction
+from app.graph.nodes.discharge_agent import DISCHARGE_SCHEMA
+from app.graph.nodes.extraction import ExtractionSchema, compile_schema, make_extraction_node, run_schemas
+from app.graph.nodes.id_agent import ID_SCHEMA
+from app.graph.nodes.llm_client import LLMUnavailableError
+from app.services import span_selector
+
+# A schema for another document type; wiring it into the graph also
+# needs a ClaimState key, an aggregator entry and workflow edges.
+PRESCRIPTION_SCHEMA = compile_schema(
+    ExtractionSchema(
+        name="prescription_agent",
+        label="Prescription Agent",
+        doc_type="prescription",
+        document="prescription",
+        state_key="prescription_data",
+        fields=("prescribing_doctor", "prescription_date"),
+    )
+)
+
+
+@pytest.fixture(autouse=True)
+def combine_small_requests():
+    """Combine schemas whose pages fit in a small request."""
+    with patch.object(extraction, "COMBINE_TOKENS", 200):
+        yield
+
+
+def _pages(*texts: str) -> list[dict]:
+    """Build extracted pages, numbered from 1."""
+    return [{"page_number": i, "text": text} for i, text in enumerate(texts, start=1)]
+
+
+# ─── Schemas ─────────────────────────────────────────────────────────────────
+
+
+def test_declared_schema_compiles_prompt_validator_and_scorer():
+    """A schema yields its prompt, string-only validation and confidence."""
+    assert '"prescribing_doctor": "<string or null>",\n  "prescription_date"' in PRESCRIPTION_SCHEMA.system_prompt
+    assert "text from prescription pages" in PRESCRIPTION_SCHEMA.system_prompt
+    result = PRESCRIPTION_SCHEMA.result({"prescribing_doctor": "Dr. Rao", "prescription_date": 20240301, "x": 1})
+    assert result == {"prescribing_doctor": "Dr. Rao", "prescription_date": "20240301", "confidence": "high"}
+    assert PRESCRIPTION_SCHEMA.default()["confidence"] == "low"
+
+
+# ─── Combined requests ───────────────────────────────────────────────────────
+
+
+def test_small_schemas_share_one_request():
+    """ID and discharge fields for a small claim come from one LLM call."""
+    pages = _pages("AADHAAR CARD\nName: Raj Malhotra", "DISCHARGE SUMMARY\nDiagnosis: Dengue")
+    answer = {
+        "identity_document": {"patient_name": "RAJ M", "date_of_birth": "05-07-1982"},
+        "discharge_summary": {"diagnosis": "Dengue", "hospital_name": "City Hospital"},
+    }
+    llm = MagicMock(return_value=json.dumps(answer))
+    results = run_schemas([ID_SCHEMA, DISCHARGE_SCHEMA], pages, {"identity_document": [1], "discharge_summary": [2]}, llm)
+
+    llm.assert_called_once()
+    content = llm.call_args.args[1]
+    assert "- identity_document: pages 1" in content and "- patient_name: Raj Malhotra" in content
+    # The validated pattern match wins over the LLM's reading.
+    assert results["id_data"]["patient_name"] == "Raj Malhotra"
+    assert results["discharge_data"]["diagnosis"] == "Dengue"
+    assert results["discharge_data"]["confidence"] == "medium"
+
+
+def test_large_schemas_get_their_own_requests():
+    """Pages over the token budget are not combined."""
+    pages = _pages("identity " * 150, "discharge " * 150)
+    llm = MagicMock(return_value=json.dumps({}))
+    run_schemas([ID_SCHEMA, DISCHARGE_SCHEMA], pages, {"identity_document": [1], "discharge_summary": [2]}, llm)
+    assert llm.call_count == 2
+
+
+def test_extraction_node_reports_each_degraded_agent():
+    """An open circuit degrades every agent that shared the request."""
+    node = make_extraction_node([ID_SCHEMA, DISCHARGE_SCHEMA])
+    state = {"claim_id": "CLM-X", "pages": _pages("card text", "summary text"),
+             "classified_pages": {"identity_document": [1], "discharge_summary": [2]}}
+    with patch.object(extraction, "call_llm", side_effect=LLMUnavailableError(5.0)):
+        result = node(state)
+
+    assert result["id_data"]["degraded"] is True and result["discharge_data"]["confidence"] == "low"
+    assert result["degraded_nodes"] == ["id_agent", "discharge_agent"]
+    assert "extraction" in workflow.build_workflow(combine_extraction=True).get_graph().nodes
+
+
+# ─── Span selection ──────────────────────────────────────────────────────────
+
+_HISTORY = "\n".join(f"Day {day}: vitals stable, IV fluids and antibiotics continued." for day in range(1, 40))
+_LONG_SUMMARY = (
+    "CITY CARE HOSPITAL\n12 MG Road, Bangalore\nDISCHARGE SUMMARY\n"
+    "Date of Admission: 01-03-2024\nDate of Discharge: 09-03-2024\nConsultant: Dr. Meera Shah\n"
+    "Final Diagnosis:\nDengue fever with thrombocytopenia\n\nCourse in ward\n" + _HISTORY
+)
+_FIELDS = {"diagnosis": "Dengue fever", "admission_date": "01-03-2024", "discharge_date": "09-03-2024",
+           "treating_physician": "Dr. Meera Shah", "hospital_name": "City Care Hospital"}
+
+
+@pytest.fixture
+def span_selection():
+    """Turn span selection on; it is off by default."""
+    with patch.object(span_selector, "SPAN_SELECTION_ENABLED", True):
+        yield
+
+
+def test_span_selection_is_opt_in():
+    """With the default settings a long summary is sent whole, in one call."""
+    llm = MagicMock(return_value=json.dumps({**_FIELDS, "treating_physician": None}))
+    extraction.extract_fields(DISCHARGE_SCHEMA, _pages(_LONG_SUMMARY), [1], llm)
+
+    llm.assert_called_once()
+    assert "Day 20" in llm.call_args.args[1]
+
+
+def test_discharge_prompt_holds_only_the_relevant_spans(span_selection):
+    """A long summary is cut to its letterhead and keyword lines."""
+    llm = MagicMock(return_value=json.dumps(_FIELDS))
+    result = extraction.extract_fields(DISCHARGE_SCHEMA, _pages(_LONG_SUMMARY), [1], llm)
+
+    llm.assert_called_once()
+    sent = llm.call_args.args[1]
+    assert "CITY CARE HOSPITAL" in sent and "Dengue fever with thrombocytopenia" in sent
+    assert "Day 20" not in sent and "[...]" in sent
+    assert len(sent) < 0.25 * len(_LONG_SUMMARY)
+    assert result["confidence"] == "high"
+
+
+def test_fields_missing_from_spans_are_asked_with_full_text(span_selection):
+    """A null field triggers one more call with the whole text; span values are kept."""
+    answers = iter([{**_FIELDS, "treating_physician": None}, {**_FIELDS, "diagnosis": "Fever"}])
+    llm = MagicMock(side_effect=lambda *_: json.dumps(next(answers)))
+    result = extraction.extract_fields(DISCHARGE_SCHEMA, _pages(_LONG_SUMMARY), [1], llm)
+
+    assert llm.call_count == 2 and "Day 20" in llm.call_args.args[1]
+    assert result["treating_physician"] == "Dr. Meera Shah" and result["diagnosis"] == "Dengue fever"
+
+
+def test_short_summary_is_sent_whole(span_selection):
+    """Spans that would not shorten the text much are not used."""
+    short = "CITY HOSPITAL\nDiagnosis: Dengue\nDate of Admission: 01-03-2024"
+    llm = MagicMock(return_value=json.dumps({"diagnosis": None}))
+    extraction.extract_fields(DISCHARGE_SCHEMA, _pages(short), [1], llm)
+
+    llm.assert_called_once()
+    assert llm.call_args.args[1] == f"--- Page 1 ---\n{short}"
@@ -0,0 +1,115 @@
+"""Unit tests for the fused single-call mode for small claims.
+
+The LLM and the fallback pipeline are mocked — these tests cover when
+the fused call is used and how its answer is split into the state keys.
+"""
+
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.graph import workflow
+from app.graph.nodes import fused
+
+# ─── helpers ──────────────────────────────────────────────────────────────────
+
+
+@pytest.fixture(autouse=True)
+def no_label_logging():
+    """Keep fused labels out of the fingerprint index and training log."""
+    with patch.object(fused, "remember_llm_label"), patch.object(fused, "FUSED_MAX_TOKENS", 2000):
+        yield
+
+
+def _state(*texts: str) -> dict:
+    """Build a minimal claim state with one page per text."""
+    pages = [{"page_number": i, "text": text} for i, text in enumerate(texts, start=1)]
+    return {"claim_id": "CLM-FUSED", "pages": pages, "classified_pages": {}, "degraded_nodes": []}
+
+
+_ANSWER = {
+    "pages": [
+        {"page_number": 1, "document_type": "identity_document"},
+        {"page_number": 2, "document_type": "itemized_bill"},
+    ],
+    "identity": {"patient_name": "Ravi Iyer", "date_of_birth": None, "policy_number": "P-77",
+                 "member_id": None, "insurance_provider": None},
+    "discharge": {"diagnosis": "Dengue"},
+    "bill": {"items": [{"description": "Consultation", "quantity": 1, "unit_price": 500, "total_price": 500},
+                       {"description": "CBC", "quantity": 2, "unit_price": 300, "total_price": 500}],
+             "calculated_total": 1000},
+}
+
+
+# ─── Fused mode ──────────────────────────────────────────────────────────────
+
+
+def test_small_claim_is_processed_with_one_call():
+    """One LLM call yields every state key, through the agents' validators."""
+    state = _state("AADHAAR CARD Ravi Iyer", "HOSPITAL BILL Consultation 500 CBC 2 x 300")
+    fallback = MagicMock()
+    with patch.object(fused, "call_llm", return_value=json.dumps(_ANSWER)) as mock_call:
+        result = fused.make_fused_node(fallback)(state)
+
+    mock_call.assert_called_once()
+    fallback.assert_not_called()
+    assert result["classified_pages"] == {"identity_document": [1], "itemized_bill": [2]}
+    assert result["id_data"]["patient_name"] == "Ravi Iyer" and result["id_data"]["confidence"] == "medium"
+    # No discharge pages were classified, so the stray answer is ignored.
+    assert result["discharge_data"]["diagnosis"] is None
+    assert result["bill_data"]["verified_total"] == 1100 and result["bill_data"]["total_mismatch"] is True
+
+
+def test_unusable_answer_falls_back_to_the_agents():
+    """A page missing from the answer sends the claim down the normal path."""
+    answer = {**_ANSWER, "pages": _ANSWER["pages"][:1]}
+    fallback = MagicMock(return_value={"classified_pages": {}})
+    with patch.object(fused, "call_llm", return_value=json.dumps(answer)):
+        result = fused.make_fused_node(fallback)(_state("card", "bill"))
+
+    fallback.assert_called_once()
+    assert result == {"classified_pages": {}}
+
+
+def test_large_claim_skips_the_fused_call():
+    """Claims above ``WORKFLOW_FUSED_MAX_TOKENS`` never make the fused call."""
+    fallback = MagicMock(return_value={})
+    with patch.object(fused, "FUSED_MAX_TOKENS", 5), patch.object(fused, "call_llm") as mock_call:
+        fused.make_fused_node(fallback)(_state("a page with rather more than five tokens of text on it"))
+
+    mock_call.assert_not_called()
+    fallback.assert_called_once()
+    assert "fused" in workflow.build_workflow(fused=True).get_graph().nodes
+
+
+def test_fallback_runs_the_configured_pipeline():
+    """Without a usable fused answer the graph runs the extraction node it was built with."""
+    ran = []
+
+    def segregator(state):
+        """Classify the single page as a discharge summary."""
+        ran.append("segregator")
+        return {"classified_pages": {"discharge_summary": [1]}}
+
+    def bill_agent(state):
+        """Return an empty bill."""
+        ran.append("bill_agent")
+        return {"bill_data": {}}
+
+    def extraction(state):
+        """Return degraded identity and discharge data."""
+        ran.append("extraction")
+        return {"id_data": {}, "discharge_data": {"diagnosis": "Dengue"}, "degraded_nodes": ["extraction"]}
+
+    with patch.object(workflow, "segregator_node", segregator), \
+         patch.object(workflow, "bill_agent_node", bill_agent), \
+         patch.object(workflow, "make_extraction_node", return_value=extraction), \
+         patch.object(workflow, "aggregator_node", lambda state: {"final_output": dict(state)}), \
+         patch.object(fused, "call_llm", side_effect=RuntimeError("down")):
+        graph = workflow.build_workflow(streaming_dispatch=False, fused=True, combine_extraction=True)
+        state = graph.invoke(_state("discharge summary"))
+
+    assert sorted(ran) == ["bill_agent", "extraction", "segregator"]
+    assert state["discharge_data"] == {"diagnosis": "Dengue"}
+    assert state["degraded_nodes"] == ["extraction"]
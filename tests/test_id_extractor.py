@@ -0,0 +1,99 @@
+"""Unit tests for deterministic identity extraction in front of the ID agent's LLM."""
+
+import json
+from unittest.mock import patch
+
+from app.graph.nodes import id_agent
+from app.services.id_extractor import extract_id_fields, verhoeff_valid
+
+FIELDS = ["patient_name", "date_of_birth", "policy_number", "member_id", "insurance_provider"]
+
+_INSURER_CARD = (
+    "Star Health and Allied Insurance Co. Ltd.\n"
+    "Name: Priya Nair\n"
+    "Date of Birth: 14/08/1988\n"
+    "Policy No: SH-2024-001234\n"
+    "Member ID: MBR00917\n"
+)
+
+
+def _pages(*texts: str) -> list[dict]:
+    """Build extracted pages, numbered from 1."""
+    return [{"page_number": i, "text": text} for i, text in enumerate(texts, start=1)]
+
+
+# ─── Patterns and checksums ──────────────────────────────────────────────────
+
+
+def test_verhoeff_accepts_only_valid_check_digits():
+    """Aadhaar numbers with a wrong check digit are not reported."""
+    assert verhoeff_valid("234567890124")
+    assert not verhoeff_valid("234567890125")
+    findings = extract_id_fields("Aadhaar: 2345 6789 0124\nOld: 2345 6789 0125\nPAN: ABCPE1234F", FIELDS)
+    assert findings.aadhaar == ["2345 6789 0124"]
+    assert findings.pan == ["ABCPE1234F"]
+
+
+def test_invalid_date_is_left_for_the_llm():
+    """An impossible date of birth is not extracted and marks the field unresolved."""
+    findings = extract_id_fields("Name: A B\nDate of Birth: 31-02-1990", FIELDS)
+    assert "date_of_birth" not in findings.fields
+    assert findings.unresolved == {"date_of_birth"}
+
+
+def test_hospital_uhid_is_not_a_member_id():
+    """A hospital's UHID is the patient's record number, not the insurer's member ID."""
+    findings = extract_id_fields("Name: Priya Nair\nUHID No: CH-0042871", FIELDS)
+    assert "member_id" not in findings.fields
+
+
+# ─── ID agent fast path ──────────────────────────────────────────────────────
+
+
+def test_clean_insurer_card_skips_llm():
+    """Every required field found deterministically means no LLM call."""
+    with patch.object(id_agent, "call_llm") as mock_call:
+        result = id_agent.extract_identity(_pages(_INSURER_CARD), [1])
+
+    mock_call.assert_not_called()
+    assert result == {
+        "patient_name": "Priya Nair",
+        "date_of_birth": "14/08/1988",
+        "policy_number": "SH-2024-001234",
+        "member_id": "MBR00917",
+        "insurance_provider": "Star Health and Allied Insurance Co. Ltd.",
+        "confidence": "high",
+    }
+
+
+def test_prefill_can_be_turned_off():
+    """With ``ID_PREFILL_ENABLED`` off the LLM reads the card alone, without hints."""
+    answer = {"patient_name": "Priya Nair", "date_of_birth": None, "policy_number": None,
+              "member_id": None, "insurance_provider": None}
+    with patch.object(id_agent, "ID_PREFILL_ENABLED", False), \
+         patch.object(id_agent, "call_llm", return_value=json.dumps(answer)) as mock_call:
+        result = id_agent.extract_identity(_pages(_INSURER_CARD), [1])
+
+    mock_call.assert_called_once()
+    assert "Already read" not in mock_call.call_args.args[1]
+    assert result["patient_name"] == "Priya Nair" and result["policy_number"] is None
+
+
+def test_partial_findings_are_passed_to_the_llm():
+    """Missing fields go to the LLM with the verified values as hints, which win."""
+    text = "AADHAAR CARD\nName: Raj Malhotra\nDOB: 05-07-1982\nAadhaar: 2345 6789 0124"
+    answer = {"patient_name": "RAJ M", "date_of_birth": None, "policy_number": None,
+              "member_id": None, "insurance_provider": None}
+    with patch.object(id_agent, "call_llm", return_value=json.dumps(answer)) as mock_call:
+        result = id_agent.extract_identity(_pages(text), [1])
+
+    prompt = mock_call.call_args.args[1]
+    assert "- patient_name: Raj Malhotra" in prompt and "Aadhaar number 2345 6789 0124" in prompt
+    assert result["patient_name"] == "Raj Malhotra" and result["date_of_birth"] == "05-07-1982"
+
+
+def test_llm_failure_still_returns_defaults():
+    """Partial findings are not returned when the LLM call fails."""
+    with patch.object(id_agent, "call_llm", side_effect=RuntimeError("timeout")):
+        result = id_agent.extract_identity(_pages("Name: Raj Malhotra\nDate of Birth: 05-07-1982"), [1])
+    assert result["patient_name"] is None and result["confidence"] == "low"
@@ -0,0 +1,156 @@
+"""Unit tests for the layout template registry.
+
+Pages are real PyMuPDF renders of one form filled with different
+people; the LLM is mocked and must not be called for matched pages.
+"""
+
+from unittest.mock import patch
+
+import fitz  # PyMuPDF
+import pytest
+
+from app.graph.nodes import id_agent, segregator
+from app.services import layout_templates, page_fingerprint
+from app.services.layout_templates import LayoutSampleLog, TemplateIndex, learn_templates, record_layout_samples
+from app.services.page_fingerprint import PageFingerprintIndex
+from app.services.pdf_parser import page_blocks
+
+# ─── helpers ──────────────────────────────────────────────────────────────────
+
+_PEOPLE = [
+    ("Ramesh Kumar", "12/03/1980", "SH-2024-0001", "M-1001"),
+    ("Anita Sharma", "01/11/1975", "SH-2024-0552", "M-2202"),
+    ("Vikram Rao", "30/06/1990", "SH-2023-9982", "M-0031"),
+]
+
+
+def _card(name: str, dob: str, policy: str, member: str) -> dict:
+    """Render the insurer's ID card form and return it as an extracted page."""
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 60), "STAR HEALTH TPA - MEMBER IDENTITY CARD", fontsize=14)
+    page.insert_text((72, 110), "Insurer: Star Health Insurance", fontsize=11)
+    page.insert_text((72, 150), f"Member Name: {name}", fontsize=11)
+    page.insert_text((72, 180), f"Date of Birth: {dob}", fontsize=11)
+    page.insert_text((72, 210), f"Policy No: {policy}", fontsize=11)
+    page.insert_text((72, 240), f"Member ID: {member}", fontsize=11)
+    page.insert_text((72, 300), "This card is valid only with a photo ID", fontsize=9)
+    extracted = {"page_number": 1, "text": page.get_text("text").strip(), "blocks": page_blocks(page)}
+    doc.close()
+    return extracted
+
+
+def _fields(name: str, dob: str, policy: str, member: str) -> dict:
+    """The ID agent's output for a card."""
+    return {
+        "patient_name": name,
+        "date_of_birth": dob,
+        "policy_number": policy,
+        "member_id": member,
+        "insurance_provider": "Star Health Insurance",
+    }
+
+
+@pytest.fixture
+def card_index(tmp_path):
+    """Log three processed cards, learn from them and install the templates."""
+    log = LayoutSampleLog(tmp_path / "samples.jsonl")
+    with patch.object(layout_templates, "_sample_log", log):
+        for person in _PEOPLE:
+            record_layout_samples([_card(*person)], {"identity_document": [1]}, {"identity_document": _fields(*person)})
+    TemplateIndex(learn_templates(log.read())).save(tmp_path / "templates.json")
+    index = TemplateIndex.load(tmp_path / "templates.json")
+    with patch.object(layout_templates, "_index", index), patch.object(layout_templates, "_index_loaded", True):
+        yield index
+
+
+# ─── Learning and matching ───────────────────────────────────────────────────
+
+
+def test_learned_template_matches_new_page_and_reads_fields(card_index):
+    """A fourth card of the same form matches and yields every field."""
+    new = ("Suresh Iyer", "05/05/1966", "SH-2025-1234", "M-7777")
+    page = _card(*new)
+    match = card_index.match(page["blocks"])
+
+    assert match is not None and match.template.doc_type == "identity_document"
+    assert card_index.extract(match, page["blocks"]) == _fields(*new)
+
+
+def test_single_sample_or_other_layout_does_not_match(card_index):
+    """A layout seen once is not learned, and other layouts don't match."""
+    assert learn_templates([{"doc_type": "other", "blocks": _card(*_PEOPLE[0])["blocks"], "fields": {}}]) == []
+    other = [[0.1, 0.1, 0.5, 0.12, "CITY HOSPITAL DISCHARGE SUMMARY"], [0.1, 0.2, 0.5, 0.22, "Diagnosis: Dengue"]]
+    assert card_index.match(other) is None
+
+
+def test_matched_pages_skip_classification_and_extraction_llm(card_index):
+    """Template pages need neither the segregator's nor the ID agent's LLM call."""
+    page = _card("Suresh Iyer", "05/05/1966", "SH-2025-1234", "M-7777")
+    with patch.object(page_fingerprint, "_index", PageFingerprintIndex(None)), \
+         patch.object(segregator, "call_llm") as classify_call, \
+         patch.object(id_agent, "call_llm") as extract_call:
+        classified = segregator.segregator_node({"claim_id": "CLM-T", "pages": [page]})["classified_pages"]
+        id_data = id_agent.extract_identity([page], classified["identity_document"])
+
+    assert classified == {"identity_document": [1]}
+    assert id_data["patient_name"] == "Suresh Iyer" and id_data["confidence"] == "high"
+    classify_call.assert_not_called()
+    extract_call.assert_not_called()
+
+
+# ─── Sample log ──────────────────────────────────────────────────────────────
+
+
+def test_sample_log_holds_no_personal_data_and_rotates(tmp_path):
+    """Identity values and digits never reach the log, which is rotated at its size cap."""
+    log = LayoutSampleLog(tmp_path / "samples.jsonl", max_bytes=1)
+    with patch.object(layout_templates, "_sample_log", log):
+        for person in _PEOPLE:
+            record_layout_samples([_card(*person)], {"identity_document": [1]}, {"identity_document": _fields(*person)})
+
+    written = "".join(path.read_text() for path in tmp_path.iterdir())
+    for person in _PEOPLE:
+        assert not any(value in written for value in person)
+    assert not any(c.isdigit() for sample in log.read() for block in sample["blocks"] for c in block[4])
+    # Only the newest file and one rotated file are kept.
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["samples.jsonl", "samples.jsonl.1"]
+    assert len(log.read()) == 2
+
+
+def _summary(name: str) -> dict:
+    """Render a discharge summary naming the patient, as an extracted page."""
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 60), "CITY HOSPITAL - DISCHARGE SUMMARY", fontsize=14)
+    page.insert_text((72, 110), f"Patient: {name}", fontsize=11)
+    page.insert_text((72, 150), "Admission Date: 02/03/2024", fontsize=11)
+    page.insert_text((72, 180), "Diagnosis: Dengue fever", fontsize=11)
+    extracted = {"page_number": 2, "text": page.get_text("text").strip(), "blocks": page_blocks(page)}
+    doc.close()
+    return extracted
+
+
+def test_sample_log_redacts_every_page_type_and_skips_degraded(tmp_path):
+    """The patient's name and dates are kept off other pages too; degraded results are not logged."""
+    person = _PEOPLE[0]
+    log = LayoutSampleLog(tmp_path / "samples.jsonl")
+    discharge = {"admission_date": "02/03/2024", "diagnosis": "Dengue fever", "confidence": "medium"}
+    with patch.object(layout_templates, "_sample_log", log):
+        record_layout_samples(
+            [_card(*person), _summary(person[0])],
+            {"identity_document": [1], "discharge_summary": [2]},
+            {"identity_document": _fields(*person), "discharge_summary": discharge},
+        )
+        record_layout_samples(
+            [_summary(person[0])],
+            {"discharge_summary": [2]},
+            {"identity_document": {}, "discharge_summary": {**discharge, "degraded": True}},
+        )
+
+    written = (tmp_path / "samples.jsonl").read_text()
+    assert person[0] not in written and "02/03/2024" not in written
+    samples = log.read()
+    assert [sample["doc_type"] for sample in samples] == ["identity_document", "discharge_summary"]
+    assert set(samples[1]["fields"]) == {"admission_date", "diagnosis"}
+
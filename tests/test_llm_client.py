@@ -0,0 +1,545 @@
+"""Unit tests for the shared LLM client layers.
+
+The Cerebras transport is mocked here — these tests cover the local
+caching and traffic-control logic, not the model.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import httpx
+import pytest
+from cerebras.cloud.sdk import APITimeoutError, BadRequestError, RateLimitError
+
+from app.graph.nodes import llm_client
+from app.graph.nodes.llm_client import (
+    AdaptiveConcurrencyLimiter,
+    CircuitBreaker,
+    HedgePolicy,
+    IncrementalJSONParser,
+    LLMDeadlineExceededError,
+    LLMOverloadedError,
+    LLMResponseCache,
+    LLMStreamInterruptedError,
+    LLMUnavailableError,
+    RetryBudget,
+    SingleFlight,
+    TokenRateLimiter,
+    estimate_tokens,
+    llm_call_context,
+    make_cache_key,
+    prompt_version,
+)
+
+# ─── helpers ──────────────────────────────────────────────────────────────────
+
+
+_REQUEST = httpx.Request("POST", "https://api.cerebras.ai/v1/chat/completions")
+
+
+def _status_error(cls, status: int):
+    """Build an SDK status error for the given HTTP status."""
+    return cls(f"HTTP {status}", response=httpx.Response(status, request=_REQUEST), body=None)
+
+
+def _completion(content: str) -> SimpleNamespace:
+    """Build a minimal chat completion response object."""
+    message = SimpleNamespace(content=content)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+def _stream(*pieces: str) -> MagicMock:
+    """Build a completion stream that yields the given content deltas."""
+    chunks = [
+        SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=p))], usage=None)
+        for p in pieces
+    ]
+    stream = MagicMock()
+    stream.__iter__.return_value = iter(chunks)
+    return stream
+
+
+@pytest.fixture
+def fake_client():
+    """Patch the Cerebras client and give each test fresh client-side state."""
+    client = MagicMock()
+    with patch.object(llm_client, "get_cerebras_client", return_value=client), \
+         patch.object(llm_client, "_cache", LLMResponseCache(None)), \
+         patch.object(llm_client, "_singleflight", SingleFlight()), \
+         patch.object(llm_client, "_limiter", AdaptiveConcurrencyLimiter()), \
+         patch.object(llm_client, "_rate_limiter", TokenRateLimiter()), \
+         patch.object(llm_client, "_retry_budget", RetryBudget()), \
+         patch.object(llm_client, "_breaker", CircuitBreaker()), \
+         patch.object(llm_client, "_RETRY_BASE_DELAY", 0.0):
+        yield client
+
+
+# ─── Pooled clients ──────────────────────────────────────────────────────────
+
+
+def test_client_is_created_once_and_reused(monkeypatch):
+    """Every call shares one pooled client until it is closed."""
+    monkeypatch.setenv("CEREBRAS_API_KEY", "test-key")
+    monkeypatch.setattr(llm_client, "_client", None)
+
+    client = llm_client.get_cerebras_client()
+    assert llm_client.get_cerebras_client() is client
+
+    llm_client.close_llm_client()
+    assert llm_client._client is None
+    assert llm_client.get_cerebras_client() is not client
+    llm_client.close_llm_client()
+
+
+# ─── Response cache ──────────────────────────────────────────────────────────
+
+
+def test_cache_key_tracks_prompt_version():
+    """Editing the system prompt changes the key prefix and therefore the entry."""
+    req_a = llm_client._build_request("prompt A", "page text")
+    req_b = llm_client._build_request("prompt B", "page text")
+    assert make_cache_key(req_a) != make_cache_key(req_b)
+    assert make_cache_key(req_a).startswith(prompt_version("prompt A") + ":")
+    assert make_cache_key(req_a) == make_cache_key(llm_client._build_request("prompt A", "page text"))
+
+
+def test_cache_serves_repeat_calls(fake_client):
+    """An identical second call is answered from the memory tier."""
+    fake_client.chat.completions.create.return_value = _completion('{"document_type": "other"}')
+
+    first = llm_client.call_llm("sys", "text")
+    second = llm_client.call_llm("sys", "text")
+
+    assert first == second == '{"document_type": "other"}'
+    assert fake_client.chat.completions.create.call_count == 1
+    stats = llm_client.get_llm_stats()["cache"]
+    assert stats["memory_hits"] == 1 and stats["misses"] == 1
+
+
+def test_cache_skips_malformed_json(fake_client):
+    """Non-JSON answers are not cached so a retry can recover."""
+    fake_client.chat.completions.create.return_value = _completion("not json")
+    llm_client.call_llm("sys", "text")
+    llm_client.call_llm("sys", "text")
+    assert fake_client.chat.completions.create.call_count == 2
+
+
+def test_cache_disk_tier_and_eviction(tmp_path):
+    """Entries survive a new process via SQLite and the LRU tail is evicted."""
+    path = str(tmp_path / "cache.sqlite3")
+    cache = LLMResponseCache(path, memory_entries=1, disk_entries=2)
+    for i in range(3):
+        cache.put(f"v:{i}", f"value-{i}", "v")
+
+    reopened = LLMResponseCache(path)
+    assert reopened.get("v:0") is None, "Oldest entry should be evicted from disk"
+    assert reopened.get("v:2") == "value-2"
+    assert reopened.stats()["disk_hits"] == 1
+
+    reopened.invalidate_prompt_version("v")
+    assert reopened.get("v:2") is None
+
+
+def test_cache_ttl_expiry():
+    """Expired entries are treated as misses."""
+    cache = LLMResponseCache(None, ttl_seconds=-1)
+    cache.put("v:key", "value", "v")
+    assert cache.get("v:key") is None
+
+
+# ─── Single-flight coalescing ────────────────────────────────────────────────
+
+
+def test_singleflight_coalesces_threaded_callers(fake_client):
+    """Concurrent identical calls share one API request."""
+    release = threading.Event()
+
+    def slow_create(**_):
+        release.wait(timeout=5)
+        return _completion('{"document_type": "other"}')
+
+    fake_client.chat.completions.create.side_effect = slow_create
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futures = [pool.submit(llm_client.call_llm, "sys", "same page") for _ in range(4)]
+        while llm_client.get_llm_stats()["singleflight"]["coalesced"] < 3:
+            threading.Event().wait(0.01)
+        release.set()
+        results = [f.result(timeout=5) for f in futures]
+
+    assert set(results) == {'{"document_type": "other"}'}
+    assert fake_client.chat.completions.create.call_count == 1
+    assert llm_client.get_llm_stats()["singleflight"]["coalesced"] == 3
+
+
+def test_singleflight_shares_failures(fake_client):
+    """Followers see the leader's exception instead of retrying on their own."""
+    flight = llm_client._singleflight
+    future, leader = flight.join("k")
+    follower, is_leader = flight.join("k")
+    assert leader and not is_leader and follower is future
+
+    flight.reject("k", RuntimeError("boom"))
+    with pytest.raises(RuntimeError, match="boom"):
+        follower.result(timeout=1)
+    assert flight.stats()["in_flight"] == 0
+
+
+# ─── Adaptive concurrency limiter ────────────────────────────────────────────
+
+
+def test_limiter_grows_additively_and_backs_off():
+    """Healthy completions raise the limit; an overload halves it."""
+    limiter = AdaptiveConcurrencyLimiter(initial=4, minimum=1, maximum=64)
+    for _ in range(40):
+        limiter.acquire()
+        limiter.release(0.1, overloaded=False, failed=False)
+    grown = limiter.limit
+    assert grown > 4, f"Limit should grow with healthy traffic, got {grown}"
+
+    limiter.acquire()
+    limiter.release(0.1, overloaded=True, failed=True)
+    assert limiter.limit < grown, "An overload should cut the limit multiplicatively"
+
+
+def test_limiter_queues_over_limit():
+    """Callers beyond the limit wait and are granted slots in order."""
+    limiter = AdaptiveConcurrencyLimiter(initial=1, minimum=1, maximum=1)
+    limiter.acquire()
+    with pytest.raises(TimeoutError):
+        limiter.acquire(timeout=0.05)
+
+    acquired = threading.Event()
+    waiter = threading.Thread(target=lambda: (limiter.acquire(), acquired.set()))
+    waiter.start()
+    while limiter.stats()["queue_depth"] != 1:
+        threading.Event().wait(0.01)
+    limiter.release(0.1, overloaded=False, failed=False)
+    waiter.join(timeout=2)
+    assert acquired.is_set()
+    assert limiter.stats()["in_flight"] == 1
+
+
+# ─── Token rate limiter ──────────────────────────────────────────────────────
+
+
+def test_estimate_tokens_is_reasonable():
+    """The local estimate lands near the ~4 characters/token rule of thumb."""
+    text = "Room charges (5 days)     5 x 1000 = 5000\nMedicines (IV fluids)     1 x 2000 = 2000"
+    assert 15 <= estimate_tokens(text) <= 40
+    assert estimate_tokens("") == 0
+
+
+def test_estimate_cache_is_keyed_by_digest_and_bounded():
+    """Cached estimates hold digests, not text, and the cache stays under its size."""
+    with patch.object(llm_client, "_estimate_cache", llm_client.OrderedDict()) as cache, \
+         patch.object(llm_client, "_ESTIMATE_CACHE_SIZE", 2):
+        for text in ("Patient: Priya Sharma", "second page", "third page", "second page"):
+            estimate_tokens(text)
+        assert len(cache) == 2
+        assert all(isinstance(key, bytes) and len(key) == 16 for key in cache)
+        assert estimate_tokens("Patient: Priya Sharma") == llm_client._count_tokens("Patient: Priya Sharma")
+
+
+def test_rate_limiter_waits_instead_of_rejecting():
+    """Once the minute's tokens are spent, the next request is delayed."""
+    limiter = TokenRateLimiter(requests_per_minute=60, tokens_per_minute=600, max_wait=30)
+    request = llm_client._build_request("sys", "word " * 100)
+
+    first = limiter.reserve(request)
+    second = limiter.reserve(request)
+    assert first.delay == 0
+    assert second.delay > 0, "Second request should wait for token refill"
+
+    with pytest.raises(LLMOverloadedError):
+        TokenRateLimiter(tokens_per_minute=10, max_wait=1).reserve(request)
+
+
+def test_rate_limiter_reconciles_usage():
+    """Actual usage refunds over-reservation and recalibrates the estimate."""
+    limiter = TokenRateLimiter(tokens_per_minute=10_000)
+    request = llm_client._build_request("sys", "word " * 100)
+    reservation = limiter.reserve(request)
+    before = limiter.stats()["tokens_available"]
+
+    usage = SimpleNamespace(prompt_tokens=reservation.prompt_estimate * 2, completion_tokens=10)
+    limiter.reconcile(reservation, usage)
+
+    assert limiter.stats()["estimate_calibration"] > 1.0
+    assert limiter.estimate(request) > reservation.prompt_estimate
+    assert limiter.stats()["tokens_available"] != before
+
+
+def test_failed_requests_keep_their_quota(fake_client):
+    """A request that reached the API and failed is not refunded; one that never left is."""
+    fake_client.chat.completions.create.side_effect = _status_error(BadRequestError, 400)
+    limiter = TokenRateLimiter(requests_per_minute=60, tokens_per_minute=10_000)
+    with patch.object(llm_client, "_rate_limiter", limiter):
+        with pytest.raises(BadRequestError):
+            llm_client.call_llm("sys", "word " * 100)
+    stats = limiter.stats()
+    assert stats["requests_available"] < 60
+    assert 10_000 - stats["tokens_available"] >= limiter.estimate(llm_client._build_request("sys", "word " * 100))
+
+    reservation = limiter.reserve(llm_client._build_request("sys", "other"))
+    before = limiter.stats()["requests_available"]
+    limiter.cancel(reservation)
+    assert limiter.stats()["requests_available"] == pytest.approx(before + 1, abs=0.1)
+
+
+def test_rate_limit_backlog_degrades_the_node(fake_client):
+    """A quota backlog over the cap marks the classifier degraded, not a plain "other"."""
+    from app.graph.nodes import segregator
+
+    limiter = TokenRateLimiter(tokens_per_minute=10, max_wait=1)
+    with patch.object(llm_client, "_rate_limiter", limiter), \
+         patch.object(segregator, "STREAMING_ENABLED", False):
+        assert segregator._classify_page_isolated({"page_number": 1, "text": "word " * 100}) == ("other", True)
+    fake_client.chat.completions.create.assert_not_called()
+
+
+# ─── Hedged requests ─────────────────────────────────────────────────────────
+
+
+def _warm_hedger(latency: float = 0.01) -> HedgePolicy:
+    """A hedge policy with a full latency window and a generous budget."""
+    hedger = HedgePolicy(percentile=95, budget=1.0)
+    for _ in range(HedgePolicy._MIN_SAMPLES):
+        hedger.record(latency)
+    return hedger
+
+
+def test_hedge_wins_over_stuck_primary(fake_client):
+    """A slow primary is raced by one hedge, and the hedge's answer is used."""
+    release = threading.Event()
+    calls = []
+
+    def create(**_):
+        calls.append(1)
+        if len(calls) == 1:
+            release.wait(timeout=5)
+            return _completion('{"from": "primary"}')
+        return _completion('{"from": "hedge"}')
+
+    fake_client.chat.completions.create.side_effect = create
+    hedger = _warm_hedger()
+    with patch.object(llm_client, "_HEDGE_ENABLED", True), patch.object(llm_client, "_hedger", hedger):
+        result = llm_client.call_llm("sys", "slow page")
+    release.set()
+
+    assert result == '{"from": "hedge"}'
+    stats = hedger.stats()
+    assert stats["hedges"] == 1 and stats["hedge_wins"] == 1
+
+
+def test_hedge_respects_budget():
+    """No hedge is sent once hedges would exceed the budget fraction."""
+    hedger = HedgePolicy(percentile=95, budget=0.05)
+    for _ in range(HedgePolicy._MIN_SAMPLES):
+        hedger.record(0.01)
+    hedger.delay()
+    assert not hedger.try_spend(), "1 hedge out of 1 request is over a 5% budget"
+    for _ in range(40):
+        hedger.delay()
+    assert hedger.try_spend()
+
+
+# ─── Retries ─────────────────────────────────────────────────────────────────
+
+
+def test_retry_recovers_from_transient_errors(fake_client):
+    """A 429 followed by a timeout is retried until the call succeeds."""
+    fake_client.chat.completions.create.side_effect = [
+        _status_error(RateLimitError, 429),
+        APITimeoutError(request=_REQUEST),
+        _completion('{"document_type": "prescription"}'),
+    ]
+    assert llm_client.call_llm("sys", "page") == '{"document_type": "prescription"}'
+    assert fake_client.chat.completions.create.call_count == 3
+
+
+def test_retry_skips_permanent_errors(fake_client):
+    """A 400 is raised immediately without retrying."""
+    fake_client.chat.completions.create.side_effect = _status_error(BadRequestError, 400)
+    with pytest.raises(BadRequestError):
+        llm_client.call_llm("sys", "page")
+    assert fake_client.chat.completions.create.call_count == 1
+
+
+def test_retry_respects_claim_budget(fake_client):
+    """Once a claim's retries are spent, failures surface on the first attempt."""
+    fake_client.chat.completions.create.side_effect = _status_error(RateLimitError, 429)
+    with llm_call_context("CLM-BUDGET") as context:
+        context.retries_left = 1
+        with pytest.raises(RateLimitError):
+            llm_client.call_llm("sys", "page one")
+        with pytest.raises(RateLimitError):
+            llm_client.call_llm("sys", "page two")
+
+    # 2 attempts for the first call (1 retry), then 1 attempt for the second.
+    assert fake_client.chat.completions.create.call_count == 3
+    assert llm_client.get_llm_stats()["retries"]["claim_budget_exhausted"] >= 1
+
+
+# ─── Circuit breaker ─────────────────────────────────────────────────────────
+
+
+def test_breaker_opens_and_fails_fast(fake_client):
+    """Repeated transient failures open the circuit; later calls never hit the API."""
+    fake_client.chat.completions.create.side_effect = APITimeoutError(request=_REQUEST)
+    with patch.object(llm_client, "_breaker", CircuitBreaker(failure_threshold=2, recovery_seconds=60)), \
+         patch.object(llm_client, "_RETRY_MAX_ATTEMPTS", 1):
+        for i in range(2):
+            with pytest.raises(APITimeoutError):
+                llm_client.call_llm("sys", f"page {i}")
+        with pytest.raises(LLMUnavailableError) as excinfo:
+            llm_client.call_llm("sys", "page 3")
+
+    assert excinfo.value.retry_after > 0
+    assert fake_client.chat.completions.create.call_count == 2
+
+
+def test_breaker_half_open_probe_closes_circuit():
+    """After the recovery period one probe is admitted; success closes the circuit."""
+    breaker = CircuitBreaker(failure_threshold=1, recovery_seconds=0)
+    breaker.record_failure(APITimeoutError(request=_REQUEST))
+    assert breaker.state == CircuitBreaker.OPEN
+
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(LLMUnavailableError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_segregator_marks_degraded_when_circuit_open():
+    """Open-circuit pages default to 'other' and the node reports itself degraded."""
+    from app.graph.nodes import segregator
+
+    state = {"claim_id": "CLM-OPEN", "pages": [{"page_number": 1, "text": "Patient notes, page 1"}]}
+    with patch.object(segregator, "call_llm", side_effect=LLMUnavailableError(30)):
+        result = segregator.segregator_node(state)
+
+    assert result["classified_pages"] == {"other": [1]}
+    assert result["degraded_nodes"] == ["segregator"]
+
+
+# ─── Deadlines ───────────────────────────────────────────────────────────────
+
+
+def test_deadline_caps_request_timeout(fake_client):
+    """Each request's timeout is the time left on the claim deadline."""
+    fake_client.chat.completions.create.return_value = _completion('{"ok": 1}')
+
+    with llm_call_context("claim-d", deadline=time.monotonic() + 5):
+        llm_client.call_llm("sys", "text")
+
+    timeout = fake_client.chat.completions.create.call_args.kwargs["timeout"]
+    assert 4 < timeout <= 5
+
+
+def test_deadline_skips_calls_but_serves_cache(fake_client):
+    """With no time left, only cached answers are returned."""
+    fake_client.chat.completions.create.return_value = _completion('{"ok": 1}')
+    llm_client.call_llm("sys", "cached")
+
+    with llm_call_context("claim-d", deadline=time.monotonic() + 0.1) as context:
+        assert llm_client.call_llm("sys", "cached") == '{"ok": 1}'
+        with pytest.raises(LLMDeadlineExceededError):
+            llm_client.call_llm("sys", "fresh")
+
+    assert context.deadline_exceeded
+    assert fake_client.chat.completions.create.call_count == 1
+    assert llm_client.get_llm_stats()["circuit_breaker"]["consecutive_failures"] == 0
+
+
+def test_deadline_stops_retries(fake_client):
+    """A retry whose backoff would outlast the deadline is not attempted."""
+    fake_client.chat.completions.create.side_effect = _status_error(RateLimitError, 429)
+
+    with patch.object(llm_client, "_backoff_delay", return_value=5.0), \
+         llm_call_context("claim-d", deadline=time.monotonic() + 3):
+        with pytest.raises(LLMDeadlineExceededError):
+            llm_client.call_llm("sys", "text")
+
+    assert fake_client.chat.completions.create.call_count == 1
+
+
+def test_slot_wait_timeout_is_overload_until_the_deadline(fake_client):
+    """A full limiter is reported as overload while the claim has time, then as the deadline."""
+    fake_client.chat.completions.create.return_value = _completion('{"ok": 1}')
+    limiter = AdaptiveConcurrencyLimiter(initial=1, minimum=1, maximum=1)
+    limiter.acquire()
+
+    with patch.object(llm_client, "_limiter", limiter), patch.object(llm_client, "_REQUEST_TIMEOUT", 0.05), \
+         llm_call_context("claim-d", deadline=time.monotonic() + 5) as context:
+        with pytest.raises(LLMOverloadedError):
+            llm_client.call_llm("sys", "text")
+    assert not context.deadline_exceeded
+
+    with patch.object(llm_client, "_limiter", limiter), patch.object(llm_client, "_DEADLINE_MIN_CALL_SECONDS", 0.5), \
+         llm_call_context("claim-d", deadline=time.monotonic() + 0.55) as context:
+        with pytest.raises(LLMDeadlineExceededError):
+            llm_client.call_llm("sys", "text")
+    assert context.deadline_exceeded
+    fake_client.chat.completions.create.assert_not_called()
+
+
+# ─── Streaming completions ───────────────────────────────────────────────────
+
+
+def test_incremental_parser_streams_items_across_chunk_boundaries():
+    """Array items and scalar fields surface as soon as they close."""
+    doc = '```json\n{"items": [{"d": "a \\"}]"}, {"d": "b"}], "calculated_total": 12.5}\n```'
+    for step in (1, 4, len(doc)):
+        parser = IncrementalJSONParser(item_keys=("items",))
+        items = []
+        for i in range(0, len(doc), step):
+            items += parser.feed(doc[i:i + step])
+        assert items == [{"d": 'a "}]'}, {"d": "b"}]
+        assert parser.done and parser.fields["calculated_total"] == 12.5
+
+
+def test_incremental_parser_reports_required_fields_early():
+    """A field is available before the object is closed."""
+    parser = IncrementalJSONParser()
+    parser.feed('{"document_type": "itemized_bill"')
+    assert parser.has_fields(("document_type",)) and not parser.done
+
+
+def test_stream_stops_once_required_fields_arrive(fake_client):
+    """The stream is closed after the answer field, and the result cached."""
+    stream = _stream('{"document_', 'type": "prescription"', ', "padding": "never read"}')
+    fake_client.chat.completions.create.return_value = stream
+
+    first = llm_client.call_llm_json_stream("sys", "text", required_fields=("document_type",))
+    second = llm_client.call_llm_json_stream("sys", "text", required_fields=("document_type",))
+
+    assert first == second == {"document_type": "prescription"}
+    stream.close.assert_called_once()
+    assert fake_client.chat.completions.create.call_count == 1
+    assert fake_client.chat.completions.create.call_args.kwargs["stream"] is True
+
+
+def test_stream_failure_after_items_is_not_retried(fake_client):
+    """Items already handed out must not be replayed by a retry."""
+    stream = _stream('{"items": [1, 2,')
+    stream.__iter__.return_value = _failing_after(stream.__iter__.return_value)
+    fake_client.chat.completions.create.return_value = stream
+    seen = []
+
+    with pytest.raises(LLMStreamInterruptedError):
+        llm_client.call_llm_json_stream("sys", "text", item_key="items", on_item=seen.append)
+
+    assert seen == [1, 2]
+    assert fake_client.chat.completions.create.call_count == 1
+
+
+def _failing_after(chunks):
+    """Yield ``chunks`` and then raise a transient timeout."""
+    yield from chunks
+    raise APITimeoutError(request=_REQUEST)
+
@@ -0,0 +1,429 @@
+"""Unit tests for page classification in the segregator node.
+
+The LLM is mocked here — these tests cover how pages are scheduled,
+ordered and isolated, and the keyword rules in front of the LLM, not
+the model's labels.
+"""
+
+import json
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from app.graph.nodes import segregator
+from app.graph.nodes.llm_client import get_call_context, llm_call_context
+from app.services import page_fingerprint, text_classifier
+from app.services.page_fingerprint import PageFingerprintIndex, simhash
+from app.services.page_rules import DEFAULT_RULES, PageRuleClassifier
+from app.services.page_runs import continuation_score
+from app.services.text_classifier import LabelLog, split_holdout, tokenize
+
+# ─── helpers ──────────────────────────────────────────────────────────────────
+
+
+@pytest.fixture(autouse=True)
+def isolated_local_model(tmp_path):
+    """Log labels to a temp file and start without a trained local model or fingerprints."""
+    with patch.object(text_classifier, "_label_log", LabelLog(tmp_path / "labels.jsonl")), \
+         patch.object(page_fingerprint, "_index", PageFingerprintIndex(None)), \
+         patch.object(text_classifier, "_model", None), \
+         patch.object(text_classifier, "_model_loaded", True):
+        yield tmp_path / "labels.jsonl"
+
+
+def _state(*texts: str) -> dict:
+    """Build a minimal segregator state with one page per text."""
+    pages = [{"page_number": i, "text": text} for i, text in enumerate(texts, start=1)]
+    return {"claim_id": "CLM-SEG", "pages": pages}
+
+
+def _answer(doc_type: str) -> str:
+    """Build the LLM's JSON answer for a document type."""
+    return json.dumps({"document_type": doc_type})
+
+
+# ─── Concurrent classification ───────────────────────────────────────────────
+
+
+def test_pages_are_classified_concurrently_in_page_order():
+    """Slow calls overlap, and page numbers still come back in order."""
+    active = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def fake_call(_prompt, text):
+        nonlocal active, peak
+        with lock:
+            active += 1
+            peak = max(peak, active)
+        # Earlier pages finish last, so completion order is reversed.
+        time.sleep(0.01 * (10 - int(text.split()[-1])))
+        with lock:
+            active -= 1
+        return _answer("prescription")
+
+    state = _state(*(f"page {i}" for i in range(1, 10)))
+    with patch.object(segregator, "_CLASSIFY_CONCURRENCY", 4), \
+         patch.object(segregator, "call_llm", side_effect=fake_call):
+        result = segregator.segregator_node(state)
+
+    assert result["classified_pages"] == {"prescription": list(range(1, 10))}
+    assert 1 < peak <= 4
+
+
+def test_page_failure_is_isolated():
+    """One failing page falls back to 'other' without affecting the rest."""
+
+    def fake_call(_prompt, text):
+        if text == "broken":
+            raise RuntimeError("boom")
+        return _answer("itemized_bill")
+
+    with patch.object(segregator, "call_llm", side_effect=fake_call):
+        result = segregator.segregator_node(_state("bill", "broken", "bill"))
+
+    assert result["classified_pages"] == {"itemized_bill": [1, 3], "other": [2]}
+    assert "degraded_nodes" not in result
+
+
+def test_worker_threads_see_the_claim_context():
+    """Pool threads inherit the claim's LLM call context."""
+    seen = []
+
+    def fake_call(_prompt, _text):
+        seen.append(get_call_context().claim_id)
+        return _answer("other")
+
+    with llm_call_context("CLM-CTX"), patch.object(segregator, "call_llm", side_effect=fake_call):
+        segregator.segregator_node(_state("a", "b", "c"))
+
+    assert seen == ["CLM-CTX"] * 3
+
+
+# ─── Batched classification ──────────────────────────────────────────────────
+
+
+def test_batches_pack_pages_and_reask_only_missing():
+    """Pages share a request; a page missing from the answer is re-asked alone."""
+    prompts = []
+
+    def fake_call(prompt, content):
+        assert prompt == segregator.BATCH_SYSTEM_PROMPT
+        prompts.append(content)
+        if len(prompts) == 1:
+            # Page 3 is dropped and page 2 gets an invalid type.
+            return json.dumps([
+                {"page_number": 1, "document_type": "itemized_bill"},
+                {"page_number": 2, "document_type": "invoice"},
+            ])
+        return json.dumps([
+            {"page_number": 2, "document_type": "itemized_bill"},
+            {"page_number": 3, "document_type": "discharge_summary"},
+        ])
+
+    with patch.object(segregator, "_BATCH_TOKENS", 10_000), \
+         patch.object(segregator, "call_llm", side_effect=fake_call):
+        result = segregator.segregator_node(_state("bill", "bill cont.", "summary"))
+
+    assert result["classified_pages"] == {"itemized_bill": [1, 2], "discharge_summary": [3]}
+    assert len(prompts) == 2
+    assert "=== PAGE 1 ===" not in prompts[1] and "=== PAGE 3 ===" in prompts[1]
+
+
+def test_batch_labels_reject_duplicates_and_unknown_pages():
+    """A page labelled twice counts as missing; unknown pages are ignored."""
+    raw = json.dumps([
+        {"page_number": 1, "document_type": "prescription"},
+        {"page_number": 1, "document_type": "other"},
+        {"page_number": "2", "document_type": "prescription"},
+        {"page_number": 9, "document_type": "prescription"},
+    ])
+    assert segregator._parse_batch_labels(raw, {1, 2}) == {2: "prescription"}
+
+
+def test_batch_falls_back_to_single_pages_on_unusable_answer():
+    """If a batch answer labels nothing, each page is classified on its own."""
+
+    def fake_call(prompt, _content):
+        if prompt == segregator.BATCH_SYSTEM_PROMPT:
+            return json.dumps({"error": "unsupported"})
+        return _answer("prescription")
+
+    with patch.object(segregator, "_BATCH_TOKENS", 10_000), \
+         patch.object(segregator, "call_llm", side_effect=fake_call) as mock_call:
+        result = segregator.segregator_node(_state("rx one", "rx two"))
+
+    assert result["classified_pages"] == {"prescription": [1, 2]}
+    assert mock_call.call_count == 3
+
+
+def test_pack_batches_respects_token_budget():
+    """Consecutive pages fill a batch until the budget would be exceeded."""
+    pages = _state(*("word " * 40 for _ in range(5)))["pages"]
+    with patch.object(segregator, "_BATCH_TOKENS", 100):
+        batches = segregator._pack_batches(pages)
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+
+
+# ─── Rule-based pre-classification ───────────────────────────────────────────
+
+
+def test_rules_label_unambiguous_pages_without_llm():
+    """Clear pages are labeled by rules; only the ambiguous one reaches the LLM."""
+    state = _state(
+        "DISCHARGE SUMMARY\nDiagnosis: Dengue\nDate of Admission: 10-Jan-2024",
+        "BANK ACCOUNT DETAILS\nIFSC Code: HDFC0001234\nCANCELLED CHEQUE ATTACHED",
+        "Visiting hours are 10 AM to 8 PM.",
+    )
+    with patch.object(segregator, "call_llm", return_value=_answer("other")) as mock_call:
+        result = segregator.segregator_node(state)
+
+    assert result["classified_pages"] == {
+        "discharge_summary": [1],
+        "cheque_or_bank_details": [2],
+        "other": [3],
+    }
+    assert mock_call.call_count == 1
+
+
+def test_rules_defer_mixed_evidence():
+    """Pages with competing evidence stay below the threshold."""
+    classifier = PageRuleClassifier()
+    verdict = classifier.classify("PRESCRIPTION\nRx: Tab Paracetamol\nPAYMENT RECEIPT\nReceived from: A. Patient")
+    assert verdict.doc_type is None
+    assert verdict.scores["prescription"] > 0 and verdict.scores["cash_receipt"] > 0
+
+
+def test_rule_stats_count_hits_per_rule():
+    """Each matching rule is counted once per page."""
+    classifier = PageRuleClassifier()
+    classifier.classify("AADHAAR CARD\nAadhaar No: 1234 5678 9012\nAadhaar")
+    classifier.classify("nothing to see here")
+
+    stats = classifier.stats()
+    assert stats["pages"] == 2 and stats["labeled"] == 1 and stats["deferred"] == 1
+    assert stats["rule_hits"]["aadhaar_keyword"] == 1
+    assert stats["labeled_by_type"] == {"identity_document": 1}
+
+
+def test_default_rules_target_allowed_types():
+    """Every rule points at a type the segregator accepts."""
+    assert {rule.doc_type for rule in DEFAULT_RULES} <= segregator.ALLOWED_TYPES
+
+
+# ─── Near-duplicate fingerprints ─────────────────────────────────────────────
+
+_FORM = (
+    "CITY HOSPITAL PRE-ADMISSION NOTE Patient name: {name} Age: {age} "
+    "Referred by Dr. {doctor} for evaluation on {date} Ward {ward} bed {bed}"
+)
+
+
+def _form(name: str, age: int, doctor: str, date: str, ward: int, bed: int) -> str:
+    """Fill the shared hospital form template."""
+    return _FORM.format(name=name, age=age, doctor=doctor, date=date, ward=ward, bed=bed)
+
+
+def test_simhash_ignores_digits_and_whitespace():
+    """Masked numbers and reflowed spacing give the same fingerprint."""
+    assert simhash("Invoice 1234 total   due\n 5678 " * 3) == simhash("invoice 9999 TOTAL due 0000 " * 3)
+    assert simhash("too short to fingerprint") is None
+
+
+def test_near_duplicate_page_reuses_llm_label():
+    """A second copy of a form with a different patient skips the LLM."""
+    first = _form("Ramesh Kumar", 45, "Mehta", "01/02/2024", 3, 12)
+    second = _form("Ramesh Kumar", 61, "Mehta", "17/09/2024", 7, 4)
+    with patch.object(segregator, "call_llm", return_value=_answer("other")) as mock_call:
+        segregator.segregator_node(_state(first))
+        result = segregator.segregator_node(_state(second))
+
+    assert result["classified_pages"] == {"other": [1]}
+    assert mock_call.call_count == 1
+
+
+def test_fingerprint_index_matches_within_distance_only():
+    """Banded search finds fingerprints a few bits away but not further."""
+    index = PageFingerprintIndex(None, max_distance=3)
+    text = _form("Asha Rao", 30, "Iyer", "02/03/2024", 1, 2)
+    index.store(text, "claim_forms")
+    fingerprint = simhash(text)
+
+    with patch.object(page_fingerprint, "simhash", return_value=fingerprint ^ 0b101):
+        assert index.lookup(text) == "claim_forms"
+    with patch.object(page_fingerprint, "simhash", return_value=fingerprint ^ 0xF0F0):
+        assert index.lookup(text) is None
+
+
+def test_fingerprint_index_evicts_lru_and_persists(tmp_path):
+    """The least recently used entry is evicted, on disk as well."""
+    path = str(tmp_path / "fp.sqlite3")
+    index = PageFingerprintIndex(path, max_entries=2)
+    pages = [" ".join(f"{word}{n}" for n in range(10)) for word in ("alpha", "beta", "gamma")]
+    index.store(pages[0], "prescription")
+    index.store(pages[1], "cash_receipt")
+    assert index.lookup(pages[0]) == "prescription"
+    index.store(pages[2], "itemized_bill")
+
+    reloaded = PageFingerprintIndex(path, max_entries=2)
+    assert reloaded.lookup(pages[1]) is None
+    assert reloaded.lookup(pages[0]) == "prescription"
+    assert reloaded.lookup(pages[2]) == "itemized_bill"
+    assert index.stats()["evictions"] == 1
+
+
+# ─── Excerpt classification ──────────────────────────────────────────────────
+
+_LONG_BILL = "\n".join(
+    ["CITY HOSPITAL", "Patient: A. Rao"] + [f"Line item {n} consumables 1 x 100 = 100" for n in range(200)]
+)
+
+
+def test_excerpt_sends_head_and_tail_only():
+    """A long page is classified from its first and last lines."""
+    with patch.object(segregator, "_HEAD_TOKENS", 40), \
+         patch.object(segregator, "call_llm", return_value=_answer("itemized_bill")) as mock_call:
+        assert segregator.classify_page(_LONG_BILL) == "itemized_bill"
+
+    sent = mock_call.call_args.args[1]
+    assert sent.startswith("CITY HOSPITAL") and "[...]" in sent
+    assert sent.endswith("Line item 199 consumables 1 x 100 = 100")
+    assert len(sent) < len(_LONG_BILL) / 10
+
+
+def test_excerpt_escalates_on_other_and_rule_contradiction():
+    """'other', or a type the rules see no evidence for, re-asks with the full page."""
+    for excerpt_answer in ("other", "prescription"):
+        answers = iter([_answer(excerpt_answer), _answer("itemized_bill")])
+        with patch.object(segregator, "_HEAD_TOKENS", 40), \
+             patch.object(segregator, "call_llm", side_effect=lambda *_: next(answers)) as mock_call:
+            assert segregator.classify_page(_LONG_BILL) == "itemized_bill"
+        assert mock_call.call_count == 2
+        assert mock_call.call_args.args[1] == _LONG_BILL
+
+
+def test_short_page_is_sent_in_full():
+    """Pages within the excerpt budget skip the excerpt step."""
+    with patch.object(segregator, "_HEAD_TOKENS", 40), \
+         patch.object(segregator, "call_llm", return_value=_answer("other")) as mock_call:
+        segregator.classify_page("Short note")
+    mock_call.assert_called_once()
+
+
+# ─── Run-length propagation ──────────────────────────────────────────────────
+
+
+def test_continuation_score_uses_markers_and_headers():
+    """Page markers decide; otherwise a shared running header plus similar content links pages."""
+    assert continuation_score("Ledger\nPage 1 of 3", "Ledger\nPage 2 of 3") == 1.0
+    assert continuation_score("Ledger\nPage 2 of 3", "Ledger\nPage 1 of 2") == 0.0
+    assert continuation_score("Ledger\nPage 2 of 3", "Ledger\nPage 3 of 5") == 0.0
+    header = "SUNRISE MULTISPECIALITY HOSPITAL\nIP No. {}\n"
+    assert continuation_score(header.format(101) + "Ward A", header.format(102) + "Ward B") >= 0.8
+    assert continuation_score("Blood sugar fasting 92", "Received with thanks rupees") < 0.8
+    assert continuation_score("", "anything") == 0.0
+
+
+_LETTERHEAD = "CITY CARE MULTISPECIALITY HOSPITAL\n12 MG Road, Bangalore - 560001\nPatient: Priya Sharma   IP No: 4471\n"
+_LETTERHEAD_BILL = _LETTERHEAD + (
+    "ITEMIZED BILL\nDescription Qty Rate Amount\nRoom Charges 3 2500 7500\nConsultation 1 800 800\nTotal 8300"
+)
+_LETTERHEAD_SUMMARY = _LETTERHEAD + (
+    "DISCHARGE SUMMARY\nDate of Admission: 01-03-2024\nDiagnosis: Dengue fever\nCondition at discharge: stable"
+)
+
+
+def test_shared_letterhead_alone_does_not_continue_a_run():
+    """A discharge summary after a bill on the same letterhead is classified on its own."""
+    assert continuation_score(_LETTERHEAD_BILL, _LETTERHEAD_SUMMARY) < 0.8
+    answers = iter([_answer("itemized_bill"), _answer("discharge_summary")])
+    with patch.object(segregator, "_RUN_MODE", True), \
+         patch.object(segregator, "PAGE_RULES_ENABLED", False), \
+         patch.object(segregator, "call_llm", side_effect=lambda *_: next(answers)) as mock_call:
+        result = segregator.segregator_node(_state(_LETTERHEAD_BILL, _LETTERHEAD_SUMMARY))
+
+    assert result["classified_pages"] == {"itemized_bill": [1], "discharge_summary": [2]}
+    assert mock_call.call_count == 2
+
+
+def test_run_mode_classifies_only_the_first_page_of_a_run():
+    """A ten-page ledger costs one call; a new document starts a new run."""
+    ledger = [f"SUNRISE HOSPITAL LEDGER\nPage {n} of 10\nentry {n}" for n in range(1, 11)]
+    answers = iter([_answer("other"), _answer("prescription")])
+    with patch.object(segregator, "_RUN_MODE", True), \
+         patch.object(segregator, "call_llm", side_effect=lambda *_: next(answers)) as mock_call:
+        result = segregator.segregator_node(_state(*ledger, "Dr. Rao clinic follow-up notes"))
+
+    assert result["classified_pages"] == {"other": list(range(1, 11)), "prescription": [11]}
+    assert mock_call.call_count == 2
+
+
+def test_run_mode_follows_a_locally_labeled_first_page():
+    """Continuation pages inherit a type set by the keyword rules."""
+    pages = [
+        "DISCHARGE SUMMARY\nPage 1 of 2\nDate of Admission: 01/01/2024\nDiagnosis: Dengue",
+        "Continued\nPage 2 of 2\nAdvised rest and fluids",
+    ]
+    with patch.object(segregator, "_RUN_MODE", True), patch.object(segregator, "call_llm") as mock_call:
+        result = segregator.segregator_node(_state(*pages))
+
+    assert result["classified_pages"] == {"discharge_summary": [1, 2]}
+    mock_call.assert_not_called()
+
+
+# ─── Local text classifier ───────────────────────────────────────────────────
+
+
+def test_llm_labels_are_logged_for_training(isolated_local_model):
+    """Pages the LLM classifies become training examples; rule-labeled ones do not."""
+    state = _state("Patient notes, page 1", "DISCHARGE SUMMARY\nDiagnosis: Dengue\nDate of Admission: 1-Jan")
+    with patch.object(segregator, "call_llm", return_value=_answer("prescription")):
+        segregator.segregator_node(state)
+
+    assert LabelLog(isolated_local_model).read() == [("Patient notes, page 1", "prescription")]
+
+
+def test_label_log_rotates_at_its_size_cap(tmp_path):
+    """A full label log is moved aside once, so at most two files are kept."""
+    log = LabelLog(tmp_path / "labels.jsonl", max_bytes=1)
+    for i in range(3):
+        log.append(f"page {i}", "other")
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["labels.jsonl", "labels.jsonl.1"]
+    assert log.read() == [("page 1", "other"), ("page 2", "other")]
+
+
+def test_tokenize_masks_digits_and_adds_bigrams():
+    """Numbers are masked so IDs and amounts generalise across claims."""
+    assert tokenize("Bill No 4521") == ["bill", "no", "0", "bill no", "no 0"]
+
+
+def test_holdout_split_is_stable():
+    """The same texts are held out on every run."""
+    examples = [(f"page {i}", "other") for i in range(200)]
+    _, held_a = split_holdout(examples, 0.2)
+    _, held_b = split_holdout(list(reversed(examples)), 0.2)
+    assert sorted(held_a) == sorted(held_b) and 10 < len(held_a) < 70
+
+
+def test_local_model_trains_saves_and_skips_llm(tmp_path):
+    """A confident local prediction labels the page without an LLM call."""
+    bills = [f"hospital bill room charges {i} pharmacy charges total amount {i}" for i in range(30)]
+    rx = [f"prescription tab paracetamol {i} dosage after food review {i}" for i in range(30)]
+    model = text_classifier.TextClassifier.fit(bills + rx, ["itemized_bill"] * 30 + ["prescription"] * 30)
+    model.save(tmp_path / "model.npz")
+    loaded = text_classifier.TextClassifier.load(tmp_path / "model.npz")
+
+    assert loaded.predict("room charges pharmacy charges total amount 99")[0] == "itemized_bill"
+    assert loaded.predict("zzz qqq")[1] == 0.0
+    report = text_classifier.evaluate(loaded, [(rx[0], "prescription"), (bills[0], "itemized_bill")])
+    assert report["accuracy"] == 1.0
+
+    with patch.object(text_classifier, "_model", loaded), \
+         patch.object(segregator, "call_llm") as mock_call:
+        result = segregator.segregator_node(_state("tab paracetamol dosage after food review"))
+    assert result["classified_pages"] == {"prescription": [1]}
+    mock_call.assert_not_called()
+